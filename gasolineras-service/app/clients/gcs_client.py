@@ -1,28 +1,58 @@
 """Cliente de persistencia a Google Cloud Storage."""
-import io
 import importlib
+from typing import Iterable
+
+# Trozo de la subida reanudable: lo maximo que se retiene en memoria antes de enviarlo
+# (multiplo de 256 KiB, como exige GCS).
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def write_parquet_batches(sink, batches: Iterable[dict[str, list]], schema, compression: str) -> int:
+    """
+    Escribe en `sink` cada lote de columnas como un row group y devuelve las filas
+    escritas. Solo se retiene en memoria el lote en curso.
+    """
+    pyarrow = importlib.import_module("pyarrow")
+    parquet = importlib.import_module("pyarrow.parquet")
+
+    rows = 0
+    with parquet.ParquetWriter(sink, schema, compression=compression) as writer:
+        for columns in batches:
+            batch = pyarrow.record_batch(columns, schema=schema)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
 
 
 class GCSClient:
-    def upload_parquet(
+    def upload_parquet_batches(
         self,
-        records: list[dict],
+        batches: Iterable[dict[str, list]],
+        schema,
         bucket_name: str,
         blob_path: str,
         compression: str,
-    ) -> str:
-        pyarrow = importlib.import_module("pyarrow")
-        parquet = importlib.import_module("pyarrow.parquet")
+    ) -> tuple[str, int]:
+        """
+        Sube un Parquet escrito lote a lote con una subida reanudable. Se escribe en un
+        objeto `.partial` y se copia al destino al terminar: si el export falla a medias
+        no se sustituye el fichero bueno anterior por uno truncado.
+        """
         storage = importlib.import_module("google.cloud.storage")
 
-        table = pyarrow.Table.from_pylist(records)
-        buffer = io.BytesIO()
-        parquet.write_table(table, buffer, compression=compression)
-        buffer.seek(0)
-
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(blob_path)
-        blob.upload_from_file(buffer, content_type="application/octet-stream")
+        bucket = storage.Client().bucket(bucket_name)
+        partial = bucket.blob(f"{blob_path}.partial")
+        try:
+            with partial.open(
+                "wb",
+                chunk_size=UPLOAD_CHUNK_BYTES,
+                content_type="application/octet-stream",
+                ignore_flush=True,
+            ) as sink:
+                rows = write_parquet_batches(sink, batches, schema, compression)
+            bucket.copy_blob(partial, bucket, blob_path)
+        finally:
+            if partial.exists():
+                partial.delete()
 
-        return f"gs://{bucket_name}/{blob_path}"
+        return f"gs://{bucket_name}/{blob_path}", rows
@@ -1,10 +1,28 @@
 """Cliente de fuente externa Ministerio de Energia."""
-from app.services.fetch_gobierno import fetch_data_gobierno, parse_float
+from typing import Iterator, Optional
+
+from app.services.fetch_gobierno import (
+    UpstreamNotModified,
+    fetch_data_gobierno,
+    horario_cache_stats,
+    parse_float,
+    stream_data_gobierno,
+)
+from app.services.sync_metrics import StageTimings
 
 
 class GobiernoClient:
     def fetch_gasolineras(self) -> list[dict]:
         return fetch_data_gobierno()
 
+    def iter_gasolineras(
+        self,
+        meta: Optional[dict] = None,
+        validators: Optional[dict] = None,
+        timings: Optional[StageTimings] = None,
+    ) -> Iterator[dict]:
+        """Descarga la respuesta y devuelve las gasolineras parseadas por trozos (ver `stream_data_gobierno`)."""
+        return stream_data_gobierno(meta, validators, timings)
+
 
-__all__ = ["GobiernoClient", "parse_float"]
+__all__ = ["GobiernoClient", "UpstreamNotModified", "horario_cache_stats", "parse_float"]
@@ -25,6 +25,8 @@ class Settings:
     auto_sync_on_read: bool
     auto_sync_cooldown_minutes: int
     auto_ensure_fresh_on_startup: bool
+    snapshot_refresh_interval_s: int
+    snapshot_version_ttl_s: float
 
     historical_scope: str
     history_retention_days: int
@@ -35,6 +37,13 @@ class Settings:
     raw_export_parquet_compression: str
 
     force_memory_mode: bool
+    memory_snapshot_dir: str
+
+    response_cache_max_entries: int
+    tiles_cache_max_age_s: int
+    snapshot_load_method: str
+    snapshot_sync_mode: str
+    sync_lock_wait_s: float
 
     @classmethod
     def from_env(cls) -> "Settings":
@@ -54,6 +63,8 @@ class Settings:
             auto_sync_on_read=_as_bool(os.getenv("AUTO_SYNC_ON_READ", "false"), default=False),
             auto_sync_cooldown_minutes=max(1, int(os.getenv("AUTO_SYNC_COOLDOWN_MINUTES", "30"))),
             auto_ensure_fresh_on_startup=_as_bool(os.getenv("AUTO_ENSURE_FRESH_ON_STARTUP", "true"), default=True),
+            snapshot_refresh_interval_s=max(0, int(os.getenv("SNAPSHOT_REFRESH_INTERVAL_S", "600"))),
+            snapshot_version_ttl_s=max(0.0, float(os.getenv("SNAPSHOT_VERSION_TTL_S", "5"))),
             historical_scope=(os.getenv("HISTORICAL_SCOPE", "all") or "all").strip().lower(),
             history_retention_days=max(1, int(os.getenv("HISTORY_RETENTION_DAYS", "30"))),
             raw_export_enabled=_as_bool(os.getenv("RAW_EXPORT_ENABLED", "false"), default=False),
@@ -61,6 +72,12 @@ class Settings:
             raw_export_gcs_prefix=(os.getenv("RAW_EXPORT_GCS_PREFIX") or "raw/").strip() or "raw/",
             raw_export_parquet_compression=(os.getenv("RAW_EXPORT_PARQUET_COMPRESSION") or "snappy").strip() or "snappy",
             force_memory_mode=_as_bool(os.getenv("FORCE_MEMORY_MODE", "false"), default=False),
+            memory_snapshot_dir=(os.getenv("MEMORY_SNAPSHOT_DIR") or "").strip(),
+            response_cache_max_entries=max(0, int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))),
+            tiles_cache_max_age_s=max(0, int(os.getenv("TILES_CACHE_MAX_AGE_S", "300"))),
+            snapshot_load_method=(os.getenv("SNAPSHOT_LOAD_METHOD") or "copy").strip().lower(),
+            snapshot_sync_mode=(os.getenv("SNAPSHOT_SYNC_MODE") or "incremental").strip().lower(),
+            sync_lock_wait_s=max(0.0, float(os.getenv("SYNC_LOCK_WAIT_S", "20"))),
         )
 
 
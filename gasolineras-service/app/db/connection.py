@@ -116,6 +116,18 @@ def get_cursor(conn):
     return conn.cursor(cursor_factory=RealDictCursor)
 
 
+def get_named_cursor(conn, name: str, itersize: int = 2000):
+    """
+    Cursor de servidor (DECLARE ... CURSOR) que trae filas por lotes de `itersize`
+    en lugar de cargar todo el resultado en memoria del cliente.
+    """
+    if RealDictCursor is None:
+        raise RuntimeError("RealDictCursor no disponible (psycopg2 no instalado)")
+    cur = conn.cursor(name=name, cursor_factory=RealDictCursor)
+    cur.itersize = itersize
+    return cur
+
+
 # -------------------------------------------------------------------
 # Ciclo de vida (compatibilidad con main.py)
 # -------------------------------------------------------------------
@@ -5,7 +5,7 @@ desde la fuente oficial del Gobierno de España.
 """
 import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 from app.routes.gasolineras import (
@@ -13,10 +13,12 @@ from app.routes.gasolineras import (
     _get_snapshot_state,
     _perform_sync,
     _sync_lock,
+    _sync_service,
 )
 from app.db.connection import close_db_connection, test_db_connection
 from app.db.connection import is_db_configured
 from app.routes.ev_integration import router as ev_integration_router
+from app.services.sync_metrics import METRICS_MEDIA_TYPE, render_metrics
 
 # Configuración de logging
 logging.basicConfig(
@@ -37,6 +39,8 @@ async def lifespan(app: FastAPI):
 
         if settings.auto_ensure_fresh_on_startup:
             with _sync_lock:
+                if _sync_service.memory_mode:
+                    _sync_service.restore_memory_snapshot()
                 snapshot = _get_snapshot_state()
                 if snapshot["total"] > 0 and snapshot["is_current"]:
                     logger.info(
@@ -44,6 +48,9 @@ async def lifespan(app: FastAPI):
                         snapshot["total"],
                         snapshot["snapshot_date_local"],
                     )
+                elif snapshot["total"] > 0 and _sync_service.memory_mode:
+                    # Copia local restaurada: se sirve ya y el refresco va en segundo plano.
+                    logger.info("ℹ️ Snapshot local de %s servido mientras se refresca", snapshot["snapshot_date_local"])
                 else:
                     logger.warning(
                         "⚠️ Snapshot no vigente al arrancar (total=%s, snapshot=%s, hoy=%s). Sincronizando...",
@@ -61,11 +68,16 @@ async def lifespan(app: FastAPI):
             logger.info("ℹ️ AUTO_ENSURE_FRESH_ON_STARTUP=false: no se evalúa frescura en startup")
     except Exception as e:
         logger.error(f"❌ Error al conectar con PostgreSQL: {e}")
+
+    if settings.snapshot_refresh_interval_s > 0:
+        _sync_service.start_background_refresh()
+        logger.info("🔁 Refresco del snapshot en segundo plano cada %ss", settings.snapshot_refresh_interval_s)
     
     yield
     
     # Shutdown
     logger.info("🛑 Cerrando microservicio de gasolineras...")
+    _sync_service.stop_background_refresh()
     close_db_connection()
     logger.info("✅ Conexión a PostgreSQL cerrada")
 
@@ -142,3 +154,10 @@ def health_check():
             "storage_mode": "memory-fallback",
             "warning": str(e),
         }
+
+@app.get("/metrics", tags=["General"], include_in_schema=False)
+def metrics():
+    """
+    Histogramas de tiempos y filas por etapa del sync (formato texto de Prometheus)
+    """
+    return Response(content=render_metrics(), media_type=METRICS_MEDIA_TYPE)
@@ -1,4 +1,7 @@
 """Modelos de entrada para endpoints geograficos."""
+from datetime import datetime
+from typing import Optional
+
 from pydantic import BaseModel, Field
 
 
@@ -8,3 +11,5 @@ class MarkersViewport(BaseModel):
     lat_sw: float = Field(..., ge=-90, le=90)
     lon_sw: float = Field(..., ge=-180, le=180)
     zoom: int = Field(..., ge=0, le=22)
+    abierta_ahora: bool = Field(False, description="Solo estaciones abiertas ahora (hora peninsular)")
+    abierta_en: Optional[datetime] = Field(None, description="Solo estaciones abiertas en ese instante")
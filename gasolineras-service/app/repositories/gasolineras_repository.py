@@ -1,9 +1,15 @@
 """Repositorio SQL/PostGIS para entidad Gasolinera."""
 import importlib
+import io
+import json
+import logging
+import re
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Iterator, Optional
 
-from app.db.connection import get_db_conn, get_cursor
+from app.db.connection import get_db_conn, get_cursor, get_named_cursor
 
 try:
     _psycopg2_extras = importlib.import_module("psycopg2.extras")
@@ -11,17 +17,31 @@ try:
 except Exception:  # pragma: no cover
     execute_values = None
 
+logger = logging.getLogger(__name__)
 
 class GasolinerasRepository:
     def get_snapshot_state(self) -> dict:
         with get_db_conn() as conn:
             with get_cursor(conn) as cur:
-                cur.execute(
-                    """
-                    SELECT COUNT(*) AS total, MAX(actualizado_en) AS last_sync_at
-                    FROM gasolineras
-                    """
-                )
+                if self._sync_state_available(cur):
+                    # Con sync incremental las filas sin cambios conservan su `actualizado_en`.
+                    cur.execute(
+                        """
+                        SELECT COUNT(*) AS total,
+                               GREATEST(
+                                   MAX(actualizado_en),
+                                   (SELECT last_sync_at FROM gasolineras_sync_state WHERE id = 1)
+                               ) AS last_sync_at
+                        FROM gasolineras
+                        """
+                    )
+                else:
+                    cur.execute(
+                        """
+                        SELECT COUNT(*) AS total, MAX(actualizado_en) AS last_sync_at
+                        FROM gasolineras
+                        """
+                    )
                 row_raw = cur.fetchone()
 
         row = dict(row_raw) if row_raw else {}
@@ -30,47 +50,509 @@ class GasolinerasRepository:
             "last_sync_at": row.get("last_sync_at"),
         }
 
-    def replace_snapshot(self, rows: list[tuple]) -> tuple[int, int]:
+    # Columnas de la tupla que construye `SyncService._prepare_sync_rows` (sin el WKT de geom).
+    _SNAPSHOT_COLUMNS = (
+        "ideess", "rotulo", "municipio", "provincia", "direccion",
+        "precio_95_e5", "precio_95_e5_premium", "precio_98_e5",
+        "precio_gasoleo_a", "precio_gasoleo_b",
+        "precio_gasoleo_premium", "precio_diesel_renovable",
+        "latitud", "longitud",
+        "horario", "horario_parsed", "horario_bits",
+        "actualizado_en",
+    )
+    _WKT_POSITION = 14
+    # Columnas que definen si una estacion ha cambiado (geom se deriva de latitud/longitud).
+    _DIFF_COLUMNS = _SNAPSHOT_COLUMNS[1:-1]
+    _GEOM_FROM_LATLON = (
+        "CASE WHEN latitud IS NOT NULL AND longitud IS NOT NULL"
+        " THEN ST_SetSRID(ST_MakePoint(longitud, latitud), 4326)::geography END"
+    )
+    LOAD_METHODS = ("copy", "execute_values")
+    SWAP_LOCK_TIMEOUT_MS = 5000
+    # Intentos del RENAME si un lector largo (cursor de /stream, export, otro servicio)
+    # retiene la tabla; agotados, el snapshot se copia en sitio.
+    SWAP_ATTEMPTS = 3
+    SWAP_RETRY_DELAY_S = 1.0
+    # SQLSTATE lock_not_available (vence lock_timeout).
+    _LOCK_NOT_AVAILABLE = "55P03"
+    # Clave del advisory lock que serializa los sync entre instancias.
+    SYNC_ADVISORY_LOCK_KEY = 4_751_212_025
+
+    def __init__(self, load_method: str = "copy") -> None:
+        if load_method not in self.LOAD_METHODS:
+            raise ValueError(f"load_method debe ser uno de {self.LOAD_METHODS}")
+        self.load_method = load_method
+        self._has_sync_state: Optional[bool] = None
+
+    def _sync_state_available(self, cur) -> bool:
+        """Comprueba (una vez por proceso) si existe `gasolineras_sync_state`."""
+        if self._has_sync_state is None:
+            cur.execute("SELECT to_regclass('gasolineras_sync_state') IS NOT NULL AS ready")
+            row = cur.fetchone()
+            self._has_sync_state = bool(row and row["ready"])
+        return self._has_sync_state
+
+    @staticmethod
+    def _copy_text_value(value) -> str:
+        """Valor en formato texto de COPY (\\N = NULL; escapa barra, tabulador y saltos de linea)."""
+        if value is None:
+            return "\\N"
+        if isinstance(value, datetime):
+            text = value.isoformat()
+        elif isinstance(value, bytes):
+            text = "\\x" + value.hex()
+        elif isinstance(value, str):
+            text = value
+        elif isinstance(value, (int, float)):
+            text = repr(value)
+        else:
+            # psycopg2.extras.Json guarda el objeto original en `adapted`.
+            adapted = getattr(value, "adapted", value)
+            text = adapted if isinstance(adapted, str) else json.dumps(adapted, ensure_ascii=False)
+        return (
+            text.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+
+    @classmethod
+    def _copy_buffer(cls, rows: list[tuple]) -> io.StringIO:
+        wkt = cls._WKT_POSITION
+        buffer = io.StringIO()
+        for row in rows:
+            values = row[:wkt] + row[wkt + 1:]
+            buffer.write("\t".join(cls._copy_text_value(value) for value in values))
+            buffer.write("\n")
+        buffer.seek(0)
+        return buffer
+
+    def _stage_copy(self, cur, rows: list[tuple]) -> None:
+        """Copia las filas a la tabla temporal `gasolineras_load` (sin WAL, se borra al confirmar)."""
+        columns = ", ".join(self._SNAPSHOT_COLUMNS)
+        cur.execute(
+            "CREATE TEMP TABLE gasolineras_load (LIKE gasolineras INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        cur.copy_expert(f"COPY gasolineras_load ({columns}) FROM STDIN", self._copy_buffer(rows))
+
+    def _load_copy(self, cur, rows: list[tuple], target: str) -> None:
+        """
+        Carga por COPY en una tabla temporal (sin WAL) y construye `geom` en bloque
+        con ST_MakePoint en un unico INSERT ... SELECT.
+        """
+        columns = ", ".join(self._SNAPSHOT_COLUMNS)
+        self._stage_copy(cur, rows)
+        cur.execute(
+            f"""
+            INSERT INTO {target} ({columns}, geom)
+            SELECT {columns}, {self._GEOM_FROM_LATLON}
+            FROM gasolineras_load
+            """
+        )
+
+    @staticmethod
+    def _load_execute_values(cur, rows: list[tuple], target: str) -> None:
         if execute_values is None:
             raise RuntimeError("psycopg2.extras.execute_values no disponible")
+        execute_values(
+            cur,
+            f"""
+            INSERT INTO {target}
+                (ideess, rotulo, municipio, provincia, direccion,
+                 precio_95_e5, precio_95_e5_premium, precio_98_e5,
+                 precio_gasoleo_a, precio_gasoleo_b,
+                 precio_gasoleo_premium, precio_diesel_renovable,
+                 latitud, longitud, geom,
+                 horario, horario_parsed, horario_bits,
+                 actualizado_en)
+            VALUES %s
+            """,
+            rows,
+            template=(
+                "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,"
+                " %s, %s, ST_GeomFromText(%s, 4326)::geography, %s, %s, %s, %s)"
+            ),
+        )
+
+    @staticmethod
+    def _clone_indexes(cur, source: str, target: str) -> list[str]:
+        """
+        Recrea en `target` los indices (y la PK) de `source` con sufijo `_next`.
+        Devuelve los nombres originales para renombrarlos tras el intercambio.
+        """
+        cur.execute(
+            """
+            SELECT i.relname AS index_name, pg_get_indexdef(x.indexrelid) AS indexdef, x.indisprimary AS is_primary
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = %s::regclass
+            """,
+            [source],
+        )
+        names = []
+        for row in cur.fetchall():
+            name, next_name = row["index_name"], f"{row['index_name']}_next"
+            indexdef = re.sub(rf"INDEX {re.escape(name)} ON ", f"INDEX {next_name} ON ", row["indexdef"], count=1)
+            indexdef = re.sub(rf" ON ((?:\w+\.)?){source} USING ", rf" ON \g<1>{target} USING ", indexdef, count=1)
+            cur.execute(indexdef)
+            if row["is_primary"]:
+                cur.execute(f"ALTER TABLE {target} ADD CONSTRAINT {next_name} PRIMARY KEY USING INDEX {next_name}")
+            names.append(name)
+        return names
+
+    @staticmethod
+    def _swap_blocked(cur) -> Optional[str]:
+        """
+        Motivo por el que `gasolineras` no puede sustituirse por RENAME + DROP: vistas
+        o FKs que dependen de ella (el DROP fallaria) o RLS (las politicas no se copian).
+        """
+        cur.execute(
+            """
+            SELECT
+                EXISTS (
+                    SELECT 1 FROM pg_depend d
+                    JOIN pg_rewrite r ON r.oid = d.objid
+                    WHERE d.classid = 'pg_rewrite'::regclass
+                      AND d.refobjid = 'gasolineras'::regclass
+                      AND r.ev_class <> 'gasolineras'::regclass
+                ) AS has_views,
+                EXISTS (SELECT 1 FROM pg_constraint WHERE confrelid = 'gasolineras'::regclass) AS has_fks,
+                (SELECT relrowsecurity FROM pg_class WHERE oid = 'gasolineras'::regclass) AS has_rls
+            """
+        )
+        row = cur.fetchone() or {}
+        for reason in ("has_views", "has_fks", "has_rls"):
+            if row.get(reason):
+                return reason
+        return None
+
+    @staticmethod
+    def _copy_table_grants(cur, source: str, target: str) -> None:
+        """Replica en `target` los GRANT y el comentario de `source` (LIKE no los copia)."""
+        cur.execute(
+            """
+            SELECT format(
+                'GRANT %%s ON %%I TO %%s', privilege_type, %s,
+                CASE WHEN grantee = 'PUBLIC' THEN 'PUBLIC' ELSE quote_ident(grantee) END
+            ) AS stmt
+            FROM information_schema.role_table_grants
+            WHERE table_schema = current_schema() AND table_name = %s AND grantee <> current_user
+            """,
+            [target, source],
+        )
+        for row in cur.fetchall():
+            cur.execute(row["stmt"])
+        cur.execute(
+            "SELECT format('COMMENT ON TABLE %%I IS %%L', %s, obj_description(%s::regclass, 'pg_class')) AS stmt",
+            [target, source],
+        )
+        row = cur.fetchone()
+        if row and row["stmt"]:
+            cur.execute(row["stmt"])
 
+    def _swap_tables(self, cur, index_names: list[str]) -> bool:
+        """
+        RENAME de `gasolineras_next` a `gasolineras` dentro de un savepoint. Si no se
+        obtiene el bloqueo en `SWAP_LOCK_TIMEOUT_MS` se deshace solo el intercambio y se
+        reintenta; devuelve False si ningun intento lo consigue.
+        """
+        for attempt in range(1, self.SWAP_ATTEMPTS + 1):
+            cur.execute("SAVEPOINT snapshot_swap")
+            try:
+                cur.execute(f"SET LOCAL lock_timeout = '{self.SWAP_LOCK_TIMEOUT_MS}ms'")
+                cur.execute("ALTER TABLE gasolineras RENAME TO gasolineras_old")
+                cur.execute("ALTER TABLE gasolineras_next RENAME TO gasolineras")
+                cur.execute("DROP TABLE gasolineras_old")
+                for name in index_names:
+                    cur.execute(f"ALTER INDEX {name}_next RENAME TO {name}")
+            except Exception as exc:
+                if getattr(exc, "pgcode", None) != self._LOCK_NOT_AVAILABLE:
+                    raise
+                # Deshace tambien el SET LOCAL: el resto de la transaccion no hereda el timeout.
+                cur.execute("ROLLBACK TO SAVEPOINT snapshot_swap")
+                logger.warning(
+                    "⏳ gasolineras ocupada por otro lector, intercambio %s/%s aplazado", attempt, self.SWAP_ATTEMPTS
+                )
+                if attempt < self.SWAP_ATTEMPTS:
+                    time.sleep(self.SWAP_RETRY_DELAY_S)
+                continue
+            cur.execute("RELEASE SAVEPOINT snapshot_swap")
+            return True
+        return False
+
+    def _load_in_place(self, cur, rows: list[tuple]) -> None:
+        """DELETE + carga sobre la tabla viva: no necesita bloqueo exclusivo."""
+        cur.execute("DELETE FROM gasolineras")
+        if self.load_method == "copy":
+            self._load_copy(cur, rows, "gasolineras")
+        else:
+            self._load_execute_values(cur, rows, "gasolineras")
+
+    def replace_snapshot(self, rows: list[tuple], cluster_grid_sizes: tuple[float, ...] = ()) -> tuple[int, int]:
+        """
+        Construye el snapshot en `gasolineras_next` (carga + indices + ANALYZE) y lo
+        intercambia con `gasolineras` mediante RENAME en la misma transaccion.
+
+        Los lectores siguen usando la tabla anterior durante toda la carga; solo el
+        RENAME final toma un bloqueo exclusivo breve. Al eliminar la tabla vieja
+        entera no quedan tuplas muertas que limpiar por autovacuum.
+
+        Si hay vistas, FKs o RLS sobre `gasolineras`, o un lector retiene la tabla
+        mas alla de los reintentos, el snapshot se escribe en sitio (DELETE + INSERT).
+        """
         with get_db_conn() as conn:
             with get_cursor(conn) as cur:
-                cur.execute("DELETE FROM gasolineras")
-                deleted_count = cur.rowcount
+                cur.execute("SELECT COUNT(*) AS total FROM gasolineras")
+                deleted_count = int((cur.fetchone() or {"total": 0})["total"])
+                inserted_count = len(rows)
+
+                blocked = self._swap_blocked(cur)
+                if blocked:
+                    logger.warning("⚠️ gasolineras no admite intercambio por RENAME (%s): carga en sitio", blocked)
+                    self._load_in_place(cur, rows)
+                else:
+                    cur.execute("DROP TABLE IF EXISTS gasolineras_next")
+                    # Sin indices: se clonan despues de cargar, construirlos de una vez es mas barato.
+                    cur.execute("CREATE TABLE gasolineras_next (LIKE gasolineras INCLUDING ALL EXCLUDING INDEXES)")
+                    self._copy_table_grants(cur, "gasolineras", "gasolineras_next")
+                    if self.load_method == "copy":
+                        self._load_copy(cur, rows, "gasolineras_next")
+                    else:
+                        self._load_execute_values(cur, rows, "gasolineras_next")
+
+                    index_names = self._clone_indexes(cur, "gasolineras", "gasolineras_next")
+                    cur.execute("ANALYZE gasolineras_next")
+
+                    if not self._swap_tables(cur, index_names):
+                        logger.warning("⚠️ Intercambio de gasolineras agotado: copia en sitio desde gasolineras_next")
+                        cur.execute("DELETE FROM gasolineras")
+                        cur.execute("INSERT INTO gasolineras SELECT * FROM gasolineras_next")
+                        cur.execute("DROP TABLE gasolineras_next")
+
+                if cluster_grid_sizes:
+                    self._refresh_cluster_pyramid(cur, cluster_grid_sizes)
+
+        return deleted_count, inserted_count
+
+    def apply_snapshot_diff(
+        self, rows: list[tuple], synced_at: datetime, cluster_grid_sizes: tuple[float, ...] = ()
+    ) -> Optional[dict]:
+        """
+        Aplica el snapshot escribiendo solo lo que cambia: inserta estaciones nuevas,
+        actualiza las que difieren en alguna columna de `_DIFF_COLUMNS` y borra las
+        que ya no aparecen. Las filas identicas no se tocan (ni WAL ni tuplas muertas).
+
+        Devuelve None si falta `gasolineras_sync_state` (esquema sin migrar); en ese
+        caso el llamador debe usar `replace_snapshot`.
+        """
+        columns = ", ".join(self._SNAPSHOT_COLUMNS)
+        updates = ", ".join(f"{col} = EXCLUDED.{col}" for col in self._SNAPSHOT_COLUMNS[1:])
+        current = ", ".join(f"gasolineras.{col}" for col in self._DIFF_COLUMNS)
+        incoming = ", ".join(f"EXCLUDED.{col}" for col in self._DIFF_COLUMNS)
+
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                if not self._sync_state_available(cur):
+                    return None
+
+                # Bloquea la fila de estado: dos sync incrementales no se solapan.
+                cur.execute("SELECT last_sync_at FROM gasolineras_sync_state WHERE id = 1 FOR UPDATE")
+                state = cur.fetchone()
+                previous_sync_at = state["last_sync_at"] if state else None
 
-                execute_values(
-                    cur,
+                if self.load_method == "copy":
+                    self._stage_copy(cur, rows)
+                else:
+                    cur.execute(
+                        "CREATE TEMP TABLE gasolineras_load (LIKE gasolineras INCLUDING DEFAULTS) ON COMMIT DROP"
+                    )
+                    self._load_execute_values(cur, rows, "gasolineras_load")
+
+                cur.execute(
+                    """
+                    DELETE FROM gasolineras g
+                    WHERE NOT EXISTS (SELECT 1 FROM gasolineras_load l WHERE l.ideess = g.ideess)
+                    """
+                )
+                removed = max(cur.rowcount, 0)
+
+                cur.execute(
+                    f"""
+                    INSERT INTO gasolineras ({columns}, geom)
+                    SELECT {columns}, {self._GEOM_FROM_LATLON}
+                    FROM gasolineras_load
+                    ON CONFLICT (ideess) DO UPDATE SET {updates}, geom = EXCLUDED.geom
+                    WHERE ({current}) IS DISTINCT FROM ({incoming})
+                    RETURNING ideess, (xmax = 0) AS inserted
                     """
-                    INSERT INTO gasolineras
-                        (ideess, rotulo, municipio, provincia, direccion,
-                         precio_95_e5, precio_95_e5_premium, precio_98_e5,
-                         precio_gasoleo_a, precio_gasoleo_b,
-                         precio_gasoleo_premium, precio_diesel_renovable,
-                         latitud, longitud, geom,
-                         horario, horario_parsed,
-                         actualizado_en)
-                    VALUES %s
+                )
+                written = cur.fetchall()
+                new_ids = {r["ideess"] for r in written if r["inserted"]}
+                changed_ids = {r["ideess"] for r in written if not r["inserted"]}
+
+                cur.execute(
+                    """
+                    INSERT INTO gasolineras_sync_state (id, last_sync_at) VALUES (1, %s)
+                    ON CONFLICT (id) DO UPDATE SET last_sync_at = EXCLUDED.last_sync_at
                     """,
-                    rows,
-                    template=(
-                        "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,"
-                        " %s, %s, ST_GeomFromText(%s, 4326)::geography, %s, %s, %s)"
-                    ),
+                    [synced_at],
                 )
 
-                inserted_count = len(rows)
+                if cluster_grid_sizes and (written or removed):
+                    self._refresh_cluster_pyramid(cur, cluster_grid_sizes)
 
-        return deleted_count, inserted_count
+        return {
+            "new": len(new_ids),
+            "changed": len(changed_ids),
+            "unchanged": len(rows) - len(new_ids) - len(changed_ids),
+            "removed": removed,
+            "written_ids": new_ids | changed_ids,
+            "previous_sync_at": previous_sync_at,
+        }
 
-    def list_rows(
-        self,
+    def mark_synced(self, synced_at: datetime) -> None:
+        """
+        Da por vigente el snapshot actual en `synced_at` sin reescribirlo (el ministerio
+        no ha publicado datos nuevos). Sin `gasolineras_sync_state` se actualiza
+        `actualizado_en`, que es de donde sale entonces la fecha del snapshot.
+        """
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                if self._sync_state_available(cur):
+                    cur.execute(
+                        """
+                        INSERT INTO gasolineras_sync_state (id, last_sync_at) VALUES (1, %s)
+                        ON CONFLICT (id) DO UPDATE SET last_sync_at = EXCLUDED.last_sync_at
+                        """,
+                        [synced_at],
+                    )
+                else:
+                    cur.execute("UPDATE gasolineras SET actualizado_en = %s", [synced_at])
+
+    @contextmanager
+    def sync_advisory_lock(self, wait_s: float, poll_s: float = 0.5) -> Iterator[tuple[bool, bool]]:
+        """
+        Toma `pg_try_advisory_lock` en una conexion reservada durante todo el sync.
+        Produce (adquirido, hubo_espera): si otra instancia lo tiene se reintenta
+        hasta `wait_s` segundos. El lock es de sesion, asi que se libera solo si la
+        conexion se pierde a mitad de sync; por eso exige una conexion directa: tras
+        un pooler en modo transaccion el unlock puede ejecutarse en otro backend.
+        """
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                deadline = time.monotonic() + wait_s
+                contended = False
+                while True:
+                    cur.execute("SELECT pg_try_advisory_lock(%s) AS locked", [self.SYNC_ADVISORY_LOCK_KEY])
+                    row = cur.fetchone()
+                    if row and row["locked"]:
+                        break
+                    contended = True
+                    if time.monotonic() >= deadline:
+                        conn.commit()
+                        yield False, contended
+                        return
+                    time.sleep(poll_s)
+                # Sin transaccion abierta mientras dura el sync (evita idle in transaction).
+                conn.commit()
+                try:
+                    yield True, contended
+                finally:
+                    try:
+                        cur.execute("SELECT pg_advisory_unlock(%s) AS unlocked", [self.SYNC_ADVISORY_LOCK_KEY])
+                        row = cur.fetchone()
+                        conn.commit()
+                    except Exception as exc:
+                        logger.warning("⚠️ No se pudo liberar el lock de sync: %s", exc)
+                    else:
+                        if not (row and row["unlocked"]):
+                            # Tras un pooler en modo transaccion (PgBouncer, endpoint -pooler de Neon)
+                            # el unlock puede llegar a otro backend y el lock queda tomado.
+                            logger.error(
+                                "❌ pg_advisory_unlock no liberó el lock de sync: DATABASE_URL debe ser una "
+                                "conexión directa, no un pooler en modo transacción"
+                            )
+
+    @staticmethod
+    def _refresh_cluster_pyramid(cur, grid_sizes: tuple[float, ...]) -> int:
+        """
+        Recalcula `gasolineras_clusters` en la misma transaccion que el snapshot.
+        Si la tabla no existe (esquema sin migrar) se deshace solo este paso.
+        """
+        cur.execute("SAVEPOINT cluster_pyramid")
+        try:
+            cur.execute("DELETE FROM gasolineras_clusters")
+            cur.execute(
+                """
+                INSERT INTO gasolineras_clusters (grid_size, latitude, longitude, total, min_precio_95_e5)
+                SELECT g.grid_size, ST_Y(c.representative_geom), ST_X(c.representative_geom), c.total, c.min_precio_95_e5
+                FROM unnest(%s::float8[]) AS g(grid_size)
+                CROSS JOIN LATERAL (
+                    SELECT
+                        COUNT(*)::int AS total,
+                        MIN(precio_95_e5) AS min_precio_95_e5,
+                        (ARRAY_AGG(geom::geometry ORDER BY precio_95_e5 ASC NULLS LAST))[1] AS representative_geom
+                    FROM gasolineras
+                    WHERE geom IS NOT NULL
+                    GROUP BY ST_SnapToGrid(geom::geometry, g.grid_size, g.grid_size)
+                ) c
+                """,
+                [list(grid_sizes)],
+            )
+            cluster_count = cur.rowcount
+        except Exception as exc:
+            cur.execute("ROLLBACK TO SAVEPOINT cluster_pyramid")
+            logger.warning("⚠️ No se pudo precalcular la pirámide de clusters: %s", exc)
+            return 0
+        cur.execute("RELEASE SAVEPOINT cluster_pyramid")
+        logger.info("🗺️ Pirámide de clusters precalculada: %s celdas en %s niveles", cluster_count, len(grid_sizes))
+        return cluster_count
+
+    def cluster_pyramid_ready(self) -> bool:
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                cur.execute("SELECT to_regclass('gasolineras_clusters') IS NOT NULL AS ready")
+                row = cur.fetchone()
+                if not row or not row["ready"]:
+                    return False
+                cur.execute("SELECT EXISTS (SELECT 1 FROM gasolineras_clusters) AS ready")
+                row = cur.fetchone()
+        return bool(row and row["ready"])
+
+    def precomputed_cluster_markers(
+        self, lon_sw: float, lat_sw: float, lon_ne: float, lat_ne: float, grid_size: float
+    ) -> list[dict]:
+        """Clusters precalculados del nivel `grid_size` cuyo representante cae en el viewport."""
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                cur.execute(
+                    """
+                    SELECT latitude, longitude, total, min_precio_95_e5
+                    FROM gasolineras_clusters
+                    WHERE grid_size = %s
+                      AND latitude BETWEEN %s AND %s
+                      AND longitude BETWEEN %s AND %s
+                    ORDER BY total DESC
+                    LIMIT 1500
+                    """,
+                    [grid_size, lat_sw, lat_ne, lon_sw, lon_ne],
+                )
+                return [dict(r) for r in cur.fetchall()]
+
+    @staticmethod
+    def _open_condition(abierta_slot: Optional[int]) -> tuple[str, list]:
+        """Filtro por el bitmap de horario; sin bitmap (horario desconocido) la fila no se incluye."""
+        if abierta_slot is None:
+            return "", []
+        return " AND get_bit(horario_bits, %s) = 1", [abierta_slot]
+
+    @staticmethod
+    def _list_filters(
         provincia: Optional[str],
         municipio: Optional[str],
         precio_max: Optional[float],
-        skip: int,
-        limit: int,
-    ) -> tuple[int, list[dict]]:
+        abierta_slot: Optional[int] = None,
+    ) -> tuple[list[str], list]:
         conditions: list[str] = []
         params: list = []
 
@@ -83,7 +565,21 @@ class GasolinerasRepository:
         if precio_max is not None:
             conditions.append("precio_95_e5 <= %s")
             params.append(precio_max)
+        if abierta_slot is not None:
+            conditions.append("get_bit(horario_bits, %s) = 1")
+            params.append(abierta_slot)
+        return conditions, params
 
+    def list_rows(
+        self,
+        provincia: Optional[str],
+        municipio: Optional[str],
+        precio_max: Optional[float],
+        skip: int,
+        limit: int,
+        abierta_slot: Optional[int] = None,
+    ) -> tuple[int, list[dict]]:
+        conditions, params = self._list_filters(provincia, municipio, precio_max, abierta_slot)
         where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
 
         with get_db_conn() as conn:
@@ -93,18 +589,88 @@ class GasolinerasRepository:
                 total = int(count_row["total"])
 
                 cur.execute(
-                    f"SELECT * FROM gasolineras {where} OFFSET %s LIMIT %s",
+                    f"SELECT * FROM gasolineras {where} ORDER BY ideess OFFSET %s LIMIT %s",
                     params + [skip, limit],
                 )
                 rows = [dict(r) for r in cur.fetchall()]
 
         return total, rows
 
-    def cluster_markers(self, lon_sw: float, lat_sw: float, lon_ne: float, lat_ne: float, grid_size: float) -> list[dict]:
+    def list_rows_keyset(
+        self,
+        provincia: Optional[str],
+        municipio: Optional[str],
+        precio_max: Optional[float],
+        order_by: str,
+        after: Optional[tuple],
+        limit: int,
+        total_mode: str,
+        abierta_slot: Optional[int] = None,
+    ) -> tuple[Optional[int], list[dict]]:
+        """
+        Pagina por clave (keyset) en orden `ideess` o `(precio_95_e5 NULLS LAST, ideess)`.
+
+        `after` es la clave de la ultima fila de la pagina anterior. Devuelve hasta
+        `limit + 1` filas para que el llamador sepa si hay pagina siguiente.
+        `total_mode`: "exacto" (COUNT), "estimado" (pg_class sin filtros) o "no".
+        """
+        conditions, params = self._list_filters(provincia, municipio, precio_max, abierta_slot)
+        filter_conditions, filter_params = list(conditions), list(params)
+
+        if order_by == "precio":
+            order_sql = "precio_95_e5 ASC NULLS LAST, ideess ASC"
+            if after is not None:
+                after_price, after_id = after
+                if after_price is None:
+                    conditions.append("(precio_95_e5 IS NULL AND ideess > %s)")
+                    params.append(after_id)
+                else:
+                    conditions.append("((precio_95_e5, ideess) > (%s, %s) OR precio_95_e5 IS NULL)")
+                    params.extend([after_price, after_id])
+        else:
+            order_sql = "ideess ASC"
+            if after is not None:
+                conditions.append("ideess > %s")
+                params.append(after[0])
+
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        filter_where = ("WHERE " + " AND ".join(filter_conditions)) if filter_conditions else ""
+
         with get_db_conn() as conn:
             with get_cursor(conn) as cur:
+                total: Optional[int] = None
+                if total_mode == "estimado" and not filter_conditions:
+                    cur.execute("SELECT reltuples::bigint AS total FROM pg_class WHERE oid = 'gasolineras'::regclass")
+                    estimate_row = cur.fetchone()
+                    if estimate_row and int(estimate_row["total"]) >= 0:
+                        total = int(estimate_row["total"])
+                if total is None and total_mode != "no":
+                    cur.execute(f"SELECT COUNT(*) AS total FROM gasolineras {filter_where}", filter_params)
+                    count_row = cur.fetchone() or {"total": 0}
+                    total = int(count_row["total"])
+
                 cur.execute(
-                    """
+                    f"SELECT * FROM gasolineras {where} ORDER BY {order_sql} LIMIT %s",
+                    params + [limit + 1],
+                )
+                rows = [dict(r) for r in cur.fetchall()]
+
+        return total, rows
+
+    def cluster_markers(
+        self,
+        lon_sw: float,
+        lat_sw: float,
+        lon_ne: float,
+        lat_ne: float,
+        grid_size: float,
+        abierta_slot: Optional[int] = None,
+    ) -> list[dict]:
+        open_sql, open_params = self._open_condition(abierta_slot)
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                cur.execute(
+                    f"""
                     WITH filtered AS (
                         SELECT geom, precio_95_e5
                         FROM gasolineras
@@ -112,7 +678,7 @@ class GasolinerasRepository:
                           AND ST_Intersects(
                               geom::geometry,
                               ST_MakeEnvelope(%s, %s, %s, %s, 4326)
-                          )
+                          ){open_sql}
                     ), grouped AS (
                         SELECT
                             ST_SnapToGrid(geom::geometry, %s, %s) AS grid_geom,
@@ -131,15 +697,102 @@ class GasolinerasRepository:
                     ORDER BY total DESC
                     LIMIT 1500
                     """,
-                    [lon_sw, lat_sw, lon_ne, lat_ne, grid_size, grid_size],
+                    [lon_sw, lat_sw, lon_ne, lat_ne, *open_params, grid_size, grid_size],
                 )
                 return [dict(r) for r in cur.fetchall()]
 
-    def station_markers(self, lon_sw: float, lat_sw: float, lon_ne: float, lat_ne: float) -> list[dict]:
+    @staticmethod
+    def _tile_bytes(cur) -> bytes:
+        row = cur.fetchone()
+        tile = row["tile"] if row else None
+        return bytes(tile) if tile is not None else b""
+
+    def station_tile(self, z: int, x: int, y: int, bounds: tuple[float, float, float, float]) -> bytes:
+        """Tesela MVT con la capa `gasolineras` (id, p95) generada por ST_AsMVT."""
+        lat_sw, lon_sw, lat_ne, lon_ne = bounds
         with get_db_conn() as conn:
             with get_cursor(conn) as cur:
                 cur.execute(
                     """
+                    WITH bounds AS (
+                        SELECT ST_TileEnvelope(%s, %s, %s) AS geom
+                    ), mvtgeom AS (
+                        SELECT
+                            ST_AsMVTGeom(ST_Transform(g.geom::geometry, 3857), bounds.geom, 4096, 64, true) AS geom,
+                            g.ideess AS id,
+                            g.precio_95_e5::float8 AS p95
+                        FROM gasolineras g, bounds
+                        WHERE g.geom IS NOT NULL
+                          AND ST_Intersects(g.geom::geometry, ST_MakeEnvelope(%s, %s, %s, %s, 4326))
+                    )
+                    SELECT ST_AsMVT(mvtgeom.*, 'gasolineras', 4096, 'geom') AS tile FROM mvtgeom
+                    """,
+                    [z, x, y, lon_sw, lat_sw, lon_ne, lat_ne],
+                )
+                return self._tile_bytes(cur)
+
+    def cluster_tile(
+        self,
+        z: int,
+        x: int,
+        y: int,
+        bounds: tuple[float, float, float, float],
+        grid_size: float,
+        precomputed: bool,
+    ) -> bytes:
+        """Tesela MVT con la capa `clusters` (count, p95), desde la piramide precalculada o agregando en vivo."""
+        lat_sw, lon_sw, lat_ne, lon_ne = bounds
+        if precomputed:
+            cells_sql = """
+                SELECT ST_SetSRID(ST_MakePoint(longitude, latitude), 4326) AS point, total, min_precio_95_e5
+                FROM gasolineras_clusters
+                WHERE grid_size = %s
+                  AND latitude BETWEEN %s AND %s
+                  AND longitude BETWEEN %s AND %s
+            """
+            cells_params = [grid_size, lat_sw, lat_ne, lon_sw, lon_ne]
+        else:
+            cells_sql = """
+                SELECT
+                    (ARRAY_AGG(geom::geometry ORDER BY precio_95_e5 ASC NULLS LAST))[1] AS point,
+                    COUNT(*)::int AS total,
+                    MIN(precio_95_e5) AS min_precio_95_e5
+                FROM gasolineras
+                WHERE geom IS NOT NULL
+                  AND ST_Intersects(geom::geometry, ST_MakeEnvelope(%s, %s, %s, %s, 4326))
+                GROUP BY ST_SnapToGrid(geom::geometry, %s, %s)
+            """
+            cells_params = [lon_sw, lat_sw, lon_ne, lat_ne, grid_size, grid_size]
+
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                cur.execute(
+                    f"""
+                    WITH bounds AS (
+                        SELECT ST_TileEnvelope(%s, %s, %s) AS geom
+                    ), cells AS (
+                        {cells_sql}
+                    ), mvtgeom AS (
+                        SELECT
+                            ST_AsMVTGeom(ST_Transform(cells.point, 3857), bounds.geom, 4096, 64, true) AS geom,
+                            cells.total AS count,
+                            cells.min_precio_95_e5::float8 AS p95
+                        FROM cells, bounds
+                    )
+                    SELECT ST_AsMVT(mvtgeom.*, 'clusters', 4096, 'geom') AS tile FROM mvtgeom
+                    """,
+                    [z, x, y] + cells_params,
+                )
+                return self._tile_bytes(cur)
+
+    def station_markers(
+        self, lon_sw: float, lat_sw: float, lon_ne: float, lat_ne: float, abierta_slot: Optional[int] = None
+    ) -> list[dict]:
+        open_sql, open_params = self._open_condition(abierta_slot)
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                cur.execute(
+                    f"""
                     SELECT
                         ideess, rotulo, municipio, provincia, direccion,
                         precio_95_e5, precio_95_e5_premium, precio_98_e5,
@@ -151,19 +804,22 @@ class GasolinerasRepository:
                       AND ST_Intersects(
                           geom::geometry,
                           ST_MakeEnvelope(%s, %s, %s, %s, 4326)
-                      )
+                      ){open_sql}
                     ORDER BY precio_95_e5 NULLS LAST, ideess
                     LIMIT 2000
                     """,
-                    [lon_sw, lat_sw, lon_ne, lat_ne],
+                    [lon_sw, lat_sw, lon_ne, lat_ne, *open_params],
                 )
                 return [dict(r) for r in cur.fetchall()]
 
-    def nearby_rows(self, lat: float, lon: float, km: float, limit: int) -> list[dict]:
+    def nearby_rows(
+        self, lat: float, lon: float, km: float, limit: int, abierta_slot: Optional[int] = None
+    ) -> list[dict]:
+        open_sql, open_params = self._open_condition(abierta_slot)
         with get_db_conn() as conn:
             with get_cursor(conn) as cur:
                 cur.execute(
-                    """
+                    f"""
                     SELECT
                         ideess, rotulo, municipio, provincia, direccion,
                         precio_95_e5, precio_95_e5_premium, precio_98_e5,
@@ -173,11 +829,11 @@ class GasolinerasRepository:
                         ST_Distance(geom, ST_MakePoint(%s, %s)::geography) / 1000.0 AS distancia_km
                     FROM gasolineras
                     WHERE geom IS NOT NULL
-                      AND ST_DWithin(geom, ST_MakePoint(%s, %s)::geography, %s)
+                      AND ST_DWithin(geom, ST_MakePoint(%s, %s)::geography, %s){open_sql}
                     ORDER BY distancia_km
                     LIMIT %s
                     """,
-                    [lon, lat, lon, lat, km * 1000, limit],
+                    [lon, lat, lon, lat, km * 1000, *open_params, limit],
                 )
                 return [dict(r) for r in cur.fetchall()]
 
@@ -195,7 +851,33 @@ class GasolinerasRepository:
                 row = cur.fetchone()
         return dict(row) if row else None
 
-    def stats_rows(self, provincia: Optional[str], municipio: Optional[str]) -> list[dict]:
+    _STATS_COLUMNS = (
+        "precio_95_e5",
+        "precio_95_e5_premium",
+        "precio_98_e5",
+        "precio_gasoleo_a",
+        "precio_gasoleo_b",
+        "precio_gasoleo_premium",
+        "precio_diesel_renovable",
+    )
+
+    @classmethod
+    def _stats_select(cls) -> str:
+        """Agregados por combustible: n, min, max, media y percentiles discretos 25/50/75."""
+        parts = []
+        for column in cls._STATS_COLUMNS:
+            valid = f"FILTER (WHERE {column} > 0)"
+            parts.append(
+                f"COUNT({column}) {valid} AS {column}_n, "
+                f"MIN({column}) {valid} AS {column}_min, "
+                f"MAX({column}) {valid} AS {column}_max, "
+                f"AVG({column}) {valid} AS {column}_avg, "
+                f"percentile_disc(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY {column}) {valid} AS {column}_pct"
+            )
+        return ",\n".join(parts)
+
+    def stats_aggregate(self, provincia: Optional[str], municipio: Optional[str]) -> dict:
+        """Estadisticas de precios calculadas en una sola consulta agregada (sin traer filas)."""
         conditions: list[str] = []
         params: list = []
         if provincia:
@@ -207,13 +889,23 @@ class GasolinerasRepository:
 
         where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
 
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                cur.execute(f"SELECT COUNT(*) AS total, {self._stats_select()} FROM gasolineras {where}", params)
+                row = cur.fetchone()
+        return dict(row) if row else {"total": 0}
+
+    def stats_aggregate_by_provincia(self) -> list[dict]:
+        """Mismos agregados por provincia y nacional (fila con `es_total`), en una sola pasada."""
         with get_db_conn() as conn:
             with get_cursor(conn) as cur:
                 cur.execute(
-                    f"SELECT precio_95_e5, precio_95_e5_premium, precio_98_e5, "
-                    f"precio_gasoleo_a, precio_gasoleo_b, precio_gasoleo_premium, "
-                    f"precio_diesel_renovable FROM gasolineras {where}",
-                    params,
+                    f"""
+                    SELECT provincia, GROUPING(provincia) = 1 AS es_total, COUNT(*) AS total,
+                           {self._stats_select()}
+                    FROM gasolineras
+                    GROUP BY GROUPING SETS ((provincia), ())
+                    """
                 )
                 return [dict(r) for r in cur.fetchall()]
 
@@ -248,30 +940,30 @@ class GasolinerasRepository:
                 cur.execute("SELECT 1 FROM gasolineras WHERE ideess = %s", [ideess])
                 return bool(cur.fetchone())
 
-    def snapshot_export_rows(self) -> list[dict]:
+    def existing_ids(self, ids: list[str]) -> set[str]:
         with get_db_conn() as conn:
             with get_cursor(conn) as cur:
+                cur.execute("SELECT ideess FROM gasolineras WHERE ideess = ANY(%s)", [list(ids)])
+                return {row["ideess"] for row in cur.fetchall()}
+
+    def iter_snapshot_batches(self, batch_size: int) -> Iterator[list[dict]]:
+        """Recorre el snapshot completo con un cursor de servidor, en lotes de `batch_size` filas."""
+        with get_db_conn() as conn:
+            with get_named_cursor(conn, "gasolineras_stream", itersize=batch_size) as cur:
                 cur.execute(
                     """
                     SELECT
-                        ideess,
-                        rotulo,
-                        municipio,
-                        provincia,
-                        direccion,
-                        precio_95_e5,
-                        precio_95_e5_premium,
-                        precio_98_e5,
-                        precio_gasoleo_a,
-                        precio_gasoleo_b,
-                        precio_gasoleo_premium,
-                        precio_diesel_renovable,
-                        latitud,
-                        longitud,
-                        horario,
-                        horario_parsed,
-                        actualizado_en
+                        ideess, rotulo, municipio, provincia, direccion,
+                        precio_95_e5, precio_95_e5_premium, precio_98_e5,
+                        precio_gasoleo_a, precio_gasoleo_b,
+                        precio_gasoleo_premium, precio_diesel_renovable,
+                        latitud, longitud, horario, horario_parsed
                     FROM gasolineras
+                    ORDER BY ideess
                     """
                 )
-                return [dict(r) for r in cur.fetchall()]
+                while True:
+                    batch = cur.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    yield [dict(r) for r in batch]
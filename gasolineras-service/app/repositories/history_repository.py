@@ -1,9 +1,14 @@
 """Repositorio SQL para historico de precios."""
 import importlib
-from datetime import date
+import logging
+import re
+from datetime import date, timedelta
+from typing import Optional
 
 from app.db.connection import get_db_conn, get_cursor
 
+logger = logging.getLogger(__name__)
+
 try:
     _psycopg2_extras = importlib.import_module("psycopg2.extras")
     execute_values = _psycopg2_extras.execute_values
@@ -11,12 +16,135 @@ except Exception:  # pragma: no cover
     execute_values = None
 
 
+_RE_PARTITION_BOUND = re.compile(r"FROM \((MINVALUE|'\d{4}-\d{2}-\d{2}')\) TO \('(\d{4}-\d{2}-\d{2})'\)")
+
+
 class HistoryRepository:
+    # Particiones semanales (lunes a lunes) creadas por adelantado.
+    PARTITION_DAYS = 7
+    PARTITIONS_AHEAD = 2
+
+    def __init__(self) -> None:
+        self._is_partitioned: Optional[bool] = None
+        self._covered_weeks: set[date] = set()
+
+    def _partitioned(self, cur) -> bool:
+        """Comprueba (una vez por proceso) si `precios_historicos` esta particionada por `fecha`."""
+        if self._is_partitioned is None:
+            cur.execute(
+                """
+                SELECT EXISTS (
+                    SELECT 1 FROM pg_partitioned_table
+                    WHERE partrelid = to_regclass('precios_historicos')
+                ) AS partitioned
+                """
+            )
+            row = cur.fetchone()
+            self._is_partitioned = bool(row and row["partitioned"])
+        return self._is_partitioned
+
+    @staticmethod
+    def _week_start(day: date) -> date:
+        return day - timedelta(days=day.weekday())
+
+    @staticmethod
+    def _partitions(cur) -> list[tuple[str, date, date]]:
+        """Particiones de rango existentes como (nombre, desde, hasta); ignora la DEFAULT."""
+        cur.execute(
+            """
+            SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass('precios_historicos')
+            """
+        )
+        partitions = []
+        for row in cur.fetchall():
+            match = _RE_PARTITION_BOUND.search(row["bound"] or "")
+            if match:
+                start = date.min if match.group(1) == "MINVALUE" else date.fromisoformat(match.group(1).strip("'"))
+                partitions.append((row["name"], start, date.fromisoformat(match.group(2))))
+        return partitions
+
+    def _ensure_partitions(self, cur, first_day: date, last_day: date) -> None:
+        """Crea las particiones semanales que falten entre `first_day` y `PARTITIONS_AHEAD` semanas tras `last_day`."""
+        week = self._week_start(first_day)
+        weeks = []
+        while week <= self._week_start(last_day) + timedelta(days=self.PARTITION_DAYS * self.PARTITIONS_AHEAD):
+            if week not in self._covered_weeks:
+                weeks.append(week)
+            week += timedelta(days=self.PARTITION_DAYS)
+        if not weeks:
+            return
+
+        existing = self._partitions(cur)
+        for week in weeks:
+            week_end = week + timedelta(days=self.PARTITION_DAYS)
+            # Una particion previa (p. ej. mensual creada a mano) que solape la semana la cubre.
+            if not any(start < week_end and week < end for _, start, end in existing):
+                name = f"precios_historicos_p{week:%Y%m%d}"
+                cur.execute(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF precios_historicos FOR VALUES FROM (%s) TO (%s)",
+                    [week, week_end],
+                )
+                logger.info("🗂️ Particion de historico creada: %s", name)
+            self._covered_weeks.add(week)
+
+    @staticmethod
+    def _has_default_partition(cur) -> bool:
+        cur.execute(
+            """
+            SELECT EXISTS (
+                SELECT 1 FROM pg_partitioned_table
+                WHERE partrelid = to_regclass('precios_historicos') AND partdefid <> 0
+            ) AS has_default
+            """
+        )
+        row = cur.fetchone()
+        return bool(row and row["has_default"])
+
     def prune_before(self, retention_cutoff: date) -> int:
+        """
+        Elimina el historico anterior a `retention_cutoff`. Con la tabla particionada
+        se borran particiones completas (DROP, sin tuplas muertas), asi que la
+        retencion se redondea a la semana; sin particionar se hace DELETE por filas.
+
+        Cada particion se separa con `DETACH PARTITION ... CONCURRENTLY` (fuera de
+        transaccion: no bloquea lecturas ni escrituras del historico) antes del DROP.
+        Con particion DEFAULT PostgreSQL no lo admite y se usa el DETACH normal. Las
+        filas devueltas son la estimacion de `pg_class.reltuples`, sin recorrer la tabla.
+        """
         with get_db_conn() as conn:
             with get_cursor(conn) as cur:
-                cur.execute("DELETE FROM precios_historicos WHERE fecha < %s", [retention_cutoff])
-                return cur.rowcount
+                if not self._partitioned(cur):
+                    cur.execute("DELETE FROM precios_historicos WHERE fecha < %s", [retention_cutoff])
+                    return cur.rowcount
+
+                expired = [(name, start, end) for name, start, end in self._partitions(cur) if end <= retention_cutoff]
+                if not expired:
+                    return 0
+                cur.execute(
+                    "SELECT relname AS name, reltuples::bigint AS total FROM pg_class WHERE relname = ANY(%s)",
+                    [[name for name, _, _ in expired]],
+                )
+                # reltuples = -1: la particion nunca se ha analizado.
+                estimates = {row["name"]: max(int(row["total"]), 0) for row in cur.fetchall()}
+                concurrently = " CONCURRENTLY" if not self._has_default_partition(cur) else ""
+            conn.commit()
+
+            conn.autocommit = True
+            try:
+                with get_cursor(conn) as cur:
+                    dropped_rows = 0
+                    for name, start, end in expired:
+                        cur.execute(f"ALTER TABLE precios_historicos DETACH PARTITION {name}{concurrently}")
+                        cur.execute(f"DROP TABLE {name}")
+                        dropped_rows += estimates.get(name, 0)
+                        self._covered_weeks.discard(start)
+                        logger.info("🧹 Particion de historico eliminada: %s (%s..%s)", name, start, end)
+                    return dropped_rows
+            finally:
+                conn.autocommit = False
 
     def upsert_daily_prices(self, rows: list[tuple]) -> int:
         if not rows:
@@ -26,6 +154,9 @@ class HistoryRepository:
 
         with get_db_conn() as conn:
             with get_cursor(conn) as cur:
+                if self._partitioned(cur):
+                    fechas = [row[1] for row in rows]
+                    self._ensure_partitions(cur, min(fechas), max(fechas))
                 execute_values(
                     cur,
                     """
@@ -45,7 +176,41 @@ class HistoryRepository:
                 )
         return len(rows)
 
+    def copy_snapshot_prices(self, fecha: date, ids: Optional[set[str]] = None) -> int:
+        """
+        Escribe el historico de `fecha` con los precios actuales de `gasolineras` (solo
+        `ids` si se indica) en una sola sentencia: un dia nuevo sin datos nuevos del
+        ministerio no necesita volver a descargar ni parsear el feed.
+        """
+        where = "WHERE ideess = ANY(%s)" if ids is not None else ""
+        params: list = [fecha] + ([list(ids)] if ids is not None else [])
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                if self._partitioned(cur):
+                    self._ensure_partitions(cur, fecha, fecha)
+                cur.execute(
+                    f"""
+                    INSERT INTO precios_historicos
+                        (ideess, fecha, p95, p95p, p98, pa, pb, pp, pdr)
+                    SELECT ideess, %s, precio_95_e5, precio_95_e5_premium, precio_98_e5,
+                           precio_gasoleo_a, precio_gasoleo_b, precio_gasoleo_premium, precio_diesel_renovable
+                    FROM gasolineras
+                    {where}
+                    ON CONFLICT (ideess, fecha) DO UPDATE SET
+                        p95 = EXCLUDED.p95,
+                        p95p = EXCLUDED.p95p,
+                        p98 = EXCLUDED.p98,
+                        pa  = EXCLUDED.pa,
+                        pb  = EXCLUDED.pb,
+                        pp  = EXCLUDED.pp,
+                        pdr = EXCLUDED.pdr
+                    """,
+                    params,
+                )
+                return max(cur.rowcount, 0)
+
     def get_history(self, ideess: str, fecha_desde: date, fecha_hasta: date) -> list[dict]:
+        # El rango sobre `fecha` (clave de particion) limita la lectura a las particiones del periodo.
         with get_db_conn() as conn:
             with get_cursor(conn) as cur:
                 cur.execute(
@@ -58,3 +223,18 @@ class HistoryRepository:
                     [ideess, fecha_desde, fecha_hasta],
                 )
                 return [dict(r) for r in cur.fetchall()]
+
+    def get_history_bulk(self, ids: list[str], fecha_desde: date, fecha_hasta: date) -> list[dict]:
+        """Historico de varias estaciones en una sola consulta, ordenado por IDEESS y fecha."""
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                cur.execute(
+                    """
+                    SELECT ideess, fecha, p95, p95p, p98, pa, pb, pp, pdr
+                    FROM precios_historicos
+                    WHERE ideess = ANY(%s) AND fecha BETWEEN %s AND %s
+                    ORDER BY ideess, fecha ASC
+                    """,
+                    [list(ids), fecha_desde, fecha_hasta],
+                )
+                return [dict(r) for r in cur.fetchall()]
@@ -1,7 +1,9 @@
 """Rutas HTTP ligeras para gasolineras (orquestadores)."""
-from typing import Annotated, Optional
+from datetime import date, datetime
+from typing import Annotated, Callable, Literal, Optional
 
-from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
 from app.clients.gcs_client import GCSClient
 from app.clients.gobierno_client import GobiernoClient
@@ -14,11 +16,13 @@ from app.repositories.history_repository import HistoryRepository
 from app.services.export_service import ExportService
 from app.services.gasolinera_service import GasolineraService
 from app.services.memory_store import MemoryStore
+from app.services.mvt import MVT_MEDIA_TYPE
+from app.services.response_cache import ResponseCache
 from app.services.sync_service import SyncService
 
 router = APIRouter(prefix="/gasolineras", tags=["Gasolineras"])
 
-_gas_repo = GasolinerasRepository()
+_gas_repo = GasolinerasRepository(load_method=settings.snapshot_load_method)
 _history_repo = HistoryRepository()
 _memory_store = MemoryStore()
 _gobierno_client = GobiernoClient()
@@ -45,6 +49,7 @@ _gas_service = GasolineraService(
     history_repo=_history_repo,
     memory_store=_memory_store,
     history_retention_days=settings.history_retention_days,
+    response_cache=ResponseCache(max_entries=settings.response_cache_max_entries),
 )
 
 
@@ -69,6 +74,28 @@ def _validate_internal_secret(x_internal_secret: Optional[str]) -> None:
         raise HTTPException(status_code=403, detail="Forbidden")
 
 
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [item.strip() for item in if_none_match.split(",")]
+    # If-None-Match usa comparacion debil: ignoramos el prefijo W/.
+    return "*" in candidates or etag in [item.removeprefix("W/") for item in candidates]
+
+
+def _conditional(request: Request, response: Response, endpoint: str, params: tuple, compute: Callable[[], dict]):
+    """Responde 304 si el cliente ya tiene la version actual; si no, calcula y anade ETag."""
+    etag = _gas_service.etag_for(endpoint, params)
+    if etag is None:
+        return compute()
+
+    cache_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    response.headers.update(cache_headers)
+    return compute()
+
+
 @router.post(
     "/markers",
     response_model=dict,
@@ -82,7 +109,9 @@ def _validate_internal_secret(x_internal_secret: Optional[str]) -> None:
     },
 )
 def get_gasolineras_markers(viewport: MarkersViewport):
-    return _gas_service.get_markers(viewport)
+    # Sin ETag: en un POST un If-None-Match que coincide exigiria 412, no 304 (RFC 9110 §13.1.2).
+    slot = _gas_service.open_slot(viewport.abierta_ahora, viewport.abierta_en)
+    return _gas_service.get_markers(viewport, slot)
 
 
 @router.get(
@@ -91,19 +120,80 @@ def get_gasolineras_markers(viewport: MarkersViewport):
     summary="Obtener gasolineras",
     description="Obtiene la lista de gasolineras con soporte para filtros y paginación.",
     responses={
+        304: {"description": "Sin cambios (If-None-Match)"},
         422: {"description": "Parámetros inválidos"},
         500: {"description": "Error interno"},
         503: {"description": "Fuente no disponible"},
     },
 )
 def get_gasolineras(
+    request: Request,
+    response: Response,
     provincia: Annotated[Optional[str], Query(description="Filtrar por provincia")] = None,
     municipio: Annotated[Optional[str], Query(description="Filtrar por municipio")] = None,
     precio_max: Annotated[Optional[float], Query(description="Precio máximo gasolina 95")] = None,
     skip: Annotated[int, Query(ge=0, description="Elementos a saltar")] = 0,
     limit: Annotated[int, Query(ge=1, le=20000, description="Número máximo de resultados")] = 100,
+    paginacion: Annotated[
+        Literal["offset", "cursor"],
+        Query(description="'offset' (skip/limit) o 'cursor' (keyset con next_cursor)"),
+    ] = "offset",
+    cursor: Annotated[Optional[str], Query(description="Cursor opaco devuelto en next_cursor")] = None,
+    orden: Annotated[Literal["ideess", "precio"], Query(description="Orden del modo cursor")] = "ideess",
+    total: Annotated[
+        Literal["exacto", "estimado", "no"],
+        Query(description="Cálculo del total en modo cursor"),
+    ] = "exacto",
+    abierta_ahora: Annotated[bool, Query(description="Solo estaciones abiertas ahora (hora peninsular)")] = False,
+    abierta_en: Annotated[Optional[datetime], Query(description="Solo estaciones abiertas en ese instante (ISO 8601)")] = None,
 ):
-    return _gas_service.list_gasolineras(provincia, municipio, precio_max, skip, limit)
+    # El cuarto de hora forma parte de la clave: el ETag cambia cuando cambia la franja.
+    slot = _gas_service.open_slot(abierta_ahora, abierta_en)
+    if paginacion == "cursor" or cursor:
+        return _conditional(
+            request,
+            response,
+            "list-keyset",
+            (provincia, municipio, precio_max, orden, cursor, limit, total, slot),
+            lambda: _gas_service.list_gasolineras_keyset(
+                provincia, municipio, precio_max, orden, cursor, limit, total, slot
+            ),
+        )
+
+    return _conditional(
+        request,
+        response,
+        "list",
+        (provincia, municipio, precio_max, skip, limit, slot),
+        lambda: _gas_service.list_gasolineras(provincia, municipio, precio_max, skip, limit, slot),
+    )
+
+
+@router.get(
+    "/tiles/{z}/{x}/{y}.mvt",
+    summary="Tesela vectorial (MVT) de gasolineras",
+    description=(
+        "Mapbox Vector Tile con la capa `clusters` (count, p95) hasta zoom 13 "
+        "y la capa `gasolineras` (id, p95) a partir de zoom 14."
+    ),
+    response_class=Response,
+    responses={
+        200: {"content": {MVT_MEDIA_TYPE: {}}},
+        304: {"description": "Sin cambios (If-None-Match)"},
+        422: {"description": "Tesela fuera de rango"},
+        500: {"description": "Error interno"},
+        503: {"description": "Fuente no disponible"},
+    },
+)
+def get_tile(z: int, x: int, y: int, request: Request):
+    headers = {"Cache-Control": f"public, max-age={settings.tiles_cache_max_age_s}"}
+    etag = _gas_service.etag_for("tile", (z, x, y))
+    if etag is not None:
+        headers["ETag"] = etag
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+    return Response(content=_gas_service.tile(z, x, y), media_type=MVT_MEDIA_TYPE, headers=headers)
 
 
 @router.get(
@@ -120,8 +210,10 @@ def gasolineras_cerca(
     lon: Annotated[float, Query(ge=-180, le=180)],
     km: Annotated[float, Query(gt=0, le=200)] = 50,
     limit: Annotated[int, Query(ge=1, le=500)] = 100,
+    abierta_ahora: Annotated[bool, Query(description="Solo estaciones abiertas ahora (hora peninsular)")] = False,
+    abierta_en: Annotated[Optional[datetime], Query(description="Solo estaciones abiertas en ese instante (ISO 8601)")] = None,
 ):
-    return _gas_service.nearby(lat, lon, km, limit)
+    return _gas_service.nearby(lat, lon, km, limit, _gas_service.open_slot(abierta_ahora, abierta_en))
 
 
 @router.post(
@@ -146,6 +238,26 @@ def snapshot_status():
     return _gas_service.snapshot_status()
 
 
+@router.get(
+    "/stream",
+    summary="Exportar el snapshot completo en NDJSON",
+    description=(
+        "Devuelve una gasolinera por línea (application/x-ndjson), leída por lotes. "
+        "`campos` limita las claves de cada línea, p. ej. `IDEESS,Latitud,Longitud,Precio Gasolina 95 E5`."
+    ),
+    response_class=StreamingResponse,
+    responses={
+        422: {"description": "Campos inválidos"},
+        500: {"description": "Error interno"},
+        503: {"description": "Fuente no disponible"},
+    },
+)
+def stream_gasolineras(
+    campos: Annotated[Optional[str], Query(description="Lista de campos separada por comas")] = None,
+):
+    return StreamingResponse(_gas_service.stream_ndjson(campos), media_type="application/x-ndjson")
+
+
 @router.post(
     "/ensure-fresh",
     response_model=dict,
@@ -204,6 +316,7 @@ def daily_sync_export(
     response_model=dict,
     summary="Obtener estadísticas de precios",
     responses={
+        304: {"description": "Sin cambios (If-None-Match)"},
         404: {"description": "Sin datos"},
         422: {"description": "Parámetros inválidos"},
         500: {"description": "Error interno"},
@@ -211,10 +324,38 @@ def daily_sync_export(
     },
 )
 def obtener_estadisticas(
+    request: Request,
+    response: Response,
     provincia: Annotated[Optional[str], Query()] = None,
     municipio: Annotated[Optional[str], Query()] = None,
 ):
-    return _gas_service.stats(provincia, municipio)
+    return _conditional(
+        request,
+        response,
+        "stats",
+        (provincia, municipio),
+        lambda: _gas_service.stats(provincia, municipio),
+    )
+
+
+# Declarada antes de "/{id}" para que "historial" no se interprete como un IDEESS.
+@router.get(
+    "/historial",
+    response_model=dict,
+    summary="Historial de precios de varias gasolineras",
+    description=(
+        "Series diarias de varias estaciones en una sola consulta, en formato columnar: "
+        "un eje `fechas` común y, por estación, una lista de precios alineada por combustible."
+    ),
+    responses={422: {"description": "Parámetros inválidos"}, 500: {"description": "Error interno"}},
+)
+def get_historial_precios_bulk(
+    ids: Annotated[list[str], Query(description="IDEESS (ids=1&ids=2 o ids=1,2)")],
+    dias: Annotated[int, Query(ge=1, le=365, description="Días hacia atrás si no se indica fecha_desde")] = 30,
+    fecha_desde: Annotated[Optional[date], Query(description="Inicio del rango (incluido)")] = None,
+    fecha_hasta: Annotated[Optional[date], Query(description="Fin del rango (incluido); por defecto hoy")] = None,
+):
+    return _gas_service.historial_bulk(ids, dias, fecha_desde, fecha_hasta)
 
 
 @router.get(
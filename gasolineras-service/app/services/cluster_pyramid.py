@@ -0,0 +1,81 @@
+"""Piramide de clusters precalculada por tamano de rejilla para el mapa."""
+from typing import Optional
+
+import numpy as np
+
+# (zoom maximo, tamano de celda en grados). A partir de zoom 14 se muestran estaciones.
+ZOOM_GRID_SIZES = (
+    (5, 0.45),
+    (6, 0.30),
+    (7, 0.20),
+    (8, 0.12),
+    (9, 0.08),
+    (10, 0.05),
+    (11, 0.03),
+    (12, 0.018),
+    (13, 0.010),
+)
+CLUSTER_GRID_SIZES = tuple(size for _zoom, size in ZOOM_GRID_SIZES)
+MAX_CLUSTERS = 1500
+_KEY_OFFSET = 1 << 20
+
+
+def grid_size_for_zoom(zoom: int) -> Optional[float]:
+    for max_zoom, grid_size in ZOOM_GRID_SIZES:
+        if zoom <= max_zoom:
+            return grid_size
+    return None
+
+
+class ClusterLevel:
+    """
+    Celdas de un tamano de rejilla: numero de estaciones, precio minimo y posicion
+    de la estacion mas barata (igual que `ST_SnapToGrid` + `ARRAY_AGG ORDER BY precio`).
+    Las celdas se guardan ordenadas por latitud para consultar el viewport por rango.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, prices: np.ndarray, grid_size: float) -> None:
+        self.grid_size = grid_size
+        located = np.flatnonzero(~(np.isnan(lats) | np.isnan(lons)))
+        cell_rows = np.round(lats[located] / grid_size).astype(np.int64)
+        cell_cols = np.round(lons[located] / grid_size).astype(np.int64)
+        # Clave entera unica por celda (lat/lon acotadas) para agrupar con un unique 1D.
+        keys = (cell_rows + _KEY_OFFSET) * (2 * _KEY_OFFSET) + (cell_cols + _KEY_OFFSET)
+        _cells, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+
+        # Primera fila de cada celda en orden (celda, precio NaN al final) = representante mas barato.
+        cell_prices = prices[located]
+        order = np.lexsort((cell_prices, inverse))
+        starts = np.flatnonzero(np.diff(inverse[order], prepend=-1))
+        first = order[starts]
+        representatives = located[first]
+
+        min_prices = cell_prices[first]
+        by_lat = np.argsort(lats[representatives], kind="stable")
+        self.lat = lats[representatives][by_lat]
+        self.lon = lons[representatives][by_lat]
+        self.count = counts[by_lat].astype(np.int64)
+        self.min_price = min_prices[by_lat]
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+    def cells_in_bbox(self, lat_sw: float, lon_sw: float, lat_ne: float, lon_ne: float) -> np.ndarray:
+        """Posiciones de las celdas cuyo representante cae en la caja, por `count` descendente."""
+        start = np.searchsorted(self.lat, lat_sw, side="left")
+        end = np.searchsorted(self.lat, lat_ne, side="right")
+        positions = np.arange(start, end)
+        lons = self.lon[positions]
+        positions = positions[(lons >= lon_sw) & (lons <= lon_ne)]
+        order = np.argsort(-self.count[positions], kind="stable")
+        return positions[order[:MAX_CLUSTERS]]
+
+
+class ClusterPyramid:
+    """Un `ClusterLevel` por cada tamano de rejilla usado por el mapa."""
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, prices: np.ndarray) -> None:
+        self.levels = {grid_size: ClusterLevel(lats, lons, prices, grid_size) for grid_size in CLUSTER_GRID_SIZES}
+
+    def level(self, grid_size: float) -> ClusterLevel:
+        return self.levels[grid_size]
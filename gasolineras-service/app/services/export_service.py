@@ -1,5 +1,8 @@
 """Servicio de exportacion de snapshot a Parquet en GCS."""
+import importlib
 from datetime import datetime, timezone
+from itertools import chain
+from typing import Iterator
 
 from fastapi import HTTPException
 
@@ -22,7 +25,46 @@ from app.services.memory_store import MemoryStore
 from app.services.sync_service import SyncService
 
 
+PRICE_EXPORT_KEYS = (
+    (KEY_P95, "precio_95_e5"),
+    (KEY_P95_PREMIUM, "precio_95_e5_premium"),
+    (KEY_P98, "precio_98_e5"),
+    (KEY_GASOLEO_A, "precio_gasoleo_a"),
+    (KEY_GASOLEO_B, "precio_gasoleo_b"),
+    (KEY_GASOLEO_PREMIUM, "precio_gasoleo_premium"),
+    ("Precio Gasóleo Premium", "precio_gasoleo_premium"),
+    (KEY_DIESEL_RENOVABLE, "precio_diesel_renovable"),
+)
+
+
+def export_schema():
+    """Esquema fijo del Parquet: con escritura por lotes no se puede inferir de la tabla entera."""
+    pa = importlib.import_module("pyarrow")
+    segmento = pa.struct([("dias", pa.list_(pa.int64())), ("apertura", pa.string()), ("cierre", pa.string())])
+    horario_parsed = pa.struct(
+        [("texto", pa.string()), ("siempre_abierto", pa.bool_()), ("segmentos", pa.list_(segmento))]
+    )
+    return pa.schema(
+        [
+            ("IDEESS", pa.string()),
+            (KEY_ROTULO, pa.string()),
+            ("Municipio", pa.string()),
+            ("Provincia", pa.string()),
+            (KEY_DIRECCION, pa.string()),
+            *((key, pa.string()) for key, _ in PRICE_EXPORT_KEYS),
+            ("Latitud", pa.float64()),
+            ("Longitud", pa.float64()),
+            ("Horario", pa.string()),
+            ("Horario_parsed", horario_parsed),
+            ("fecha_registro", pa.int64()),
+        ]
+    )
+
+
 class ExportService:
+    # Filas por lote del cursor y por row group del Parquet: acota la memoria del export.
+    EXPORT_BATCH_SIZE = 5000
+
     def __init__(
         self,
         settings: Settings,
@@ -51,55 +93,49 @@ class ExportService:
         except Exception:
             return ""
 
-    def _build_export_record(self, base: dict, fecha_registro_ms: int) -> dict:
-        return {
-            "IDEESS": str(base.get("ideess") or "").strip(),
-            KEY_ROTULO: base.get("rotulo") or "",
-            "Municipio": base.get("municipio") or "",
-            "Provincia": base.get("provincia") or "",
-            KEY_DIRECCION: base.get("direccion") or "",
-            KEY_P95: self._format_price(base.get("precio_95_e5")),
-            KEY_P95_PREMIUM: self._format_price(base.get("precio_95_e5_premium")),
-            KEY_P98: self._format_price(base.get("precio_98_e5")),
-            KEY_GASOLEO_A: self._format_price(base.get("precio_gasoleo_a")),
-            KEY_GASOLEO_B: self._format_price(base.get("precio_gasoleo_b")),
-            KEY_GASOLEO_PREMIUM: self._format_price(base.get("precio_gasoleo_premium")),
-            "Precio Gasóleo Premium": self._format_price(base.get("precio_gasoleo_premium")),
-            KEY_DIESEL_RENOVABLE: self._format_price(base.get("precio_diesel_renovable")),
-            "Latitud": base.get("latitud"),
-            "Longitud": base.get("longitud"),
-            "Horario": base.get("horario"),
-            "Horario_parsed": base.get("horario_parsed"),
-            "fecha_registro": fecha_registro_ms,
+    def _export_columns(self, rows: list[dict], fecha_registro_ms: int) -> dict[str, list]:
+        """Transpone un lote de filas a columnas, con el formato de precios del ministerio."""
+        columns = {
+            "IDEESS": [str(row.get("ideess") or "").strip() for row in rows],
+            KEY_ROTULO: [row.get("rotulo") or "" for row in rows],
+            "Municipio": [row.get("municipio") or "" for row in rows],
+            "Provincia": [row.get("provincia") or "" for row in rows],
+            KEY_DIRECCION: [row.get("direccion") or "" for row in rows],
         }
-
-    def _snapshot_rows_for_export_memory(self) -> tuple[list[dict], datetime]:
+        for key, column in PRICE_EXPORT_KEYS:
+            columns[key] = [self._format_price(row.get(column)) for row in rows]
+        columns["Latitud"] = [row.get("latitud") for row in rows]
+        columns["Longitud"] = [row.get("longitud") for row in rows]
+        columns["Horario"] = [row.get("horario") for row in rows]
+        columns["Horario_parsed"] = [row.get("horario_parsed") for row in rows]
+        columns["fecha_registro"] = [fecha_registro_ms] * len(rows)
+        return columns
+
+    def _export_batches_memory(self) -> tuple[Iterator[list[dict]], datetime]:
         self.sync_service.ensure_memory_snapshot_loaded("export-raw")
-        raw_rows, reference_dt = self.memory_store.export_rows()
-        fecha_registro_ms = int(reference_dt.timestamp() * 1000)
-        return [self._build_export_record(row, fecha_registro_ms) for row in raw_rows], reference_dt
-
-    def _snapshot_rows_for_export_postgres(self) -> tuple[list[dict], datetime]:
-        rows = self.gas_repo.snapshot_export_rows()
-        if not rows:
+        return self.memory_store.export_batches(self.EXPORT_BATCH_SIZE)
+
+    def _export_batches_postgres(self) -> tuple[Iterator[list[dict]], datetime]:
+        # Con sync incremental `actualizado_en` es el ultimo cambio de cada fila; el
+        # registro exportado lleva la fecha del snapshot, como en el modo en memoria.
+        reference_dt = self.gas_repo.get_snapshot_state().get("last_sync_at") or datetime.now(timezone.utc)
+        if reference_dt.tzinfo is None:
+            reference_dt = reference_dt.replace(tzinfo=timezone.utc)
+
+        batches = self.gas_repo.iter_snapshot_batches(self.EXPORT_BATCH_SIZE)
+        # El primer lote se lee aqui para responder 404 antes de abrir la subida.
+        first = next(batches, [])
+        if not first:
             raise LookupError("No hay snapshot en PostgreSQL para exportar")
+        return chain([first], batches), reference_dt
 
-        updated_candidates = [r.get("actualizado_en") for r in rows if isinstance(r.get("actualizado_en"), datetime)]
-        max_updated = max(updated_candidates) if updated_candidates else datetime.now(timezone.utc)
-
-        records = []
-        for row in rows:
-            updated_at = row.get("actualizado_en") or max_updated
-            if updated_at.tzinfo is None:
-                updated_at = updated_at.replace(tzinfo=timezone.utc)
-            records.append(self._build_export_record(row, int(updated_at.timestamp() * 1000)))
-
-        return records, max_updated
-
-    def _snapshot_rows_for_export(self) -> tuple[list[dict], datetime]:
+    def _export_batches(self) -> tuple[Iterator[dict[str, list]], datetime]:
         if self.sync_service.memory_mode:
-            return self._snapshot_rows_for_export_memory()
-        return self._snapshot_rows_for_export_postgres()
+            batches, reference_dt = self._export_batches_memory()
+        else:
+            batches, reference_dt = self._export_batches_postgres()
+        fecha_registro_ms = int(reference_dt.timestamp() * 1000)
+        return (self._export_columns(rows, fecha_registro_ms) for rows in batches), reference_dt
 
     def _build_export_blob_path(self, reference_dt: datetime) -> str:
         prefix = self._normalize_prefix(self.settings.raw_export_gcs_prefix)
@@ -113,13 +149,14 @@ class ExportService:
             raise HTTPException(status_code=500, detail="RAW_EXPORT_GCS_BUCKET no configurado")
 
         try:
-            records, reference_dt = self._snapshot_rows_for_export()
+            batches, reference_dt = self._export_batches()
         except LookupError as exc:
             raise HTTPException(status_code=404, detail=str(exc)) from exc
 
         blob_path = self._build_export_blob_path(reference_dt)
-        uri = self.gcs_client.upload_parquet(
-            records=records,
+        uri, rows = self.gcs_client.upload_parquet_batches(
+            batches=batches,
+            schema=export_schema(),
             bucket_name=self.settings.raw_export_gcs_bucket,
             blob_path=blob_path,
             compression=self.settings.raw_export_parquet_compression,
@@ -127,7 +164,7 @@ class ExportService:
 
         return {
             "ok": True,
-            "rows": len(records),
+            "rows": rows,
             "snapshot_date": reference_dt.astimezone(SPAIN_TZ).date().isoformat(),
             "gcs_uri": uri,
             "gcs_path": blob_path,
@@ -1,11 +1,16 @@
 """
 Servicio para obtener datos de gasolineras desde la API del Gobierno de España
 """
+import io
 import os
 import re
+import json
+import hashlib
+import tempfile
 import logging
 import httpx
-from typing import List, Dict, Optional
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional
 
 from app.services.constants import (
     KEY_DIESEL_RENOVABLE,
@@ -16,6 +21,7 @@ from app.services.constants import (
     KEY_P95_PREMIUM,
     KEY_P98,
 )
+from app.services.sync_metrics import StageTimings
 
 logger = logging.getLogger(__name__)
 
@@ -80,6 +86,16 @@ _DIA_A_ISO: dict[str, int] = {
     "D": 7,  # Domingo
 }
 
+_RE_RANGO_DIAS = re.compile(r'^([LMXJVSD])-([LMXJVSD])$')
+_RE_24H = re.compile(r'^24\s*[Hh]')
+_RE_SEGMENTO = re.compile(
+    r'^([LMXJVSD][LMXJVSD,\-]*)\s*:\s*(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2})\s*$',
+    re.IGNORECASE,
+)
+
+# Hay unos cientos de horarios distintos para ~12k estaciones.
+HORARIO_CACHE_SIZE = 4096
+
 
 def _expand_dias(dias_str: str) -> list[int]:
     """
@@ -88,7 +104,7 @@ def _expand_dias(dias_str: str) -> list[int]:
     """
     dias_str = dias_str.strip().upper()
     # Rango tipo L-V (exactamente 3 chars: letra-guion-letra)
-    m = re.match(r'^([LMXJVSD])-([LMXJVSD])$', dias_str)
+    m = _RE_RANGO_DIAS.match(dias_str)
     if m:
         s, e = _DIA_A_ISO.get(m.group(1)), _DIA_A_ISO.get(m.group(2))
         if s and e:
@@ -125,10 +141,19 @@ def parse_horario(raw: Optional[str]) -> Optional[dict]:
     """
     if not raw or not raw.strip():
         return None
+    return _parse_horario_cached(raw)
+
+
+@lru_cache(maxsize=HORARIO_CACHE_SIZE)
+def _parse_horario_cached(raw: str) -> dict:
+    """
+    Memoiza `parse_horario` por texto crudo. Las estaciones con el mismo horario
+    comparten el dict devuelto, que debe tratarse como solo lectura.
+    """
     texto = raw.strip()
 
     # 24H / siempre abierto
-    if re.match(r'^24\s*[Hh]', texto):
+    if _RE_24H.match(texto):
         return {"texto": texto, "siempre_abierto": True, "segmentos": []}
 
     segmentos = []
@@ -137,11 +162,7 @@ def parse_horario(raw: Optional[str]) -> Optional[dict]:
         if not parte:
             continue
         # Segmento: "L-D: 07:00-22:00"  o  "L,M,X: 08:00-20:00"
-        m = re.match(
-            r'^([LMXJVSD][LMXJVSD,\-]*)\s*:\s*(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2})\s*$',
-            parte,
-            re.IGNORECASE,
-        )
+        m = _RE_SEGMENTO.match(parte)
         if m:
             dias = _expand_dias(m.group(1))
             if dias:
@@ -156,6 +177,12 @@ def parse_horario(raw: Optional[str]) -> Optional[dict]:
     return {"texto": texto, "siempre_abierto": False, "segmentos": segmentos}
 
 
+def horario_cache_stats() -> dict:
+    """Contadores acumulados de la cache de `parse_horario` (aciertos, fallos, tamano)."""
+    info = _parse_horario_cached.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+
+
 # ---------------------------------------------------------------------------
 
 def parse_gasolinera(raw_data: Dict) -> Optional[Dict]:
@@ -194,69 +221,205 @@ def parse_gasolinera(raw_data: Dict) -> Optional[Dict]:
         logger.warning(f"⚠️ Error procesando registro {raw_data.get('IDEESS')}: {e}")
         return None
 
-def fetch_data_gobierno() -> List[Dict]:
+# ---------------------------------------------------------------------------
+# Lectura incremental de la respuesta
+# ---------------------------------------------------------------------------
+
+LISTA_KEY = "ListaEESSPrecio"
+_JSON_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _JsonStream:
+    """Buffer de texto que se rellena bajo demanda con los trozos de la respuesta."""
+
+    def __init__(self, chunks: Iterable[str]) -> None:
+        self._chunks = iter(chunks)
+        self.buf = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def read_more(self) -> bool:
+        # Descarta lo ya consumido para que el buffer no crezca con toda la respuesta.
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self.buf += chunk
+                return True
+        self.exhausted = True
+        return False
+
+    def peek(self) -> str:
+        """Siguiente caracter significativo (salta espacios); "" al final del cuerpo."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read_more():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"JSON inesperado en la respuesta: se esperaba '{char}'")
+        self.pos += 1
+
+    def value(self):
+        """Decodifica el siguiente valor completo, pidiendo mas datos si esta cortado."""
+        self.peek()
+        while True:
+            try:
+                value, end = _JSON_DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise ValueError("Respuesta JSON truncada o invalida")
+                continue
+            # Un escalar al final del buffer podria seguir en el siguiente trozo.
+            if end == len(self.buf) and not self.exhausted and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_lista_eess(chunks: Iterable[str], meta: Optional[dict] = None) -> Iterator[Dict]:
     """
-    Obtiene datos actualizados de gasolineras desde la API del gobierno
+    Recorre el objeto raiz de la respuesta a medida que llegan los trozos de texto
+    y emite cada elemento de `ListaEESSPrecio` sin materializar la lista completa.
+    El resto de claves de primer nivel (Fecha, Nota, ...) se guardan en `meta`.
+    """
+    stream = _JsonStream(chunks)
+    if stream.peek() == "\ufeff":
+        stream.pos += 1
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key == LISTA_KEY and stream.peek() == "[":
+            stream.pos += 1
+            if stream.peek() != "]":
+                while True:
+                    yield stream.value()
+                    if stream.peek() != ",":
+                        break
+                    stream.pos += 1
+            stream.expect("]")
+        else:
+            value = stream.value()
+            if meta is not None:
+                meta[key] = value
+        if stream.peek() != ",":
+            break
+        stream.pos += 1
+    stream.expect("}")
+
+
+class UpstreamNotModified(Exception):
     """
+    Los datos no han cambiado desde la ultima descarga aplicada: la API respondio 304
+    (`reason="upstream-not-modified"`) o el cuerpo tiene el mismo sha256
+    (`reason="upstream-same-fingerprint"`).
+    """
+
+    def __init__(self, reason: str = "upstream-not-modified") -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _conditional_headers(validators: Optional[dict]) -> dict:
+    headers = {}
+    if validators and validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators and validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+# Cuerpo descargado antes de parsear: hasta este tamano en memoria, el resto a disco.
+BODY_SPOOL_MAX_BYTES = 4 * 1024 * 1024
+BODY_READ_CHUNK_CHARS = 64 * 1024
+
+
+def _iter_body_text(body, encoding: str) -> Iterator[str]:
+    with io.TextIOWrapper(body, encoding=encoding) as text:
+        while True:
+            chunk = text.read(BODY_READ_CHUNK_CHARS)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _iter_parsed_body(body, encoding: str, meta: Optional[dict], timings: StageTimings) -> Iterator[Dict]:
+    """Emite cada gasolinera parseada del cuerpo ya descargado (y cierra `body` al terminar)."""
+    recibidos = 0
+    procesadas = 0
+    errores = 0
+    sin_coordenadas = 0
+    try:
+        for raw_item in timings.timed_iter("decode", iter_lista_eess(_iter_body_text(body, encoding), meta)):
+            recibidos += 1
+            with timings.stage("parse"):
+                parsed = parse_gasolinera(raw_item) if isinstance(raw_item, dict) else None
+            if not parsed:
+                errores += 1
+                continue
+            if parsed.get("Latitud") is None or parsed.get("Longitud") is None:
+                sin_coordenadas += 1
+            procesadas += 1
+            yield parsed
+    except ValueError as e:
+        logger.error(f"❌ Error al parsear respuesta: {e}")
+        raise
+    finally:
+        body.close()
+    timings.count("decode", recibidos)
+    timings.count("parse", procesadas)
+
+    if not recibidos:
+        logger.warning("⚠️ La API no devolvió datos")
+        return
+
+    logger.info(f"📥 Recibidos {recibidos} registros de la API")
+    if errores > 0:
+        logger.warning(f"⚠️ {errores} registros no pudieron procesarse")
+    logger.info(f"✅ Procesadas {procesadas} gasolineras correctamente")
+    logger.info(f"📍 Registros sin coordenadas: {sin_coordenadas}")
+
+
+def _download_body(body, meta: Optional[dict], validators: Optional[dict], timings: StageTimings) -> str:
+    """Descarga el cuerpo a `body` calculando su sha256; devuelve la codificacion del texto."""
     try:
         logger.info(f"🌐 Consultando API del gobierno: {API_URL}")
-        
+        digest = hashlib.sha256()
+
         with get_http_client() as client:
-            response = client.get(API_URL)
-            response.raise_for_status()
-        
-        json_data = response.json()
-        
-        if not isinstance(json_data, dict):
-            raise ValueError("La respuesta de la API no es un objeto JSON válido")
-        
-        raw_list = json_data.get("ListaEESSPrecio", [])
-        
-        if not raw_list:
-            logger.warning("⚠️ La API no devolvió datos")
-            return []
-        
-        logger.info(f"📥 Recibidos {len(raw_list)} registros de la API")
-        
-        # DEBUG: Mostrar un registro de ejemplo
-        if raw_list:
-            ejemplo = raw_list[0]
-            logger.info(f"🔍 Ejemplo de registro crudo:")
-            logger.info(f"  - IDEESS: {ejemplo.get('IDEESS')}")
-            logger.info(f"  - Latitud (crudo): '{ejemplo.get('Latitud')}' (tipo: {type(ejemplo.get('Latitud'))})")
-            logger.info(f"  - Longitud (crudo): '{ejemplo.get('Longitud (WGS84)')}' (tipo: {type(ejemplo.get('Longitud (WGS84)'))})")
-        
-        # Parsear y filtrar registros válidos
-        gasolineras = []
-        errores = 0
-        sin_coordenadas = 0
-        
-        for raw_item in raw_list:
-            parsed = parse_gasolinera(raw_item)
-            if parsed:
-                # Verificar si tiene coordenadas válidas
-                if parsed.get("Latitud") is None or parsed.get("Longitud") is None:
-                    sin_coordenadas += 1
-                gasolineras.append(parsed)
-            else:
-                errores += 1
-        
-        if errores > 0:
-            logger.warning(f"⚠️ {errores} registros no pudieron procesarse")
-        
-        logger.info(f"✅ Procesadas {len(gasolineras)} gasolineras correctamente")
-        logger.info(f"📍 Registros sin coordenadas: {sin_coordenadas}")
-        
-        # Mostrar un ejemplo parseado
-        if gasolineras:
-            ejemplo_parseado = gasolineras[0]
-            logger.info(f"🔍 Ejemplo parseado:")
-            logger.info(f"  - IDEESS: {ejemplo_parseado.get('IDEESS')}")
-            logger.info(f"  - Latitud: {ejemplo_parseado.get('Latitud')} (tipo: {type(ejemplo_parseado.get('Latitud'))})")
-            logger.info(f"  - Longitud: {ejemplo_parseado.get('Longitud')} (tipo: {type(ejemplo_parseado.get('Longitud'))})")
-        
-        return gasolineras
-        
+            with client.stream("GET", API_URL, headers=_conditional_headers(validators)) as response:
+                if response.status_code == 304:
+                    raise UpstreamNotModified()
+                response.raise_for_status()
+                for chunk in timings.timed_iter("fetch", response.iter_bytes()):
+                    digest.update(chunk)
+                    body.write(chunk)
+                encoding = response.encoding or "utf-8"
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+
+        sha256 = digest.hexdigest()
+        timings.count("fetch", body.tell())
+        if meta is not None:
+            meta.update({"etag": etag, "last_modified": last_modified, "sha256": sha256})
+        if validators and validators.get("sha256") == sha256:
+            raise UpstreamNotModified("upstream-same-fingerprint")
+        return encoding
+
+    except UpstreamNotModified as e:
+        if e.reason == "upstream-not-modified":
+            logger.info("ℹ️ La API del gobierno respondió 304: datos sin republicar")
+        else:
+            logger.info("ℹ️ La API del gobierno devolvió el mismo cuerpo (sha256) que el último sync")
+        raise
     except httpx.TimeoutException:
         logger.error(f"❌ Timeout al consultar la API (>{REQUEST_TIMEOUT}s)")
         raise
@@ -270,9 +433,42 @@ def fetch_data_gobierno() -> List[Dict]:
     except httpx.RequestError as e:
         logger.error(f"❌ Error en la petición: {e}")
         raise
-    except ValueError as e:
-        logger.error(f"❌ Error al parsear respuesta: {e}")
-        raise
     except Exception as e:
         logger.error(f"❌ Error inesperado: {e}")
-        raise
\ No newline at end of file
+        raise
+
+
+def stream_data_gobierno(
+    meta: Optional[dict] = None,
+    validators: Optional[dict] = None,
+    timings: Optional[StageTimings] = None,
+) -> Iterator[Dict]:
+    """
+    Descarga la API del gobierno y devuelve un iterador de gasolineras parseadas. El
+    cuerpo se descarga entero (a un fichero temporal, en memoria hasta
+    `BODY_SPOOL_MAX_BYTES`) antes de parsear nada, para decidir primero si los datos
+    han cambiado; despues se parsea por trozos, sin arbol JSON ni lista completa.
+
+    `validators` (`etag`, `last_modified`) se envian como peticion condicional; si la
+    API responde 304, o el sha256 del cuerpo coincide con `validators["sha256"]`, se
+    lanza `UpstreamNotModified` sin parsear. `meta` recibe `etag`, `last_modified` y
+    `sha256` al descargar y las claves de primer nivel del JSON al recorrer el
+    iterador. Con `timings` se separa el tiempo de red (`fetch`), de JSON (`decode`)
+    y de `parse_gasolinera` (`parse`).
+    """
+    timings = timings or StageTimings()
+    body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_MAX_BYTES)
+    try:
+        encoding = _download_body(body, meta, validators, timings)
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return _iter_parsed_body(body, encoding, meta, timings)
+
+
+def fetch_data_gobierno() -> List[Dict]:
+    """
+    Obtiene datos actualizados de gasolineras desde la API del gobierno
+    """
+    return list(stream_data_gobierno())
@@ -1,15 +1,22 @@
 """Servicio de consultas y casos de uso de gasolineras."""
+import base64
+import hashlib
+import json
+import logging
 import re
 from datetime import date, datetime, timedelta, timezone
-from math import atan2, cos, isfinite, radians, sin, sqrt
-from typing import Optional
+from itertools import chain
+from math import isfinite
+from typing import Iterable, Iterator, Optional
 
+import numpy as np
 from fastapi import HTTPException
 
 from app.decorators.with_memory_fallback import with_memory_fallback
 from app.models.viewport import MarkersViewport
 from app.repositories.gasolineras_repository import GasolinerasRepository
 from app.repositories.history_repository import HistoryRepository
+from app.services.cluster_pyramid import ClusterLevel, grid_size_for_zoom
 from app.services.constants import (
     KEY_DIESEL_RENOVABLE,
     KEY_DIRECCION,
@@ -22,12 +29,31 @@ from app.services.constants import (
     KEY_ROTULO,
     SPAIN_TZ,
 )
+from app.services.horario_bitmap import slot_for
 from app.services.memory_store import MemoryStore
+from app.services.mvt import MVT_BUFFER, encode_point_layer, optional_float, tile_bounds
+from app.services.price_stats import price_stats_by_fuel, price_stats_from_aggregate
+from app.services.response_cache import ResponseCache
 from app.services.sync_service import SyncService
 
+logger = logging.getLogger(__name__)
+
 
 class GasolineraService:
     _TEXT_FILTER_RE = re.compile(r"^[A-Za-z0-9ÁÉÍÓÚÜÑáéíóúüñÇç'\-\.\s]+$")
+    STREAM_BATCH_SIZE = 2000
+    HISTORY_BULK_MAX_IDS = 50
+    HISTORY_MAX_DAYS = 365
+    # Columna de precios_historicos -> nombre del combustible en las respuestas de historial.
+    HISTORY_FUELS = {
+        "p95": "Gasolina 95 E5",
+        "p95p": "Gasolina 95 E5 Premium",
+        "p98": "Gasolina 98 E5",
+        "pa": "Gasóleo A",
+        "pb": "Gasóleo B",
+        "pp": "Gasóleo Premium",
+        "pdr": "Diésel Renovable",
+    }
 
     def __init__(
         self,
@@ -36,12 +62,18 @@ class GasolineraService:
         history_repo: HistoryRepository,
         memory_store: MemoryStore,
         history_retention_days: int,
+        response_cache: Optional[ResponseCache] = None,
     ) -> None:
         self.sync_service = sync_service
         self.gas_repo = gas_repo
         self.history_repo = history_repo
         self.memory_store = memory_store
         self.history_retention_days = history_retention_days
+        self.response_cache = response_cache or ResponseCache(max_entries=0)
+        # (version del snapshot, {provincia | None (nacional): (total, combustibles)})
+        self._province_stats: tuple[Optional[str], dict] = (None, {})
+        self._cluster_pyramid_state: tuple[Optional[str], bool] = (None, False)
+        sync_service.add_snapshot_listener(self.refresh_province_stats)
 
     def enable_memory_fallback(self, reason: str, exc: Exception) -> bool:
         if self.sync_service.memory_mode:
@@ -49,6 +81,25 @@ class GasolineraService:
         self.sync_service.activate_memory_mode(f"{reason}-db-failed: {exc}")
         return True
 
+    def _cached(self, endpoint: str, params: tuple, compute):
+        version = self.sync_service.current_snapshot_version()
+        return self._flag_stale(self.response_cache.get_or_compute(version, (endpoint, *params), compute))
+
+    def _flag_stale(self, result):
+        """Marca `stale: true` las respuestas servidas desde un snapshot de un dia anterior."""
+        if isinstance(result, dict) and self.sync_service.snapshot_stale:
+            return {**result, "stale": True}
+        return result
+
+    def etag_for(self, endpoint: str, params: tuple) -> Optional[str]:
+        """ETag fuerte derivado de la version del snapshot y los parametros de la consulta."""
+        version = self.sync_service.current_snapshot_version()
+        if version is None:
+            return None
+        key = (version, self.sync_service.snapshot_stale, endpoint, params)
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32]
+        return f'"{digest}"'
+
     @staticmethod
     def _fmt(val) -> str:
         if val is None:
@@ -80,33 +131,7 @@ class GasolineraService:
 
     @staticmethod
     def _grid_size_for_zoom(zoom: int) -> Optional[float]:
-        if zoom <= 5:
-            return 0.45
-        if zoom <= 6:
-            return 0.30
-        if zoom <= 7:
-            return 0.20
-        if zoom <= 8:
-            return 0.12
-        if zoom <= 9:
-            return 0.08
-        if zoom <= 10:
-            return 0.05
-        if zoom <= 11:
-            return 0.03
-        if zoom <= 12:
-            return 0.018
-        if zoom <= 13:
-            return 0.010
-        return None
-
-    @staticmethod
-    def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-        r = 6371.0
-        dlat = radians(lat2 - lat1)
-        dlon = radians(lon2 - lon1)
-        a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-        return r * 2 * atan2(sqrt(a), sqrt(1 - a))
+        return grid_size_for_zoom(zoom)
 
     def _validate_text_filter(self, field_name: str, value: Optional[str], max_length: int = 120) -> Optional[str]:
         if value is None:
@@ -154,6 +179,17 @@ class GasolineraService:
         if viewport.lon_sw >= viewport.lon_ne:
             raise HTTPException(status_code=400, detail="lon_sw must be lower than lon_ne")
 
+    @staticmethod
+    def open_slot(abierta_ahora: bool, abierta_en: Optional[datetime]) -> Optional[int]:
+        """Cuarto de hora semanal para filtrar por horario (None = sin filtro)."""
+        if abierta_en is not None:
+            if abierta_ahora:
+                raise HTTPException(status_code=422, detail="Usa abierta_ahora o abierta_en, no ambos")
+            return slot_for(abierta_en)
+        if abierta_ahora:
+            return slot_for(datetime.now(SPAIN_TZ))
+        return None
+
     @staticmethod
     def _bbox_payload(viewport: MarkersViewport) -> dict:
         return {
@@ -163,44 +199,47 @@ class GasolineraService:
             "lon_sw": viewport.lon_sw,
         }
 
-    def _memory_rows_in_viewport(self, viewport: MarkersViewport) -> list[dict]:
-        return [
-            row
-            for row in self.memory_store.snapshot_rows
-            if row.get("latitud") is not None
-            and row.get("longitud") is not None
-            and viewport.lat_sw <= float(row["latitud"]) <= viewport.lat_ne
-            and viewport.lon_sw <= float(row["longitud"]) <= viewport.lon_ne
-        ]
-
-    def _memory_cluster_markers(self, filtered: list[dict], grid_size: float) -> list[dict]:
-        grouped: dict[tuple[float, float], dict] = {}
-        for row in filtered:
-            lat = float(row["latitud"])
-            lon = float(row["longitud"])
-            key = (round(lat / grid_size) * grid_size, round(lon / grid_size) * grid_size)
-            item = grouped.setdefault(key, {"count": 0, "min_price": None})
-            item["count"] += 1
-            price = row.get("precio_95_e5")
-            if price is not None:
-                item["min_price"] = price if item["min_price"] is None else min(item["min_price"], price)
+    def _memory_indices_in_viewport(self, viewport: MarkersViewport) -> np.ndarray:
+        return self.memory_store.indices_in_bbox(viewport.lat_sw, viewport.lon_sw, viewport.lat_ne, viewport.lon_ne)
 
-        markers = [
+    def _memory_cluster_markers(
+        self, viewport: MarkersViewport, grid_size: float, abierta_slot: Optional[int] = None
+    ) -> list[dict]:
+        columns = self.memory_store.columns
+        if abierta_slot is None:
+            level = columns.clusters.level(grid_size)
+        else:
+            # La piramide precalculada incluye todas las estaciones: con filtro se agrupan solo las abiertas.
+            indices = self.memory_store.filter_indices(abierta_slot=abierta_slot)
+            level = ClusterLevel(
+                columns.lat[indices], columns.lon[indices], columns.prices["precio_95_e5"][indices], grid_size
+            )
+        positions = level.cells_in_bbox(viewport.lat_sw, viewport.lon_sw, viewport.lat_ne, viewport.lon_ne)
+        return [
             {
                 "type": "cluster",
-                "latitude": lat,
-                "longitude": lon,
-                "count": data["count"],
-                "min_precio_95_e5": self._fmt(data.get("min_price")),
+                "latitude": float(level.lat[pos]),
+                "longitude": float(level.lon[pos]),
+                "count": int(level.count[pos]),
+                "min_precio_95_e5": self._fmt(None if np.isnan(level.min_price[pos]) else float(level.min_price[pos])),
             }
-            for (lat, lon), data in grouped.items()
+            for pos in positions.tolist()
         ]
-        markers.sort(key=lambda marker: marker["count"], reverse=True)
-        return markers[:1500]
 
-    def _memory_station_markers(self, filtered: list[dict]) -> list[dict]:
-        filtered.sort(key=lambda row: (row.get("precio_95_e5") is None, row.get("precio_95_e5"), row.get("ideess")))
-        return [{"type": "station", "station": self.row_to_api(row)} for row in filtered[:2000]]
+    def _cluster_pyramid_ready(self) -> bool:
+        """Indica si `gasolineras_clusters` esta poblada (se comprueba una vez por version del snapshot)."""
+        version = self.sync_service.current_snapshot_version()
+        cached_version, ready = self._cluster_pyramid_state
+        if version is None or cached_version != version:
+            ready = self.gas_repo.cluster_pyramid_ready()
+            self._cluster_pyramid_state = (version, ready)
+        return ready
+
+    def _memory_station_markers(self, indices: np.ndarray) -> list[dict]:
+        columns = self.memory_store.columns
+        order = np.lexsort((columns.ideess[indices].astype(str), columns.prices["precio_95_e5"][indices]))
+        rows = self.memory_store.rows_at(indices[order[:2000]])
+        return [{"type": "station", "station": self.row_to_api(row)} for row in rows]
 
     def _markers_response(self, mode: str, zoom: int, markers: list[dict], viewport: MarkersViewport) -> dict:
         return {
@@ -212,26 +251,45 @@ class GasolineraService:
         }
 
     @with_memory_fallback("markers")
-    def get_markers(self, viewport: MarkersViewport) -> dict:
+    def get_markers(self, viewport: MarkersViewport, abierta_slot: Optional[int] = None) -> dict:
         self.sync_service.maybe_auto_sync_on_read("markers")
         self._validate_viewport(viewport)
+        if self.sync_service.memory_mode:
+            self.sync_service.ensure_memory_snapshot_loaded("markers")
+
+        params = (viewport.lat_ne, viewport.lon_ne, viewport.lat_sw, viewport.lon_sw, viewport.zoom, abierta_slot)
+        return self._cached("markers", params, lambda: self._markers(viewport, abierta_slot))
+
+    def _markers(self, viewport: MarkersViewport, abierta_slot: Optional[int] = None) -> dict:
         grid_size = self._grid_size_for_zoom(viewport.zoom)
 
         if self.sync_service.memory_mode:
-            self.sync_service.ensure_memory_snapshot_loaded("markers")
-            filtered = self._memory_rows_in_viewport(viewport)
             if grid_size is not None:
-                return self._markers_response("cluster", viewport.zoom, self._memory_cluster_markers(filtered, grid_size), viewport)
-            return self._markers_response("station", viewport.zoom, self._memory_station_markers(filtered), viewport)
+                markers = self._memory_cluster_markers(viewport, grid_size, abierta_slot)
+                return self._markers_response("cluster", viewport.zoom, markers, viewport)
+            indices = self.memory_store.open_indices(self._memory_indices_in_viewport(viewport), abierta_slot)
+            return self._markers_response("station", viewport.zoom, self._memory_station_markers(indices), viewport)
 
         if grid_size is not None:
-            rows = self.gas_repo.cluster_markers(
-                lon_sw=viewport.lon_sw,
-                lat_sw=viewport.lat_sw,
-                lon_ne=viewport.lon_ne,
-                lat_ne=viewport.lat_ne,
-                grid_size=grid_size,
-            )
+            # Con la piramide precalculada el viewport es una busqueda por rango; si no existe
+            # (tabla sin migrar o vacia) o hay filtro de horario se agrega en vivo.
+            if abierta_slot is None and self._cluster_pyramid_ready():
+                rows = self.gas_repo.precomputed_cluster_markers(
+                    lon_sw=viewport.lon_sw,
+                    lat_sw=viewport.lat_sw,
+                    lon_ne=viewport.lon_ne,
+                    lat_ne=viewport.lat_ne,
+                    grid_size=grid_size,
+                )
+            else:
+                rows = self.gas_repo.cluster_markers(
+                    lon_sw=viewport.lon_sw,
+                    lat_sw=viewport.lat_sw,
+                    lon_ne=viewport.lon_ne,
+                    lat_ne=viewport.lat_ne,
+                    grid_size=grid_size,
+                    abierta_slot=abierta_slot,
+                )
             markers = [
                 {
                     "type": "cluster",
@@ -249,10 +307,48 @@ class GasolineraService:
             lat_sw=viewport.lat_sw,
             lon_ne=viewport.lon_ne,
             lat_ne=viewport.lat_ne,
+            abierta_slot=abierta_slot,
         )
         markers = [{"type": "station", "station": self.row_to_api(row)} for row in rows]
         return self._markers_response("station", viewport.zoom, markers, viewport)
 
+    @with_memory_fallback("tiles")
+    def tile(self, z: int, x: int, y: int) -> bytes:
+        """Tesela MVT: capa `clusters` (count, p95) hasta zoom 13 y `gasolineras` (id, p95) desde zoom 14."""
+        self.sync_service.maybe_auto_sync_on_read("tiles")
+        if not (0 <= z <= 22) or not (0 <= x < 2**z and 0 <= y < 2**z):
+            raise HTTPException(status_code=422, detail="Tesela fuera de rango")
+        if self.sync_service.memory_mode:
+            self.sync_service.ensure_memory_snapshot_loaded("tiles")
+
+        return self._cached("tile", (z, x, y), lambda: self._tile(z, x, y))
+
+    def _tile(self, z: int, x: int, y: int) -> bytes:
+        grid_size = self._grid_size_for_zoom(z)
+        bounds = tile_bounds(z, x, y, buffer=MVT_BUFFER)
+
+        if not self.sync_service.memory_mode:
+            if grid_size is not None:
+                return self.gas_repo.cluster_tile(z, x, y, bounds, grid_size, precomputed=self._cluster_pyramid_ready())
+            return self.gas_repo.station_tile(z, x, y, bounds)
+
+        columns = self.memory_store.columns
+        if grid_size is not None:
+            level = columns.clusters.level(grid_size)
+            positions = level.cells_in_bbox(*bounds)
+            properties = {
+                "count": level.count[positions].tolist(),
+                "p95": [optional_float(value) for value in level.min_price[positions].tolist()],
+            }
+            return encode_point_layer("clusters", level.lat[positions], level.lon[positions], properties, z, x, y)
+
+        indices = columns.spatial.indices_in_bbox(*bounds)
+        properties = {
+            "id": [str(value) for value in columns.ideess[indices].tolist()],
+            "p95": [optional_float(value) for value in columns.prices["precio_95_e5"][indices].tolist()],
+        }
+        return encode_point_layer("gasolineras", columns.lat[indices], columns.lon[indices], properties, z, x, y)
+
     @with_memory_fallback("list")
     def list_gasolineras(
         self,
@@ -261,6 +357,7 @@ class GasolineraService:
         precio_max: Optional[float],
         skip: int,
         limit: int,
+        abierta_slot: Optional[int] = None,
     ) -> dict:
         self.sync_service.maybe_auto_sync_on_read("list")
 
@@ -268,12 +365,30 @@ class GasolineraService:
         municipio = self._validate_text_filter("municipio", municipio)
         if precio_max is not None and not isfinite(float(precio_max)):
             raise HTTPException(status_code=422, detail="precio_max debe ser un número finito")
-
         if self.sync_service.memory_mode:
             self.sync_service.ensure_memory_snapshot_loaded("list")
-            filtered = self.memory_store.filter_rows(provincia=provincia, municipio=municipio, precio_max=precio_max)
-            total = len(filtered)
-            page = filtered[skip: skip + limit]
+
+        return self._cached(
+            "list",
+            (provincia, municipio, precio_max, skip, limit, abierta_slot),
+            lambda: self._list(provincia, municipio, precio_max, skip, limit, abierta_slot),
+        )
+
+    def _list(
+        self,
+        provincia: Optional[str],
+        municipio: Optional[str],
+        precio_max: Optional[float],
+        skip: int,
+        limit: int,
+        abierta_slot: Optional[int] = None,
+    ) -> dict:
+        if self.sync_service.memory_mode:
+            filtered = self.memory_store.filter_indices(
+                provincia=provincia, municipio=municipio, precio_max=precio_max, abierta_slot=abierta_slot
+            )
+            total = int(filtered.size)
+            page = self.memory_store.rows_at(filtered[skip: skip + limit])
             return {
                 "total": total,
                 "skip": skip,
@@ -283,7 +398,7 @@ class GasolineraService:
                 "storage_mode": "memory-fallback",
             }
 
-        total, rows = self.gas_repo.list_rows(provincia, municipio, precio_max, skip, limit)
+        total, rows = self.gas_repo.list_rows(provincia, municipio, precio_max, skip, limit, abierta_slot)
         return {
             "total": total,
             "skip": skip,
@@ -293,29 +408,157 @@ class GasolineraService:
             "storage_mode": "postgres",
         }
 
+    @staticmethod
+    def _encode_cursor(order_by: str, row: dict) -> str:
+        if order_by == "precio":
+            price = row.get("precio_95_e5")
+            key = [float(price) if price is not None else None, str(row.get("ideess"))]
+        else:
+            key = [str(row.get("ideess"))]
+        raw = json.dumps({"o": order_by, "k": key}, separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: str, order_by: str) -> tuple:
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+            key = payload["k"]
+            valid_shape = len(key) == 2 if order_by == "precio" else len(key) == 1
+            if payload.get("o") != order_by or not valid_shape:
+                raise ValueError("cursor no corresponde al orden solicitado")
+            if order_by == "precio" and key[0] is not None and not isfinite(float(key[0])):
+                raise ValueError("precio no finito")
+            return tuple(key)
+        except Exception as exc:
+            raise HTTPException(status_code=422, detail="cursor inválido") from exc
+
+    @with_memory_fallback("list-keyset")
+    def list_gasolineras_keyset(
+        self,
+        provincia: Optional[str],
+        municipio: Optional[str],
+        precio_max: Optional[float],
+        order_by: str,
+        cursor: Optional[str],
+        limit: int,
+        total_mode: str,
+        abierta_slot: Optional[int] = None,
+    ) -> dict:
+        """Listado paginado por cursor opaco (`next_cursor`), estable entre paginas."""
+        self.sync_service.maybe_auto_sync_on_read("list")
+
+        provincia = self._validate_text_filter("provincia", provincia)
+        municipio = self._validate_text_filter("municipio", municipio)
+        if precio_max is not None and not isfinite(float(precio_max)):
+            raise HTTPException(status_code=422, detail="precio_max debe ser un número finito")
+        after = self._decode_cursor(cursor, order_by) if cursor else None
+        if self.sync_service.memory_mode:
+            self.sync_service.ensure_memory_snapshot_loaded("list")
+
+        return self._cached(
+            "list-keyset",
+            (provincia, municipio, precio_max, order_by, after, limit, total_mode, abierta_slot),
+            lambda: self._list_keyset(
+                provincia, municipio, precio_max, order_by, after, limit, total_mode, abierta_slot
+            ),
+        )
+
+    def _list_keyset(
+        self,
+        provincia: Optional[str],
+        municipio: Optional[str],
+        precio_max: Optional[float],
+        order_by: str,
+        after: Optional[tuple],
+        limit: int,
+        total_mode: str,
+        abierta_slot: Optional[int] = None,
+    ) -> dict:
+        if self.sync_service.memory_mode:
+            total, indices = self.memory_store.keyset_indices(
+                provincia, municipio, precio_max, order_by, after, limit, abierta_slot
+            )
+            rows = self.memory_store.rows_at(indices)
+            # En memoria el total exacto es gratis: se devuelve siempre salvo que se pida "no".
+            total_type = None if total_mode == "no" else "exacto"
+            storage_mode = "memory-fallback"
+        else:
+            total, rows = self.gas_repo.list_rows_keyset(
+                provincia, municipio, precio_max, order_by, after, limit, total_mode, abierta_slot
+            )
+            has_filters = bool(provincia or municipio or precio_max is not None or abierta_slot is not None)
+            total_type = None if total is None else ("estimado" if total_mode == "estimado" and not has_filters else "exacto")
+            storage_mode = "postgres"
+
+        page = rows[:limit]
+        next_cursor = self._encode_cursor(order_by, page[-1]) if len(rows) > limit and page else None
+        return {
+            "total": None if total_type is None else total,
+            "total_tipo": total_type,
+            "orden": order_by,
+            "limit": limit,
+            "count": len(page),
+            "gasolineras": [self.row_to_api(row) for row in page],
+            "next_cursor": next_cursor,
+            "storage_mode": storage_mode,
+        }
+
+    def _stream_fields(self, campos: Optional[str]) -> Optional[list[str]]:
+        if not campos:
+            return None
+        allowed = set(self.row_to_api({}))
+        fields = [field.strip() for field in campos.split(",") if field.strip()]
+        unknown = [field for field in fields if field not in allowed]
+        if unknown or not fields:
+            raise HTTPException(status_code=422, detail=f"campos no válidos: {', '.join(unknown) or campos}")
+        return list(dict.fromkeys(fields))
+
+    def _ndjson_chunks(self, batches: Iterable[list[dict]], fields: Optional[list[str]]) -> Iterator[bytes]:
+        for batch in batches:
+            lines = []
+            for row in batch:
+                record = self.row_to_api(row)
+                if fields is not None:
+                    record = {field: record[field] for field in fields}
+                lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str))
+            if lines:
+                yield ("\n".join(lines) + "\n").encode("utf-8")
+
+    @with_memory_fallback("stream")
+    def stream_ndjson(self, campos: Optional[str]) -> Iterator[bytes]:
+        """
+        Snapshot completo como NDJSON (una gasolinera por linea), leido por lotes
+        para que la memoria no crezca con el tamano del snapshot.
+        """
+        self.sync_service.maybe_auto_sync_on_read("stream")
+        fields = self._stream_fields(campos)
+
+        if self.sync_service.memory_mode:
+            self.sync_service.ensure_memory_snapshot_loaded("stream")
+            batches = self.memory_store.iter_batches(self.STREAM_BATCH_SIZE)
+        else:
+            batches = self.gas_repo.iter_snapshot_batches(self.STREAM_BATCH_SIZE)
+
+        # Leemos el primer lote antes de devolver el iterador: si la BD falla, el error
+        # salta aqui (antes de enviar cabeceras) y el fallback a memoria puede actuar.
+        first = next(batches, [])
+        return self._ndjson_chunks(chain([first], batches), fields)
+
     @with_memory_fallback("nearby")
-    def nearby(self, lat: float, lon: float, km: float, limit: int) -> dict:
+    def nearby(self, lat: float, lon: float, km: float, limit: int, abierta_slot: Optional[int] = None) -> dict:
         self.sync_service.maybe_auto_sync_on_read("nearby")
         self._validate_geo_query_inputs(lat, lon, km, limit)
 
         if self.sync_service.memory_mode:
             self.sync_service.ensure_memory_snapshot_loaded("nearby")
-            rows = []
-            for row in self.memory_store.snapshot_rows:
-                row_lat = row.get("latitud")
-                row_lon = row.get("longitud")
-                if row_lat is None or row_lon is None:
-                    continue
-                dist = self._haversine_km(lat, lon, float(row_lat), float(row_lon))
-                if dist <= km:
-                    copy_row = dict(row)
-                    copy_row["distancia_km"] = dist
-                    rows.append(copy_row)
-            rows.sort(key=lambda item: item["distancia_km"])
-            rows = rows[:limit]
+            rows = [
+                {**row, "distancia_km": dist}
+                for row, dist in self.memory_store.rows_within_km(lat, lon, km, limit=limit, abierta_slot=abierta_slot)
+            ]
             storage_mode = "memory-fallback"
         else:
-            rows = self.gas_repo.nearby_rows(lat, lon, km, limit)
+            rows = self.gas_repo.nearby_rows(lat, lon, km, limit, abierta_slot)
             storage_mode = "postgres"
 
         payload = []
@@ -324,19 +567,23 @@ class GasolineraService:
             item["distancia_km"] = float(row["distancia_km"]) if row.get("distancia_km") is not None else None
             payload.append(item)
 
-        return {
+        return self._flag_stale({
             "ubicacion": {"lat": lat, "lon": lon},
             "radio_km": km,
             "count": len(payload),
             "gasolineras": payload,
             "storage_mode": storage_mode,
-        }
+        })
 
     @with_memory_fallback("count")
     def count(self) -> dict:
         if self.sync_service.memory_mode:
             self.sync_service.ensure_memory_snapshot_loaded("count")
-            total = len(self.memory_store.snapshot_rows)
+        return self._cached("count", (), self._count)
+
+    def _count(self) -> dict:
+        if self.sync_service.memory_mode:
+            total = self.memory_store.count()
             return {"total": total, "mensaje": f"Total de gasolineras: {total}", "storage_mode": "memory-fallback"}
 
         total = self.gas_repo.count()
@@ -352,63 +599,110 @@ class GasolineraService:
             "last_sync_at": state["last_sync_at"].isoformat() if state["last_sync_at"] else None,
             "timezone": "Europe/Madrid",
             "storage_mode": "memory-fallback" if self.sync_service.memory_mode else "postgres",
+            "response_cache": self.response_cache.stats(),
+        }
+
+    def _province_stats_memory(self) -> dict:
+        columns = self.memory_store.columns
+        table = {None: (len(columns), price_stats_by_fuel(columns.prices))}
+        provincias = columns.categories["provincia"]
+        order = np.argsort(provincias.codes, kind="stable")
+        boundaries = np.flatnonzero(np.diff(provincias.codes[order])) + 1
+        for group in np.split(order, boundaries):
+            if group.size:
+                prices = {field: values[group] for field, values in columns.prices.items()}
+                table[provincias[int(group[0])]] = (int(group.size), price_stats_by_fuel(prices))
+        return table
+
+    def _province_stats_postgres(self) -> dict:
+        return {
+            None if row["es_total"] else (row.get("provincia") or ""): (
+                int(row["total"]),
+                price_stats_from_aggregate(row),
+            )
+            for row in self.gas_repo.stats_aggregate_by_provincia()
         }
 
+    def refresh_province_stats(self) -> None:
+        """Precalcula las estadisticas nacionales y por provincia de la version actual del snapshot."""
+        version = self.sync_service.current_snapshot_version()
+        if version is None:
+            return
+        if self.sync_service.memory_mode:
+            table = self._province_stats_memory()
+        else:
+            table = self._province_stats_postgres()
+        self._province_stats = (version, table)
+        logger.info("📊 Estadísticas precalculadas para %s provincias (%s)", len(table) - 1, version)
+
+    def _precomputed_stats(self, provincia: Optional[str], municipio: Optional[str]) -> Optional[tuple[int, dict]]:
+        """Estadisticas precalculadas si el filtro equivale a una sola provincia (o a ninguna)."""
+        if municipio:
+            return None
+        version = self.sync_service.current_snapshot_version()
+        if version is None:
+            return None
+        if self._province_stats[0] != version:
+            self.refresh_province_stats()
+
+        cached_version, table = self._province_stats
+        if cached_version != version:
+            return None
+        if not provincia:
+            return table.get(None)
+        # El filtro es un "contiene": solo sirve la entrada precalculada si casa con una unica provincia.
+        needle = provincia.lower()
+        matches = [name for name in table if name is not None and needle in name.lower()]
+        return table[matches[0]] if len(matches) == 1 else None
+
     @with_memory_fallback("stats")
     def stats(self, provincia: Optional[str], municipio: Optional[str]) -> dict:
         self.sync_service.maybe_auto_sync_on_read("stats")
 
         provincia = self._validate_text_filter("provincia", provincia)
         municipio = self._validate_text_filter("municipio", municipio)
-
         if self.sync_service.memory_mode:
             self.sync_service.ensure_memory_snapshot_loaded("stats")
-            rows = self.memory_store.filter_rows(provincia=provincia, municipio=municipio)
+
+        result = self._cached("stats", (provincia, municipio), lambda: self._stats(provincia, municipio))
+        # La hora de la respuesta no forma parte del valor cacheado.
+        return {**result, "timestamp": datetime.now(timezone.utc).isoformat()}
+
+    def _stats(self, provincia: Optional[str], municipio: Optional[str]) -> dict:
+        precomputed = self._precomputed_stats(provincia, municipio)
+        if precomputed is not None:
+            total_rows, fuels = precomputed
+        elif self.sync_service.memory_mode:
+            indices = self.memory_store.filter_indices(provincia=provincia, municipio=municipio)
+            total_rows = int(indices.size)
+            fuels = price_stats_by_fuel(
+                {field: values[indices] for field, values in self.memory_store.columns.prices.items()}
+            )
         else:
-            rows = self.gas_repo.stats_rows(provincia=provincia, municipio=municipio)
+            row = self.gas_repo.stats_aggregate(provincia=provincia, municipio=municipio)
+            total_rows = int(row.get("total") or 0)
+            fuels = price_stats_from_aggregate(row)
 
-        if not rows:
+        if not total_rows:
             raise HTTPException(status_code=404, detail="No se encontraron gasolineras con los filtros especificados")
 
-        def price_stats(field: str) -> Optional[dict]:
-            precios = sorted(float(row[field]) for row in rows if row.get(field) is not None and float(row[field]) > 0)
-            if not precios:
-                return None
-            total = len(precios)
-            return {
-                "min": round(precios[0], 3),
-                "max": round(precios[-1], 3),
-                "media": round(sum(precios) / total, 3),
-                "mediana": round(precios[total // 2], 3),
-                "p25": round(precios[total // 4], 3),
-                "p75": round(precios[total * 3 // 4], 3),
-                "total_muestras": total,
-            }
-
-        fuels = {
-            "gasolina_95": price_stats("precio_95_e5"),
-            "gasolina_95_premium": price_stats("precio_95_e5_premium"),
-            "gasolina_98": price_stats("precio_98_e5"),
-            "gasoleo_a": price_stats("precio_gasoleo_a"),
-            "gasoleo_b": price_stats("precio_gasoleo_b"),
-            "gasoleo_premium": price_stats("precio_gasoleo_premium"),
-            "diesel_renovable": price_stats("precio_diesel_renovable"),
-        }
-
         return {
-            "total_gasolineras": len(rows),
+            "total_gasolineras": total_rows,
             "filtros": {"provincia": provincia, "municipio": municipio},
-            "combustibles": {k: v for k, v in fuels.items() if v is not None},
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "combustibles": fuels,
             "storage_mode": "memory-fallback" if self.sync_service.memory_mode else "postgres",
         }
 
     @with_memory_fallback("detail")
     def detail(self, ideess: str) -> dict:
         self.sync_service.maybe_auto_sync_on_read("detail")
-
         if self.sync_service.memory_mode:
             self.sync_service.ensure_memory_snapshot_loaded("detail")
+
+        return self._cached("detail", (ideess,), lambda: self._detail(ideess))
+
+    def _detail(self, ideess: str) -> dict:
+        if self.sync_service.memory_mode:
             row = self.memory_store.row_by_id(ideess)
         else:
             row = self.gas_repo.detail_row(ideess)
@@ -429,21 +723,11 @@ class GasolineraService:
         if origin_lat is None or origin_lon is None:
             return []
 
-        rows = []
-        for row in self.memory_store.snapshot_rows:
-            if str(row.get("ideess")) == str(ideess):
-                continue
-            row_lat = row.get("latitud")
-            row_lon = row.get("longitud")
-            if row_lat is None or row_lon is None:
-                continue
-            dist = self._haversine_km(float(origin_lat), float(origin_lon), float(row_lat), float(row_lon))
-            if dist <= radio_km:
-                item = dict(row)
-                item["distancia_km"] = dist
-                rows.append(item)
-
-        rows.sort(key=lambda item: item["distancia_km"])
+        rows = [
+            {**row, "distancia_km": dist}
+            for row, dist in self.memory_store.rows_within_km(float(origin_lat), float(origin_lon), radio_km, limit=11)
+            if str(row.get("ideess")) != str(ideess)
+        ]
         return rows[:10]
 
     def _serialize_distance_rows(self, rows: list[dict]) -> list[dict]:
@@ -467,12 +751,12 @@ class GasolineraService:
 
         payload = self._serialize_distance_rows(rows)
 
-        return {
+        return self._flag_stale({
             "origen": ideess,
             "radio_km": radio_km,
             "cantidad": len(payload),
             "gasolineras_cercanas": payload,
-        }
+        })
 
     @with_memory_fallback("historial")
     def historial(self, ideess: str, dias: int) -> dict:
@@ -481,7 +765,7 @@ class GasolineraService:
 
         if self.sync_service.memory_mode:
             self.sync_service.ensure_memory_snapshot_loaded("historial")
-            if not self.memory_store.row_by_id(ideess):
+            if not self.memory_store.has_id(ideess):
                 raise HTTPException(status_code=404, detail=f"No se encontró gasolinera con ID {ideess}")
             registros = self.memory_store.history_by_id(ideess, fecha_desde, fecha_hasta)
         else:
@@ -492,15 +776,7 @@ class GasolineraService:
         for row in registros:
             if isinstance(row.get("fecha"), date):
                 row["fecha"] = row["fecha"].isoformat()
-            row["precios"] = {
-                "Gasolina 95 E5": self._fmt(row.get("p95")),
-                "Gasolina 95 E5 Premium": self._fmt(row.get("p95p")),
-                "Gasolina 98 E5": self._fmt(row.get("p98")),
-                "Gasóleo A": self._fmt(row.get("pa")),
-                "Gasóleo B": self._fmt(row.get("pb")),
-                "Gasóleo Premium": self._fmt(row.get("pp")),
-                "Diésel Renovable": self._fmt(row.get("pdr")),
-            }
+            row["precios"] = {label: self._fmt(row.get(column)) for column, label in self.HISTORY_FUELS.items()}
 
         return {
             "IDEESS": ideess,
@@ -513,6 +789,79 @@ class GasolineraService:
             **({"mensaje": "No hay datos históricos disponibles para este período"} if not registros else {}),
         }
 
+    @staticmethod
+    def _parse_ids(ids: Iterable[str]) -> list[str]:
+        """IDEESS sin duplicados y en el orden recibido; admite `ids=1&ids=2` y `ids=1,2`."""
+        return list(dict.fromkeys(item.strip() for raw in ids for item in raw.split(",") if item.strip()))
+
+    @with_memory_fallback("historial-bulk")
+    def historial_bulk(
+        self,
+        ids: Iterable[str],
+        dias: int,
+        fecha_desde: Optional[date] = None,
+        fecha_hasta: Optional[date] = None,
+    ) -> dict:
+        ids = self._parse_ids(ids)
+        if not ids:
+            raise HTTPException(status_code=422, detail="ids no puede estar vacío")
+        if len(ids) > self.HISTORY_BULK_MAX_IDS:
+            raise HTTPException(status_code=422, detail=f"Como máximo {self.HISTORY_BULK_MAX_IDS} ids por consulta")
+        fecha_hasta = fecha_hasta or datetime.now(timezone.utc).date()
+        fecha_desde = fecha_desde or fecha_hasta - timedelta(days=dias)
+        if fecha_desde > fecha_hasta:
+            raise HTTPException(status_code=422, detail="fecha_desde no puede ser posterior a fecha_hasta")
+        if (fecha_hasta - fecha_desde).days > self.HISTORY_MAX_DAYS:
+            raise HTTPException(status_code=422, detail=f"El rango no puede superar {self.HISTORY_MAX_DAYS} días")
+        if self.sync_service.memory_mode:
+            self.sync_service.ensure_memory_snapshot_loaded("historial-bulk")
+
+        return self._cached(
+            "historial-bulk",
+            (tuple(ids), fecha_desde, fecha_hasta),
+            lambda: self._historial_bulk(ids, fecha_desde, fecha_hasta),
+        )
+
+    def _historial_bulk(self, ids: list[str], fecha_desde: date, fecha_hasta: date) -> dict:
+        if self.sync_service.memory_mode:
+            series_rows = self.memory_store.history_by_ids(ids, fecha_desde, fecha_hasta)
+            existing = {ideess for ideess in ids if self.memory_store.has_id(ideess)}
+        else:
+            series_rows: dict[str, list[dict]] = {}
+            for row in self.history_repo.get_history_bulk(ids, fecha_desde, fecha_hasta):
+                series_rows.setdefault(row["ideess"], []).append(row)
+            # Solo se consulta la existencia de las estaciones que no tienen historico.
+            missing = [ideess for ideess in ids if ideess not in series_rows]
+            existing = set(series_rows) | (self.gas_repo.existing_ids(missing) if missing else set())
+
+        # Eje de fechas comun: cada serie es una lista alineada con `fechas` (null si falta el dia).
+        fechas = sorted({row["fecha"] for rows in series_rows.values() for row in rows})
+        position = {fecha: pos for pos, fecha in enumerate(fechas)}
+        estaciones = {}
+        for ideess in ids:
+            if ideess not in series_rows:
+                continue
+            series = {column: [None] * len(fechas) for column in self.HISTORY_FUELS}
+            for row in series_rows[ideess]:
+                pos = position[row["fecha"]]
+                for column, values in series.items():
+                    value = row.get(column)
+                    values[pos] = None if value is None else round(float(value), 3)
+            estaciones[ideess] = {
+                column: values for column, values in series.items() if any(v is not None for v in values)
+            }
+
+        return {
+            "fecha_desde": fecha_desde.isoformat(),
+            "fecha_hasta": fecha_hasta.isoformat(),
+            "combustibles": dict(self.HISTORY_FUELS),
+            "fechas": [fecha.isoformat() for fecha in fechas],
+            "estaciones": estaciones,
+            "sin_historial": [ideess for ideess in ids if ideess in existing and ideess not in estaciones],
+            "no_encontradas": [ideess for ideess in ids if ideess not in existing],
+            "storage_mode": "memory-fallback" if self.sync_service.memory_mode else "postgres",
+        }
+
     def ensure_fresh(self) -> dict:
         with self.sync_service.sync_lock:
             state = self.sync_service.get_snapshot_state()
@@ -0,0 +1,35 @@
+"""Utilidades geograficas compartidas (distancias y cajas de busqueda)."""
+from math import atan2, cos, pi, radians, sin, sqrt
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+# Mismo radio que `haversine_km`: una caja con otro valor dejaria fuera puntos del borde.
+KM_PER_DEGREE_LAT = EARTH_RADIUS_KM * pi / 180
+# Holgura relativa de la caja frente a redondeos de coma flotante.
+_BBOX_PADDING = 1e-6
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+
+def bbox_for_radius(lat: float, lon: float, km: float) -> tuple[float, float, float, float]:
+    """Caja (lat_sw, lon_sw, lat_ne, lon_ne) que contiene el circulo de radio `km`."""
+    dlat = km * (1 + _BBOX_PADDING) / KM_PER_DEGREE_LAT
+    cos_lat = max(cos(radians(min(89.0, abs(lat) + dlat))), 1e-6)
+    dlon = min(180.0, km * (1 + _BBOX_PADDING) / (KM_PER_DEGREE_LAT * cos_lat))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def haversine_km_array(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Version vectorizada de `haversine_km` desde un punto a N coordenadas."""
+    lat_r = np.radians(lat)
+    lats_r = np.radians(lats)
+    dlat = lats_r - lat_r
+    dlon = np.radians(lons - lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat_r) * np.cos(lats_r) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
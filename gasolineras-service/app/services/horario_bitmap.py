@@ -0,0 +1,88 @@
+"""Horario semanal compilado a un bitmap de 7 x 96 cuartos de hora."""
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+from app.services.constants import SPAIN_TZ
+from app.services.fetch_gobierno import HORARIO_CACHE_SIZE, _expand_dias, parse_horario
+
+QUARTERS_PER_DAY = 96
+SLOTS_PER_WEEK = 7 * QUARTERS_PER_DAY
+BITMAP_BYTES = SLOTS_PER_WEEK // 8
+EMPTY_BITMAP = bytes(BITMAP_BYTES)
+
+# "L-D: 24H" no genera segmentos en `parse_horario`; aqui cuenta como dia completo.
+_RE_DIAS_24H = re.compile(r'^([LMXJVSD][LMXJVSD,\-]*)\s*:\s*24\s*H', re.IGNORECASE)
+
+
+def _minutes(hhmm: str) -> Optional[int]:
+    try:
+        hours, minutes = hhmm.split(":")
+        value = int(hours) * 60 + int(minutes)
+    except (AttributeError, ValueError):
+        return None
+    return value if 0 <= value <= 24 * 60 else None
+
+
+def _set_range(bits: np.ndarray, dia: int, start_min: int, end_min: int) -> None:
+    """Marca los cuartos que solapan [start_min, end_min) del dia ISO `dia`."""
+    base = (dia - 1) * QUARTERS_PER_DAY
+    bits[base + start_min // 15: base + -(-end_min // 15)] = True
+
+
+def bitmap_from_parsed(parsed: Optional[dict]) -> Optional[bytes]:
+    """
+    Compila un `horario_parsed` a 84 bytes: el bit `slot` (LSB primero dentro de cada
+    byte, como `get_bit` de PostgreSQL sobre bytea) indica si abre en ese cuarto.
+
+    Los tramos que cierran a la misma hora o antes de abrir continuan al dia
+    siguiente (22:00-06:00). Devuelve None si el horario no se pudo interpretar.
+    """
+    if not parsed:
+        return None
+    if parsed.get("siempre_abierto"):
+        return b"\xff" * BITMAP_BYTES
+    segmentos = parsed.get("segmentos") or []
+    dias_24h = [
+        dia
+        for parte in (parsed.get("texto") or "").split(";")
+        if (m := _RE_DIAS_24H.match(parte.strip()))
+        for dia in _expand_dias(m.group(1))
+    ]
+    if not segmentos and not dias_24h:
+        return None
+
+    bits = np.zeros(SLOTS_PER_WEEK, dtype=bool)
+    for dia in dias_24h:
+        _set_range(bits, dia, 0, 24 * 60)
+    for segmento in segmentos:
+        apertura, cierre = _minutes(segmento.get("apertura")), _minutes(segmento.get("cierre"))
+        if apertura is None or cierre is None:
+            continue
+        for dia in segmento.get("dias") or []:
+            if cierre > apertura:
+                _set_range(bits, dia, apertura, cierre)
+            else:
+                _set_range(bits, dia, apertura, 24 * 60)
+                _set_range(bits, dia % 7 + 1, 0, cierre)
+    return np.packbits(bits, bitorder="little").tobytes()
+
+
+@lru_cache(maxsize=HORARIO_CACHE_SIZE)
+def horario_bitmap(raw: Optional[str]) -> Optional[bytes]:
+    """Bitmap del texto `Horario` crudo (memoizado igual que `parse_horario`)."""
+    return bitmap_from_parsed(parse_horario(raw))
+
+
+def slot_for(moment: datetime) -> int:
+    """Cuarto de hora de la semana (0 = lunes 00:00) en hora peninsular; las horas sin zona se asumen locales."""
+    local = moment.astimezone(SPAIN_TZ) if moment.tzinfo else moment
+    return (local.isoweekday() - 1) * QUARTERS_PER_DAY + (local.hour * 60 + local.minute) // 15
+
+
+def open_mask(bitmaps: np.ndarray, slot: int) -> np.ndarray:
+    """Mascara de filas abiertas en `slot` a partir de la matriz (n, BITMAP_BYTES) uint8."""
+    return ((bitmaps[:, slot >> 3] >> (slot & 7)) & 1).astype(bool)
@@ -1,6 +1,8 @@
 """Almacen en memoria para fallback cuando PostgreSQL no esta disponible."""
 from datetime import datetime, date, timezone
-from typing import Optional
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
 
 from app.clients.gobierno_client import parse_float
 from app.services.constants import (
@@ -14,16 +16,23 @@ from app.services.constants import (
     KEY_P98,
     KEY_ROTULO,
 )
+from app.services.horario_bitmap import open_mask
+from app.services.price_history import PriceHistoryRing
+from app.services.snapshot_columns import SnapshotColumns
+from app.services.snapshot_file import read_snapshot_files, write_snapshot_files
 
 
 class MemoryStore:
     def __init__(self) -> None:
-        self.snapshot_rows: list[dict] = []
-        self.history: dict[str, list[dict]] = {}
+        self.columns = SnapshotColumns([], None)
+        self.history = PriceHistoryRing(capacity=30)
         self.last_sync_at: Optional[datetime] = None
 
     def has_snapshot(self) -> bool:
-        return bool(self.snapshot_rows)
+        return len(self.columns) > 0
+
+    def count(self) -> int:
+        return len(self.columns)
 
     def to_snapshot_row(self, source: dict, fecha_sync: datetime) -> dict:
         return {
@@ -47,35 +56,48 @@ class MemoryStore:
         }
 
     def replace_snapshot(self, datos_validos: list[dict], fecha_sync: datetime) -> int:
-        self.snapshot_rows = [self.to_snapshot_row(item, fecha_sync) for item in datos_validos]
+        columns = SnapshotColumns([self.to_snapshot_row(item, fecha_sync) for item in datos_validos], fecha_sync)
+        self.columns = columns
         self.last_sync_at = fecha_sync
-        return len(self.snapshot_rows)
+        return len(columns)
+
+    def save(self, directory: str) -> None:
+        """Guarda snapshot e historico en `directory` (Arrow IPC) para un arranque en caliente."""
+        if not self.has_snapshot() or self.last_sync_at is None:
+            return
+        write_snapshot_files(directory, self.columns, self.last_sync_at, self.history)
+
+    def load(self, directory: str) -> bool:
+        """Carga el snapshot guardado con `save`; False si no hay copia local utilizable."""
+        stored = read_snapshot_files(directory)
+        if stored is None:
+            return False
+        self.columns, self.last_sync_at, history = stored
+        if history is not None:
+            self.history = history
+        return True
 
     def update_history(self, fecha_sync: datetime, retention_days: int) -> int:
-        fecha_hoy = fecha_sync.date()
-        historico_count = 0
-        for row in self.snapshot_rows:
-            ideess = row.get("ideess")
-            if not ideess:
-                continue
-            history = self.history.setdefault(ideess, [])
-            history = [h for h in history if h.get("fecha") != fecha_hoy]
-            history.append(
-                {
-                    "ideess": ideess,
-                    "fecha": fecha_hoy,
-                    "p95": row.get("precio_95_e5"),
-                    "p95p": row.get("precio_95_e5_premium"),
-                    "p98": row.get("precio_98_e5"),
-                    "pa": row.get("precio_gasoleo_a"),
-                    "pb": row.get("precio_gasoleo_b"),
-                    "pp": row.get("precio_gasoleo_premium"),
-                    "pdr": row.get("precio_diesel_renovable"),
-                }
+        """Anade (o reescribe) el dia de `fecha_sync` con los precios del snapshot actual."""
+        self.history.resize(retention_days)
+        columns = self.columns
+        keep = np.flatnonzero([bool(ideess) for ideess in columns.ideess.tolist()])
+        ids = [str(ideess) for ideess in columns.ideess[keep].tolist()]
+        prices = {column: values[keep] for column, values in columns.prices.items()}
+        return self.history.append_day(fecha_sync.date(), ids, prices)
+
+    def filter_indices(
+        self,
+        provincia: Optional[str] = None,
+        municipio: Optional[str] = None,
+        precio_max: Optional[float] = None,
+        abierta_slot: Optional[int] = None,
+    ) -> np.ndarray:
+        return np.flatnonzero(
+            self.columns.filter_mask(
+                provincia=provincia, municipio=municipio, precio_max=precio_max, abierta_slot=abierta_slot
             )
-            self.history[ideess] = history[-retention_days:]
-            historico_count += 1
-        return historico_count
+        )
 
     def filter_rows(
         self,
@@ -83,29 +105,107 @@ class MemoryStore:
         municipio: Optional[str] = None,
         precio_max: Optional[float] = None,
     ) -> list[dict]:
-        rows = self.snapshot_rows
-        if provincia:
-            p = provincia.lower()
-            rows = [r for r in rows if p in (r.get("provincia") or "").lower()]
-        if municipio:
-            m = municipio.lower()
-            rows = [r for r in rows if m in (r.get("municipio") or "").lower()]
-        if precio_max is not None:
-            rows = [r for r in rows if r.get("precio_95_e5") is not None and float(r["precio_95_e5"]) <= precio_max]
-        return rows
+        return self.columns.rows(self.filter_indices(provincia=provincia, municipio=municipio, precio_max=precio_max))
+
+    def open_indices(self, indices: np.ndarray, abierta_slot: Optional[int]) -> np.ndarray:
+        """Subconjunto de `indices` abiertos en `abierta_slot` (sin filtro si es None)."""
+        if abierta_slot is None:
+            return indices
+        return indices[open_mask(self.columns.horario_bits[indices], abierta_slot)]
+
+    def keyset_indices(
+        self,
+        provincia: Optional[str],
+        municipio: Optional[str],
+        precio_max: Optional[float],
+        order_by: str,
+        after: Optional[tuple],
+        limit: int,
+        abierta_slot: Optional[int] = None,
+    ) -> tuple[int, np.ndarray]:
+        """
+        Equivalente en memoria de `GasolinerasRepository.list_rows_keyset`.
+
+        Devuelve (total_filtrado, indices) con hasta `limit + 1` indices en orden
+        `ideess` o `(precio_95_e5 NaN al final, ideess)` posteriores a `after`.
+        """
+        columns = self.columns
+        mask = columns.filter_mask(
+            provincia=provincia, municipio=municipio, precio_max=precio_max, abierta_slot=abierta_slot
+        )
+        total = int(mask.sum())
+        ids = columns.ideess.astype(str)
+
+        if order_by == "precio":
+            prices = columns.prices["precio_95_e5"]
+            if after is not None:
+                after_price, after_id = after
+                if after_price is None:
+                    mask &= np.isnan(prices) & (ids > str(after_id))
+                else:
+                    mask &= (
+                        (prices > after_price)
+                        | ((prices == after_price) & (ids > str(after_id)))
+                        | np.isnan(prices)
+                    )
+            candidates = np.flatnonzero(mask)
+            order = np.lexsort((ids[candidates], prices[candidates]))
+        else:
+            if after is not None:
+                mask &= ids > str(after[0])
+            candidates = np.flatnonzero(mask)
+            order = np.argsort(ids[candidates], kind="stable")
+
+        return total, candidates[order[: limit + 1]]
+
+    def rows_at(self, indices) -> list[dict]:
+        return self.columns.rows(indices)
+
+    def indices_in_bbox(self, lat_sw: float, lon_sw: float, lat_ne: float, lon_ne: float) -> np.ndarray:
+        return self.columns.spatial.indices_in_bbox(lat_sw, lon_sw, lat_ne, lon_ne)
+
+    def rows_in_bbox(self, lat_sw: float, lon_sw: float, lat_ne: float, lon_ne: float) -> list[dict]:
+        return self.columns.rows(self.indices_in_bbox(lat_sw, lon_sw, lat_ne, lon_ne))
+
+    def rows_within_km(
+        self, lat: float, lon: float, km: float, limit: Optional[int] = None, abierta_slot: Optional[int] = None
+    ) -> list[tuple[dict, float]]:
+        indices, distances = self.columns.spatial.indices_within_km(lat, lon, km)
+        if abierta_slot is not None:
+            is_open = open_mask(self.columns.horario_bits[indices], abierta_slot)
+            indices, distances = indices[is_open], distances[is_open]
+        if limit is not None:
+            indices, distances = indices[:limit], distances[:limit]
+        return list(zip(self.columns.rows(indices), distances.tolist()))
+
+    def iter_rows(self) -> Iterator[dict]:
+        return self.columns.iter_rows()
+
+    def iter_batches(self, batch_size: int) -> Iterator[list[dict]]:
+        return self.columns.iter_batches(batch_size)
 
     def row_by_id(self, ideess: str) -> Optional[dict]:
-        return next((row for row in self.snapshot_rows if str(row.get("ideess")) == str(ideess)), None)
+        columns = self.columns
+        idx = columns.offset_of(ideess)
+        return columns.row(idx) if idx is not None else None
+
+    def has_id(self, ideess: str) -> bool:
+        return self.columns.offset_of(ideess) is not None
+
+    def rows_by_ids(self, ids: Iterable[str]) -> list[dict]:
+        """Filas de los IDEESS pedidos que existan en el snapshot, en el orden recibido."""
+        columns = self.columns
+        return columns.rows(columns.offsets_of(ids))
 
     def history_by_id(self, ideess: str, fecha_desde: date, fecha_hasta: date) -> list[dict]:
-        return [
-            dict(row)
-            for row in self.history.get(ideess, [])
-            if fecha_desde <= row.get("fecha", fecha_hasta) <= fecha_hasta
-        ]
-
-    def export_rows(self) -> tuple[list[dict], datetime]:
-        if not self.snapshot_rows:
+        return self.history.series([ideess], fecha_desde, fecha_hasta).get(ideess, [])
+
+    def history_by_ids(self, ids: Iterable[str], fecha_desde: date, fecha_hasta: date) -> dict[str, list[dict]]:
+        """Historico de varias estaciones; solo incluye las que tienen filas en el rango."""
+        return self.history.series(ids, fecha_desde, fecha_hasta)
+
+    def export_batches(self, batch_size: int) -> tuple[Iterator[list[dict]], datetime]:
+        if not self.has_snapshot():
             raise LookupError("No hay snapshot en memoria para exportar")
         reference_dt = self.last_sync_at or datetime.now(timezone.utc)
-        return self.snapshot_rows, reference_dt
+        return self.columns.iter_batches(batch_size), reference_dt
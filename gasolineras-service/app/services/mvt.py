@@ -0,0 +1,125 @@
+"""Teselas vectoriales (Mapbox Vector Tile v2) de puntos, sin dependencias externas."""
+import struct
+from math import atan, degrees, pi, sinh
+from typing import Optional
+
+import numpy as np
+
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+_GEOM_POINT = 1
+_CMD_MOVE_TO_ONE = (1 & 0x7) | (1 << 3)
+
+
+def tile_bounds(z: int, x: int, y: int, buffer: int = 0) -> tuple[float, float, float, float]:
+    """Caja (lat_sw, lon_sw, lat_ne, lon_ne) en grados de la tesela XYZ, ampliada `buffer` unidades MVT."""
+    n = 2**z
+    pad = buffer / MVT_EXTENT
+
+    def lon_at(tile_x: float) -> float:
+        return tile_x / n * 360.0 - 180.0
+
+    def lat_at(tile_y: float) -> float:
+        return degrees(atan(sinh(pi * (1 - 2 * tile_y / n))))
+
+    lat_ne = lat_at(max(y - pad, 0))
+    lat_sw = lat_at(min(y + 1 + pad, n))
+    return lat_sw, max(lon_at(x - pad), -180.0), lat_ne, min(lon_at(x + 1 + pad), 180.0)
+
+
+def project_to_tile(lats: np.ndarray, lons: np.ndarray, z: int, x: int, y: int) -> tuple[np.ndarray, np.ndarray]:
+    """Coordenadas enteras dentro de la tesela (0..MVT_EXTENT, eje Y hacia abajo) en Web Mercator."""
+    n = 2**z
+    lat_r = np.radians(np.clip(lats, -85.05112878, 85.05112878))
+    tile_x = (lons + 180.0) / 360.0 * n - x
+    tile_y = (1.0 - np.log(np.tan(lat_r) + 1.0 / np.cos(lat_r)) / pi) / 2.0 * n - y
+    return np.rint(tile_x * MVT_EXTENT).astype(np.int64), np.rint(tile_y * MVT_EXTENT).astype(np.int64)
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """Campo protobuf de longitud delimitada (wire type 2)."""
+    return _varint((number << 3) | 2) + _varint(len(payload)) + payload
+
+
+def _encode_value(value) -> bytes:
+    if isinstance(value, str):
+        return _field(1, value.encode("utf-8"))
+    if isinstance(value, (int, np.integer)) and value >= 0:
+        return _varint((5 << 3) | 0) + _varint(int(value))
+    return _varint((3 << 3) | 1) + struct.pack("<d", float(value))
+
+
+def encode_point_layer(
+    name: str,
+    lats: np.ndarray,
+    lons: np.ndarray,
+    properties: dict[str, list],
+    z: int,
+    x: int,
+    y: int,
+) -> bytes:
+    """
+    Capa MVT de puntos. `properties` mapea cada atributo a una lista alineada con
+    las coordenadas; los valores `None` se omiten en la feature.
+
+    Devuelve la capa ya envuelta como campo `layers` de `Tile`, asi que concatenar
+    varias capas produce una tesela valida (vacia si no hay puntos).
+    """
+    px, py = project_to_tile(lats, lons, z, x, y)
+    inside = (px >= -MVT_BUFFER) & (px <= MVT_EXTENT + MVT_BUFFER) & (py >= -MVT_BUFFER) & (py <= MVT_EXTENT + MVT_BUFFER)
+    if not inside.any():
+        return b""
+
+    keys = list(properties)
+    values: list[bytes] = []
+    value_index: dict[tuple, int] = {}
+    features = bytearray()
+    for pos in np.flatnonzero(inside).tolist():
+        tags = bytearray()
+        for key_pos, key in enumerate(keys):
+            value = properties[key][pos]
+            if value is None:
+                continue
+            lookup = (type(value).__name__, value)
+            idx = value_index.get(lookup)
+            if idx is None:
+                idx = value_index[lookup] = len(values)
+                values.append(_encode_value(value))
+            tags += _varint(key_pos) + _varint(idx)
+        geometry = _varint(_CMD_MOVE_TO_ONE) + _varint(_zigzag(int(px[pos]))) + _varint(_zigzag(int(py[pos])))
+        feature = _field(2, bytes(tags)) + _varint((3 << 3) | 0) + _varint(_GEOM_POINT) + _field(4, geometry)
+        features += _field(2, feature)
+
+    layer = (
+        _varint((15 << 3) | 0)
+        + _varint(2)
+        + _field(1, name.encode("utf-8"))
+        + bytes(features)
+        + b"".join(_field(3, key.encode("utf-8")) for key in keys)
+        + b"".join(_field(4, value) for value in values)
+        + _varint((5 << 3) | 0)
+        + _varint(MVT_EXTENT)
+    )
+    return _field(3, layer)
+
+
+def optional_float(value: float) -> Optional[float]:
+    return None if value != value else round(float(value), 3)
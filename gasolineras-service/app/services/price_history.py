@@ -0,0 +1,222 @@
+"""Historico diario de precios en memoria como ring buffer float32 (estaciones x dias)."""
+from datetime import date
+from typing import Iterable, NamedTuple
+
+import numpy as np
+
+from app.services.snapshot_columns import PRICE_COLUMNS
+
+# Columnas de `precios_historicos`, en el mismo orden que PRICE_COLUMNS del snapshot.
+HISTORY_COLUMNS = ("p95", "p95p", "p98", "pa", "pb", "pp", "pdr")
+
+_EMPTY_DAY = -1
+
+
+class _RingState(NamedTuple):
+    days: np.ndarray
+    values: np.ndarray
+    rows: dict[str, int]
+    # Ordinal del ultimo dia en que la estacion vino en el feed, por fila (_EMPTY_DAY si ninguno).
+    last_seen: np.ndarray
+
+
+class PriceHistoryRing:
+    """
+    Una matriz float32 (combustibles, estaciones, dias) con NaN = sin dato y un eje de
+    fechas compartido. El dia `d` ocupa la posicion `d.toordinal() % capacity`, asi que
+    anadir un dia escribe solo esa columna y sobrescribe el mas antiguo; las filas de
+    estacion se asignan la primera vez que aparecen, crecen por duplicacion y se
+    compactan cuando una estacion no viene en el feed (ni tiene datos) en toda la ventana.
+
+    Concurrencia (un hilo de sync, muchos lectores): `_state` se sustituye con una sola
+    asignacion. Antes de escribir una columna en sitio se publica un eje de dias que ya
+    no la referencia, y despues otro que si; `series` repite la lectura si `_state`
+    cambio mientras copiaba, asi nunca devuelve un dia a medio escribir.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        capacity = max(1, capacity)
+        self._state = _RingState(
+            np.full(capacity, _EMPTY_DAY, dtype=np.int64),
+            np.full((len(HISTORY_COLUMNS), 0, capacity), np.nan, dtype=np.float32),
+            {},
+            np.empty(0, dtype=np.int64),
+        )
+
+    @classmethod
+    def from_arrays(cls, ids: Iterable[str], days: np.ndarray, values: np.ndarray) -> "PriceHistoryRing":
+        """Reconstruye el ring a partir de IDEESS, eje de dias y matriz (combustibles, estaciones, dias)."""
+        days = np.asarray(days, dtype=np.int64).copy()
+        values = np.array(values, dtype=np.float32)
+        # Sin el feed original, una estacion cuenta como vista el ultimo dia con algun precio.
+        present = ~np.isnan(values).all(axis=0) & (days != _EMPTY_DAY)
+        last_seen = np.where(present, days, _EMPTY_DAY).max(axis=1, initial=_EMPTY_DAY)
+        ring = cls(len(days))
+        ring._state = _RingState(days, values, {ideess: pos for pos, ideess in enumerate(ids)}, last_seen)
+        return ring
+
+    def arrays(self) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """Inverso de `from_arrays`: IDEESS, eje de dias y matriz de un mismo estado publicado."""
+        state = self._state
+        ids = sorted(state.rows, key=state.rows.get)
+        return ids, state.days, state.values[:, : len(ids)]
+
+    @property
+    def capacity(self) -> int:
+        return len(self._state.days)
+
+    @property
+    def days(self) -> np.ndarray:
+        return self._state.days
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._state.values
+
+    @property
+    def rows(self) -> dict[str, int]:
+        return self._state.rows
+
+    def __len__(self) -> int:
+        return len(self._state.rows)
+
+    @property
+    def nbytes(self) -> int:
+        state = self._state
+        return state.values.nbytes + state.days.nbytes + state.last_seen.nbytes
+
+    def resize(self, capacity: int) -> None:
+        """Cambia la retencion conservando los dias mas recientes que quepan."""
+        capacity = max(1, capacity)
+        state = self._state
+        if capacity == len(state.days):
+            return
+        kept = np.flatnonzero(state.days != _EMPTY_DAY)
+        kept = kept[np.argsort(state.days[kept])][-capacity:]
+        days = np.full(capacity, _EMPTY_DAY, dtype=np.int64)
+        values = np.full((len(HISTORY_COLUMNS), state.values.shape[1], capacity), np.nan, dtype=np.float32)
+        targets = state.days[kept] % capacity
+        days[targets] = state.days[kept]
+        values[:, :, targets] = state.values[:, :, kept]
+        self._state = _RingState(days, values, state.rows, state.last_seen)
+
+    def _with_rows(self, state: _RingState, ids: list[str]) -> _RingState:
+        """Estado con fila para cada IDEESS nuevo; solo copia `values` si hay que crecer."""
+        new_ids = [ideess for ideess in dict.fromkeys(ids) if ideess not in state.rows]
+        if not new_ids:
+            return state
+        rows = dict(state.rows)
+        for ideess in new_ids:
+            rows[ideess] = len(rows)
+        values, last_seen = state.values, state.last_seen
+        allocated = values.shape[1]
+        if len(rows) > allocated:
+            size = max(len(rows), allocated * 2)
+            values = np.full((len(HISTORY_COLUMNS), size, len(state.days)), np.nan, dtype=np.float32)
+            values[:, :allocated] = state.values
+            last_seen = np.full(size, _EMPTY_DAY, dtype=np.int64)
+            last_seen[:allocated] = state.last_seen
+        return _RingState(state.days, values, rows, last_seen)
+
+    def _compact(self, ordinal: int) -> None:
+        """
+        Quita las filas de estaciones que no han venido en el feed en toda la ventana (y por
+        tanto no tienen datos en ella). Copia la matriz, pero solo el dia en que alguna sale,
+        y conserva el tamano reservado para no volver a crecer con la siguiente alta.
+        """
+        state = self._state
+        stations = len(state.rows)
+        live = state.last_seen[:stations] > ordinal - len(state.days)
+        if live.all():
+            return
+        keep = np.flatnonzero(live)
+        ids = sorted(state.rows, key=state.rows.get)
+        rows = {ids[old]: new for new, old in enumerate(keep.tolist())}
+        values = np.full_like(state.values, np.nan)
+        values[:, : keep.size] = state.values[:, keep]
+        last_seen = np.full_like(state.last_seen, _EMPTY_DAY)
+        last_seen[: keep.size] = state.last_seen[keep]
+        self._state = _RingState(state.days, values, rows, last_seen)
+
+    def append_day(self, day: date, ids: list[str], prices: dict[str, np.ndarray]) -> int:
+        """
+        Escribe los precios de `day` (arrays alineados con `ids`, claves de PRICE_COLUMNS).
+        Reescribir el mismo dia sustituye sus valores; los dias que quedan fuera de la
+        retencion respecto a `day` se vacian.
+        """
+        ordinal = day.toordinal()
+        state = self._with_rows(self._state, ids)
+        capacity = len(state.days)
+        slot = ordinal % capacity
+
+        reset = state.days[slot] != ordinal
+        expired = (state.days != _EMPTY_DAY) & (state.days <= ordinal - capacity)
+        hidden = state.days.copy()
+        hidden[expired] = _EMPTY_DAY
+        hidden[slot] = _EMPTY_DAY
+        # Los lectores dejan de ver las columnas que se van a tocar antes de escribirlas.
+        self._state = state._replace(days=hidden)
+
+        values = state.values
+        if reset:
+            values[:, :, slot] = np.nan
+        if expired.any():
+            values[:, :, expired] = np.nan
+        positions = np.fromiter((state.rows[ideess] for ideess in ids), dtype=np.int64, count=len(ids))
+        for fuel, column in enumerate(PRICE_COLUMNS):
+            values[fuel, positions, slot] = prices[column]
+        state.last_seen[positions] = ordinal
+
+        days = hidden.copy()
+        days[slot] = ordinal
+        self._state = state._replace(days=days)
+        self._compact(ordinal)
+        return len(ids)
+
+    @staticmethod
+    def _slots_between(days: np.ndarray, fecha_desde: date, fecha_hasta: date) -> np.ndarray:
+        """Posiciones del eje de fechas dentro del rango, en orden cronologico."""
+        in_range = (days >= fecha_desde.toordinal()) & (days <= fecha_hasta.toordinal())
+        slots = np.flatnonzero(in_range)
+        return slots[np.argsort(days[slots])]
+
+    def series(self, ids: Iterable[str], fecha_desde: date, fecha_hasta: date) -> dict[str, list[dict]]:
+        """
+        Filas de historico (mismo formato que `precios_historicos`) por IDEESS, solo para las
+        estaciones con algun precio en el rango; los dias sin ningun precio se omiten.
+        """
+        ids = list(ids)
+        while True:
+            state = self._state
+            known = [ideess for ideess in ids if ideess in state.rows]
+            slots = self._slots_between(state.days, fecha_desde, fecha_hasta)
+            if not known or slots.size == 0:
+                return {}
+            rows = np.asarray([state.rows[ideess] for ideess in known], dtype=np.int64)
+            block = state.values[:, rows][:, :, slots]  # (combustibles, estaciones, dias)
+            # Un sync publico otro estado mientras se copiaba: la copia puede estar a medias.
+            if self._state is state:
+                break
+
+        present = ~np.isnan(block).all(axis=0)
+        fechas = [date.fromordinal(int(ordinal)) for ordinal in state.days[slots]]
+        rounded = np.round(block.astype(np.float64), 3)
+
+        result: dict[str, list[dict]] = {}
+        for pos, ideess in enumerate(known):
+            days = np.flatnonzero(present[pos])
+            if days.size == 0:
+                continue
+            station = rounded[:, pos, days].tolist()
+            result[ideess] = [
+                {
+                    "ideess": ideess,
+                    "fecha": fechas[day],
+                    **{
+                        column: None if values[i] != values[i] else values[i]
+                        for column, values in zip(HISTORY_COLUMNS, station)
+                    },
+                }
+                for i, day in enumerate(days.tolist())
+            ]
+        return result
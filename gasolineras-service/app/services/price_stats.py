@@ -0,0 +1,61 @@
+"""Estadisticas de precios por combustible con la semantica de `percentile_disc`."""
+from typing import Optional
+
+import numpy as np
+
+# Nombre en la respuesta -> columna del snapshot.
+STATS_FUELS = {
+    "gasolina_95": "precio_95_e5",
+    "gasolina_95_premium": "precio_95_e5_premium",
+    "gasolina_98": "precio_98_e5",
+    "gasoleo_a": "precio_gasoleo_a",
+    "gasoleo_b": "precio_gasoleo_b",
+    "gasoleo_premium": "precio_gasoleo_premium",
+    "diesel_renovable": "precio_diesel_renovable",
+}
+PERCENTILES = (0.25, 0.5, 0.75)
+
+
+def _stats_dict(min_value, max_value, mean, p25, p50, p75, total: int) -> dict:
+    return {
+        "min": round(float(min_value), 3),
+        "max": round(float(max_value), 3),
+        "media": round(float(mean), 3),
+        "mediana": round(float(p50), 3),
+        "p25": round(float(p25), 3),
+        "p75": round(float(p75), 3),
+        "total_muestras": total,
+    }
+
+
+def price_stats(values: np.ndarray) -> Optional[dict]:
+    """
+    Estadisticas de una columna de precios (NaN y <= 0 se ignoran).
+
+    Los percentiles usan `inverted_cdf`, equivalente a `percentile_disc` de
+    PostgreSQL, para que ambos backends devuelvan exactamente los mismos valores.
+    """
+    precios = values[values > 0]
+    if not precios.size:
+        return None
+    p25, p50, p75 = np.percentile(precios, [p * 100 for p in PERCENTILES], method="inverted_cdf")
+    return _stats_dict(precios.min(), precios.max(), precios.mean(), p25, p50, p75, int(precios.size))
+
+
+def price_stats_by_fuel(price_columns: dict[str, np.ndarray]) -> dict:
+    fuels = {name: price_stats(price_columns[field]) for name, field in STATS_FUELS.items()}
+    return {name: stats for name, stats in fuels.items() if stats is not None}
+
+
+def price_stats_from_aggregate(row: dict) -> dict:
+    """Convierte una fila de `GasolinerasRepository.stats_aggregate` al formato de `price_stats`."""
+    fuels = {}
+    for name, field in STATS_FUELS.items():
+        total = int(row.get(f"{field}_n") or 0)
+        if not total:
+            continue
+        p25, p50, p75 = row[f"{field}_pct"]
+        fuels[name] = _stats_dict(
+            row[f"{field}_min"], row[f"{field}_max"], row[f"{field}_avg"], p25, p50, p75, total
+        )
+    return fuels
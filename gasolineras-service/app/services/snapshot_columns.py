@@ -0,0 +1,202 @@
+"""Representacion columnar (NumPy) del snapshot de gasolineras en memoria."""
+import sys
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from app.services.cluster_pyramid import ClusterPyramid
+from app.services.horario_bitmap import BITMAP_BYTES, EMPTY_BITMAP, horario_bitmap, open_mask
+from app.services.spatial_grid import SpatialGrid
+
+PRICE_COLUMNS = (
+    "precio_95_e5",
+    "precio_95_e5_premium",
+    "precio_98_e5",
+    "precio_gasoleo_a",
+    "precio_gasoleo_b",
+    "precio_gasoleo_premium",
+    "precio_diesel_renovable",
+)
+CATEGORY_COLUMNS = ("rotulo", "municipio", "provincia")
+OBJECT_COLUMNS = ("direccion", "horario", "horario_parsed")
+
+
+def _as_float(value) -> float:
+    if value is None or value == "":
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _none_if_nan(values: list[float]) -> list[Optional[float]]:
+    return [None if value != value else value for value in values]
+
+
+class CategoryColumn:
+    """Columna de texto codificada: valores unicos internados + codigos int32 por fila."""
+
+    def __init__(self, raw_values: Iterable[str]) -> None:
+        lookup: dict[str, int] = {}
+        codes: list[int] = []
+        for value in raw_values:
+            code = lookup.get(value)
+            if code is None:
+                code = len(lookup)
+                lookup[sys.intern(value)] = code
+            codes.append(code)
+        self.values: list[str] = list(lookup)
+        self.codes = np.asarray(codes, dtype=np.int32)
+
+    @classmethod
+    def from_codes(cls, values: Iterable[str], codes: np.ndarray) -> "CategoryColumn":
+        """Columna ya codificada (p. ej. el diccionario de un array Arrow), sin recorrer filas."""
+        column = cls(())
+        column.values = [sys.intern(value) for value in values]
+        column.codes = np.asarray(codes, dtype=np.int32)
+        return column
+
+    def __getitem__(self, idx: int) -> str:
+        return self.values[self.codes[idx]]
+
+    def take(self, indices: np.ndarray) -> list[str]:
+        values = self.values
+        return [values[code] for code in self.codes[indices].tolist()]
+
+    def contains_mask(self, needle: str) -> np.ndarray:
+        """Mascara de filas cuyo valor contiene `needle` (sin distinguir mayusculas)."""
+        needle = needle.lower()
+        matching = [code for code, value in enumerate(self.values) if needle in value.lower()]
+        return np.isin(self.codes, np.asarray(matching, dtype=np.int32))
+
+
+class SnapshotColumns:
+    """
+    Snapshot inmutable en columnas: coordenadas y precios en float64 (NaN = sin dato),
+    textos repetidos codificados y el resto como listas Python. Los dicts de fila
+    solo se materializan para las filas que se devuelven.
+    """
+
+    def __init__(self, rows: list[dict], actualizado_en: Optional[datetime]) -> None:
+        self.actualizado_en = actualizado_en
+        self.ideess = np.asarray([row.get("ideess") for row in rows], dtype=object)
+        self.offsets: dict[str, int] = {
+            str(ideess): idx for idx, ideess in enumerate(self.ideess.tolist()) if ideess is not None
+        }
+        self.lat = np.asarray([_as_float(row.get("latitud")) for row in rows], dtype=np.float64)
+        self.lon = np.asarray([_as_float(row.get("longitud")) for row in rows], dtype=np.float64)
+        self.prices: dict[str, np.ndarray] = {
+            column: np.asarray([_as_float(row.get(column)) for row in rows], dtype=np.float64)
+            for column in PRICE_COLUMNS
+        }
+        self.categories: dict[str, CategoryColumn] = {
+            column: CategoryColumn((row.get(column) or "") for row in rows) for column in CATEGORY_COLUMNS
+        }
+        self.objects: dict[str, list] = {column: [row.get(column) for row in rows] for column in OBJECT_COLUMNS}
+        # Horario semanal compilado (84 bytes por fila); sin horario interpretable = todo a cero.
+        self.horario_bits = np.frombuffer(
+            b"".join(horario_bitmap(row.get("horario")) or EMPTY_BITMAP for row in rows), dtype=np.uint8
+        ).reshape(len(rows), BITMAP_BYTES)
+        self._build_indexes()
+
+    @classmethod
+    def from_arrays(
+        cls,
+        ideess: np.ndarray,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        prices: dict[str, np.ndarray],
+        categories: dict[str, CategoryColumn],
+        objects: dict[str, list],
+        horario_bits: np.ndarray,
+        actualizado_en: Optional[datetime],
+    ) -> "SnapshotColumns":
+        """Snapshot a partir de columnas ya construidas (copia local Arrow), sin dicts de fila."""
+        columns = cls.__new__(cls)
+        columns.actualizado_en = actualizado_en
+        columns.ideess = np.asarray(ideess, dtype=object)
+        columns.offsets = {str(value): idx for idx, value in enumerate(columns.ideess.tolist()) if value is not None}
+        columns.lat = np.asarray(lat, dtype=np.float64)
+        columns.lon = np.asarray(lon, dtype=np.float64)
+        columns.prices = {column: np.asarray(prices[column], dtype=np.float64) for column in PRICE_COLUMNS}
+        columns.categories = {column: categories[column] for column in CATEGORY_COLUMNS}
+        columns.objects = {column: objects[column] for column in OBJECT_COLUMNS}
+        columns.horario_bits = np.asarray(horario_bits, dtype=np.uint8).reshape(len(columns.ideess), BITMAP_BYTES)
+        columns._build_indexes()
+        return columns
+
+    def _build_indexes(self) -> None:
+        self.spatial = SpatialGrid(self.lat, self.lon)
+        self.clusters = ClusterPyramid(self.lat, self.lon, self.prices["precio_95_e5"])
+
+    def __len__(self) -> int:
+        return len(self.ideess)
+
+    def all_indices(self) -> np.ndarray:
+        return np.arange(len(self), dtype=np.int64)
+
+    def rows(self, indices: Iterable[int]) -> list[dict]:
+        """Materializa los dicts de fila (mismo formato que `MemoryStore.to_snapshot_row`)."""
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size == 0:
+            return []
+
+        columns: dict[str, list] = {
+            "ideess": self.ideess[indices].tolist(),
+            "latitud": _none_if_nan(self.lat[indices].tolist()),
+            "longitud": _none_if_nan(self.lon[indices].tolist()),
+        }
+        for column, category in self.categories.items():
+            columns[column] = category.take(indices)
+        for column, values in self.prices.items():
+            columns[column] = _none_if_nan(values[indices].tolist())
+        positions = indices.tolist()
+        for column, values in self.objects.items():
+            columns[column] = [values[pos] for pos in positions]
+
+        names = list(columns)
+        return [
+            {**dict(zip(names, record)), "actualizado_en": self.actualizado_en}
+            for record in zip(*(columns[name] for name in names))
+        ]
+
+    def row(self, idx: int) -> dict:
+        return self.rows([idx])[0]
+
+    def offset_of(self, ideess) -> Optional[int]:
+        return self.offsets.get(str(ideess))
+
+    def offsets_of(self, ids: Iterable) -> np.ndarray:
+        """Offsets de los IDEESS presentes, en el orden pedido (los desconocidos se omiten)."""
+        offsets = self.offsets
+        found = [offsets.get(str(ideess)) for ideess in ids]
+        return np.asarray([idx for idx in found if idx is not None], dtype=np.int64)
+
+    def iter_batches(self, chunk_size: int = 1000) -> Iterator[list[dict]]:
+        for start in range(0, len(self), chunk_size):
+            yield self.rows(np.arange(start, min(start + chunk_size, len(self)), dtype=np.int64))
+
+    def iter_rows(self, chunk_size: int = 1000) -> Iterator[dict]:
+        for batch in self.iter_batches(chunk_size):
+            yield from batch
+
+    def filter_mask(
+        self,
+        provincia: Optional[str] = None,
+        municipio: Optional[str] = None,
+        precio_max: Optional[float] = None,
+        abierta_slot: Optional[int] = None,
+    ) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        if abierta_slot is not None:
+            mask &= open_mask(self.horario_bits, abierta_slot)
+        if provincia:
+            mask &= self.categories["provincia"].contains_mask(provincia)
+        if municipio:
+            mask &= self.categories["municipio"].contains_mask(municipio)
+        if precio_max is not None:
+            # NaN <= x es False: las filas sin precio quedan fuera, igual que antes.
+            mask &= self.prices["precio_95_e5"] <= precio_max
+        return mask
@@ -0,0 +1,192 @@
+"""Copia local del snapshot en memoria (Arrow IPC) para arrancar en caliente sin descargar el feed."""
+import importlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.services.horario_bitmap import BITMAP_BYTES
+from app.services.price_history import HISTORY_COLUMNS, PriceHistoryRing
+from app.services.snapshot_columns import CATEGORY_COLUMNS, PRICE_COLUMNS, CategoryColumn, SnapshotColumns
+
+logger = logging.getLogger(__name__)
+
+try:
+    pa = importlib.import_module("pyarrow")
+except Exception:  # pragma: no cover - pyarrow es opcional
+    pa = None
+
+FORMAT_VERSION = "2"
+SNAPSHOT_FILE = "snapshot.arrow"
+HISTORY_FILE = "history.arrow"
+
+
+def _write_table(path: Path, table) -> None:
+    """
+    Escribe a un temporal de nombre unico y lo renombra: un lector nunca ve un fichero
+    a medias y dos procesos que comparten directorio no escriben el mismo temporal.
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _read_table(path: Path):
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _snapshot_table(columns: SnapshotColumns, last_sync_at: datetime):
+    # Categorias como diccionario Arrow y horario compilado como binario fijo: al leer se
+    # recuperan codigos y bitmaps tal cual, sin volver a interpretar fila a fila.
+    arrays = {
+        "ideess": pa.array(columns.ideess.tolist(), type=pa.string()),
+        "latitud": pa.array(columns.lat, from_pandas=True),
+        "longitud": pa.array(columns.lon, from_pandas=True),
+        **{
+            column: pa.DictionaryArray.from_arrays(
+                pa.array(columns.categories[column].codes, type=pa.int32()),
+                pa.array(columns.categories[column].values, type=pa.string()),
+            )
+            for column in CATEGORY_COLUMNS
+        },
+        **{column: pa.array(values, from_pandas=True) for column, values in columns.prices.items()},
+        "direccion": pa.array(columns.objects["direccion"], type=pa.string()),
+        "horario": pa.array(columns.objects["horario"], type=pa.string()),
+        "horario_parsed": pa.array(
+            [None if value is None else json.dumps(value) for value in columns.objects["horario_parsed"]],
+            type=pa.string(),
+        ),
+        "horario_bits": pa.FixedSizeBinaryArray.from_buffers(
+            pa.binary(BITMAP_BYTES),
+            len(columns),
+            [None, pa.py_buffer(np.ascontiguousarray(columns.horario_bits).tobytes())],
+        ),
+    }
+    metadata = {"format_version": FORMAT_VERSION, "last_sync_at": last_sync_at.isoformat()}
+    return pa.table(arrays).replace_schema_metadata(metadata)
+
+
+def _float_column(table, column: str) -> np.ndarray:
+    # Los nulos de una columna float salen como NaN, igual que en memoria.
+    return table.column(column).to_numpy().astype(np.float64, copy=False)
+
+
+def _category_column(table, column: str) -> CategoryColumn:
+    array = table.column(column).combine_chunks()
+    return CategoryColumn.from_codes(array.dictionary.to_pylist(), array.indices.to_numpy(zero_copy_only=False))
+
+
+def _horario_parsed(table) -> list:
+    # Muchas estaciones comparten horario: cada texto JSON distinto se decodifica una vez.
+    decoded: dict[str, dict] = {}
+    values = []
+    for raw in table.column("horario_parsed").to_pylist():
+        if raw is not None and raw not in decoded:
+            decoded[raw] = json.loads(raw)
+        values.append(None if raw is None else decoded[raw])
+    return values
+
+
+def _horario_bits(table) -> np.ndarray:
+    array = table.column("horario_bits").combine_chunks()
+    raw = np.frombuffer(array.buffers()[1], dtype=np.uint8)
+    start = array.offset * BITMAP_BYTES
+    return raw[start : start + len(array) * BITMAP_BYTES].reshape(len(array), BITMAP_BYTES)
+
+
+def _columns_from_table(table, last_sync_at: datetime) -> SnapshotColumns:
+    return SnapshotColumns.from_arrays(
+        ideess=table.column("ideess").to_numpy(zero_copy_only=False),
+        lat=_float_column(table, "latitud"),
+        lon=_float_column(table, "longitud"),
+        prices={column: _float_column(table, column) for column in PRICE_COLUMNS},
+        categories={column: _category_column(table, column) for column in CATEGORY_COLUMNS},
+        objects={
+            "direccion": table.column("direccion").to_pylist(),
+            "horario": table.column("horario").to_pylist(),
+            "horario_parsed": _horario_parsed(table),
+        },
+        horario_bits=_horario_bits(table),
+        actualizado_en=last_sync_at,
+    )
+
+
+def _history_table(history: PriceHistoryRing, last_sync_at: datetime):
+    ids, days, values = history.arrays()
+    arrays = {"ideess": pa.array(ids, type=pa.string())}
+    for fuel, column in enumerate(HISTORY_COLUMNS):
+        flat = np.ascontiguousarray(values[fuel]).reshape(-1)
+        arrays[column] = pa.FixedSizeListArray.from_arrays(pa.array(flat, type=pa.float32()), len(days))
+    # `last_sync_at` empareja el historico con su snapshot: los dos ficheros se renombran por separado.
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "last_sync_at": last_sync_at.isoformat(),
+        "days": json.dumps(days.tolist()),
+    }
+    return pa.table(arrays).replace_schema_metadata(metadata)
+
+
+def write_snapshot_files(
+    directory: str,
+    columns: SnapshotColumns,
+    last_sync_at: datetime,
+    history: Optional[PriceHistoryRing] = None,
+) -> None:
+    if pa is None:
+        raise RuntimeError("pyarrow no disponible: no se puede persistir el snapshot")
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    _write_table(path / SNAPSHOT_FILE, _snapshot_table(columns, last_sync_at))
+    if history is not None and len(history):
+        _write_table(path / HISTORY_FILE, _history_table(history, last_sync_at))
+    else:
+        (path / HISTORY_FILE).unlink(missing_ok=True)
+
+
+def read_snapshot_files(directory: str) -> Optional[tuple[SnapshotColumns, datetime, Optional[PriceHistoryRing]]]:
+    """Snapshot (y historico si existe) guardados en `directory`; None si no hay fichero compatible."""
+    path = Path(directory)
+    if pa is None or not (path / SNAPSHOT_FILE).is_file():
+        return None
+
+    table = _read_table(path / SNAPSHOT_FILE)
+    metadata = {key.decode(): value.decode() for key, value in (table.schema.metadata or {}).items()}
+    if metadata.get("format_version") != FORMAT_VERSION:
+        logger.warning("⚠️ Snapshot local con formato %s ignorado", metadata.get("format_version"))
+        return None
+
+    last_sync_at = datetime.fromisoformat(metadata["last_sync_at"])
+    columns = _columns_from_table(table, last_sync_at)
+
+    history = None
+    if (path / HISTORY_FILE).is_file():
+        history_table = _read_table(path / HISTORY_FILE)
+        history_metadata = history_table.schema.metadata or {}
+        if history_metadata.get(b"last_sync_at", b"").decode() != metadata["last_sync_at"]:
+            # Una caida entre los dos renombrados deja un historico de otro snapshot.
+            logger.warning("⚠️ Histórico local de otro snapshot ignorado")
+            return columns, last_sync_at, None
+        days = np.asarray(json.loads(history_metadata[b"days"]), dtype=np.int64)
+        values = np.stack(
+            [
+                np.asarray(history_table.column(column).combine_chunks().flatten()).reshape(-1, len(days))
+                for column in HISTORY_COLUMNS
+            ]
+        )
+        history = PriceHistoryRing.from_arrays(
+            history_table.column("ideess").to_numpy(zero_copy_only=False), days, values
+        )
+    return columns, last_sync_at, history
@@ -0,0 +1,106 @@
+"""Indice espacial en rejilla uniforme lat/lon para el snapshot en memoria."""
+from math import floor
+from typing import Optional
+
+import numpy as np
+
+from app.services.geo import bbox_for_radius, haversine_km_array
+
+_EMPTY_INDICES = np.empty(0, dtype=np.int64)
+
+
+class SpatialGrid:
+    """
+    Rejilla empaquetada de celdas de `cell_deg` grados sobre arrays lat/lon.
+
+    Los indices de fila se ordenan por celda una sola vez; cada celda es un rango
+    contiguo (inicio, fin) dentro de ese array, de modo que las consultas por bbox
+    o radio solo tocan las celdas que intersectan la zona pedida.
+    """
+
+    DEFAULT_CELL_DEG = 0.1
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, cell_deg: float = DEFAULT_CELL_DEG) -> None:
+        self.lats = lats
+        self.lons = lons
+        self.cell_deg = cell_deg
+        self._cells: dict[tuple[int, int], tuple[int, int]] = {}
+        self._bounds: Optional[tuple[float, float, float, float]] = None
+
+        located = np.flatnonzero(~(np.isnan(lats) | np.isnan(lons)))
+        if located.size == 0:
+            self._sorted = _EMPTY_INDICES
+            return
+
+        cell_rows = np.floor(lats[located] / cell_deg).astype(np.int64)
+        cell_cols = np.floor(lons[located] / cell_deg).astype(np.int64)
+        order = np.lexsort((cell_cols, cell_rows))
+        self._sorted = located[order]
+        cell_rows = cell_rows[order]
+        cell_cols = cell_cols[order]
+
+        changes = np.flatnonzero((np.diff(cell_rows) != 0) | (np.diff(cell_cols) != 0)) + 1
+        starts = np.concatenate(([0], changes))
+        ends = np.concatenate((changes, [located.size]))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            self._cells[(int(cell_rows[start]), int(cell_cols[start]))] = (start, end)
+
+        self._bounds = (
+            float(lats[located].min()),
+            float(lons[located].min()),
+            float(lats[located].max()),
+            float(lons[located].max()),
+        )
+
+    def _cell_of(self, lat: float, lon: float) -> tuple[int, int]:
+        return floor(lat / self.cell_deg), floor(lon / self.cell_deg)
+
+    def _covers_all(self, lat_sw: float, lon_sw: float, lat_ne: float, lon_ne: float) -> bool:
+        if self._bounds is None:
+            return False
+        min_lat, min_lon, max_lat, max_lon = self._bounds
+        return lat_sw <= min_lat and lon_sw <= min_lon and lat_ne >= max_lat and lon_ne >= max_lon
+
+    def _candidates(self, lat_sw: float, lon_sw: float, lat_ne: float, lon_ne: float) -> np.ndarray:
+        """Indices de todas las filas en celdas que intersectan la caja (sin filtrar bordes)."""
+        row_min, col_min = self._cell_of(lat_sw, lon_sw)
+        row_max, col_max = self._cell_of(lat_ne, lon_ne)
+
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > len(self._cells):
+            ranges = [
+                bounds
+                for key, bounds in self._cells.items()
+                if row_min <= key[0] <= row_max and col_min <= key[1] <= col_max
+            ]
+        else:
+            ranges = [
+                self._cells[(cell_row, cell_col)]
+                for cell_row in range(row_min, row_max + 1)
+                for cell_col in range(col_min, col_max + 1)
+                if (cell_row, cell_col) in self._cells
+            ]
+
+        if not ranges:
+            return _EMPTY_INDICES
+        return np.concatenate([self._sorted[start:end] for start, end in ranges])
+
+    def indices_in_bbox(self, lat_sw: float, lon_sw: float, lat_ne: float, lon_ne: float) -> np.ndarray:
+        """Indices (ordenados) de las filas dentro de la caja."""
+        if self._covers_all(lat_sw, lon_sw, lat_ne, lon_ne):
+            return np.sort(self._sorted)
+
+        candidates = self._candidates(lat_sw, lon_sw, lat_ne, lon_ne)
+        lats = self.lats[candidates]
+        lons = self.lons[candidates]
+        mask = (lats >= lat_sw) & (lats <= lat_ne) & (lons >= lon_sw) & (lons <= lon_ne)
+        return np.sort(candidates[mask])
+
+    def indices_within_km(self, lat: float, lon: float, km: float) -> tuple[np.ndarray, np.ndarray]:
+        """Indices y distancias de las filas a <= `km` del punto, por distancia ascendente."""
+        candidates = self._candidates(*bbox_for_radius(lat, lon, km))
+        distances = haversine_km_array(lat, lon, self.lats[candidates], self.lons[candidates])
+        mask = distances <= km
+        candidates = candidates[mask]
+        distances = distances[mask]
+        order = np.argsort(distances, kind="stable")
+        return candidates[order], distances[order]
@@ -0,0 +1,139 @@
+"""Tiempos por etapa del sync y su exposicion como histogramas (formato texto de Prometheus)."""
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Iterable, Iterator, Optional, TypeVar
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - no existe en Windows
+    resource = None
+
+T = TypeVar("T")
+
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_DURATION_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_ROWS_BUCKETS = (0, 10, 100, 1000, 5000, 10000, 15000, 20000, 50000)
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Pico de memoria residente del proceso (getrusage: barato, sin trazar asignaciones)."""
+    if resource is None:
+        return None
+    # ru_maxrss viene en KiB en Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class StageTimings:
+    """
+    Tiempo de pared exclusivo, filas y pico de memoria de cada etapa de un sync.
+
+    Las etapas pueden anidarse (p. ej. la descarga ocurre mientras `prepare_rows`
+    consume el generador): el tiempo de una etapa interior se descuenta de la
+    exterior, asi la suma de etapas no cuenta nada dos veces.
+    """
+
+    def __init__(self) -> None:
+        self._started = perf_counter()
+        self._children: list[float] = []
+        self.seconds: dict[str, float] = {}
+        self.rows: dict[str, int] = {}
+        self.peak_rss_mb: dict[str, float] = {}
+
+    def _enter(self) -> float:
+        self._children.append(0.0)
+        return perf_counter()
+
+    def _exit(self, name: str, started: float) -> None:
+        elapsed = perf_counter() - started
+        self.seconds[name] = self.seconds.get(name, 0.0) + elapsed - self._children.pop()
+        if self._children:
+            self._children[-1] += elapsed
+        else:
+            peak = _peak_rss_mb()
+            if peak is not None:
+                self.peak_rss_mb[name] = peak
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = self._enter()
+        try:
+            yield
+        finally:
+            self._exit(name, started)
+
+    def timed_iter(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        """Envuelve un iterable cargando a `name` el tiempo de cada `next()`."""
+        iterator = iter(items)
+        while True:
+            started = self._enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit(name, started)
+            yield item
+
+    @property
+    def total_seconds(self) -> float:
+        return perf_counter() - self._started
+
+    def count(self, name: str, rows: int) -> None:
+        self.rows[name] = self.rows.get(name, 0) + rows
+
+    def summary(self) -> dict:
+        timings_ms = {name: round(seconds * 1000, 1) for name, seconds in self.seconds.items()}
+        timings_ms["total"] = round(self.total_seconds * 1000, 1)
+        return {"timings_ms": timings_ms, "stage_rows": dict(self.rows), "peak_rss_mb": dict(self.peak_rss_mb)}
+
+
+class Histogram:
+    """Histograma acumulativo con etiqueta `stage`, sin dependencias externas."""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, value: float) -> None:
+        with self._lock:
+            counts, totals = self._series.setdefault(stage, [[0] * len(self.buckets), [0.0, 0]])
+            for pos in range(bisect_left(self.buckets, value), len(self.buckets)):
+                counts[pos] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for stage, (counts, (total, observations)) in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="+Inf"}} {observations}')
+                lines.append(f'{self.name}_sum{{stage="{stage}"}} {total}')
+                lines.append(f'{self.name}_count{{stage="{stage}"}} {observations}')
+        return lines
+
+
+SYNC_STAGE_SECONDS = Histogram(
+    "gasolineras_sync_stage_seconds", "Tiempo de pared por etapa del sync.", _DURATION_BUCKETS_S
+)
+SYNC_STAGE_ROWS = Histogram("gasolineras_sync_stage_rows", "Filas procesadas por etapa del sync.", _ROWS_BUCKETS)
+
+
+def observe_sync(timings: StageTimings) -> None:
+    """Registra un sync terminado en los histogramas del proceso."""
+    for name, seconds in timings.seconds.items():
+        SYNC_STAGE_SECONDS.observe(name, seconds)
+    SYNC_STAGE_SECONDS.observe("total", timings.total_seconds)
+    for name, rows in timings.rows.items():
+        SYNC_STAGE_ROWS.observe(name, rows)
+
+
+def render_metrics() -> str:
+    return "\n".join([*SYNC_STAGE_SECONDS.render(), *SYNC_STAGE_ROWS.render()]) + "\n"
@@ -2,16 +2,19 @@
 import json
 import logging
 import threading
+import time
+from contextlib import ExitStack, contextmanager
 from datetime import date, datetime, timedelta, timezone
-from typing import Optional
+from typing import Callable, Iterable, Iterator, Optional
 
 from fastapi import HTTPException
 
-from app.clients.gobierno_client import GobiernoClient, parse_float
+from app.clients.gobierno_client import GobiernoClient, UpstreamNotModified, horario_cache_stats, parse_float
 from app.clients.usuarios_client import UsuariosClient
 from app.config import Settings
 from app.repositories.gasolineras_repository import GasolinerasRepository
 from app.repositories.history_repository import HistoryRepository
+from app.services.cluster_pyramid import CLUSTER_GRID_SIZES
 from app.services.constants import (
     KEY_DIESEL_RENOVABLE,
     KEY_DIRECCION,
@@ -24,7 +27,9 @@ from app.services.constants import (
     KEY_ROTULO,
     SPAIN_TZ,
 )
+from app.services.horario_bitmap import horario_bitmap
 from app.services.memory_store import MemoryStore
+from app.services.sync_metrics import StageTimings, observe_sync
 
 logger = logging.getLogger(__name__)
 
@@ -53,7 +58,22 @@ class SyncService:
 
         self._memory_mode = settings.force_memory_mode
         self._sync_lock = threading.Lock()
+        # Sustituto local del advisory lock de PostgreSQL (modo memoria o BD caida).
+        self._flight_lock = threading.Lock()
         self._last_auto_sync_attempt: Optional[datetime] = None
+        self._snapshot_version: Optional[str] = None
+        # Instante (monotonic) de la ultima lectura de la version desde la BD.
+        self._snapshot_version_checked_at = 0.0
+        self._last_sync_at: Optional[datetime] = None
+        # Refresco en segundo plano: un unico hilo, despertado por el intervalo o por lecturas.
+        self._refresh_lock = threading.Lock()
+        self._refresh_wakeup = threading.Event()
+        self._refresh_stop = threading.Event()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._refresh_trigger = "background-refresh"
+        self._snapshot_listeners: list[Callable[[], None]] = []
+        # Huella de la ultima descarga aplicada: validadores HTTP, Fecha + sha256 del cuerpo.
+        self._upstream: Optional[dict] = None
 
     @property
     def sync_lock(self) -> threading.Lock:
@@ -63,13 +83,102 @@ class SyncService:
     def memory_mode(self) -> bool:
         return self._memory_mode
 
+    @property
+    def snapshot_version(self) -> Optional[str]:
+        return self._snapshot_version
+
+    def _observe_snapshot(self, last_sync_at: Optional[datetime]) -> None:
+        if last_sync_at is None:
+            return
+        storage_mode = "memory-fallback" if self._memory_mode else "postgres"
+        self._snapshot_version = f"{storage_mode}:{last_sync_at.astimezone(timezone.utc).isoformat()}"
+        self._snapshot_version_checked_at = time.monotonic()
+        self._last_sync_at = last_sync_at
+
+    @property
+    def snapshot_stale(self) -> bool:
+        """True si el ultimo snapshot observado no es del dia local actual."""
+        last_sync_at = self._last_sync_at
+        return last_sync_at is not None and last_sync_at.astimezone(SPAIN_TZ).date() != datetime.now(SPAIN_TZ).date()
+
+    def add_snapshot_listener(self, callback: Callable[[], None]) -> None:
+        """Registra un callback que se ejecuta tras cada sincronizacion completada."""
+        self._snapshot_listeners.append(callback)
+
+    def _notify_snapshot_listeners(self) -> None:
+        for callback in self._snapshot_listeners:
+            try:
+                callback()
+            except Exception as exc:
+                logger.warning("⚠️ Error en tarea post-sync %s: %s", getattr(callback, "__name__", callback), exc)
+
+    def _snapshot_version_expired(self) -> bool:
+        """
+        En PostgreSQL otra replica puede sincronizar (o el sync incremental cambiar filas)
+        sin que este proceso se entere: la version se relee de la BD pasado un TTL corto.
+        En modo memoria solo cambia con los sync de este proceso.
+        """
+        if self._memory_mode:
+            return False
+        return time.monotonic() - self._snapshot_version_checked_at >= self.settings.snapshot_version_ttl_s
+
+    def current_snapshot_version(self) -> Optional[str]:
+        """Token de version del snapshot; se resuelve consultando el estado si no se conoce o ha caducado."""
+        version = self._snapshot_version
+        unknown = version is None or not version.startswith("memory-fallback:" if self._memory_mode else "postgres:")
+        if unknown or self._snapshot_version_expired():
+            # Se marca antes de consultar: las peticiones concurrentes no repiten la consulta.
+            self._snapshot_version_checked_at = time.monotonic()
+            try:
+                self.get_snapshot_state()
+            except Exception as exc:
+                logger.debug("No se pudo resolver la version del snapshot: %s", exc)
+                if unknown:
+                    return None
+        return self._snapshot_version
+
     def activate_memory_mode(self, reason: str) -> None:
         if not self._memory_mode:
             logger.warning("⚠️ Activando modo fallback en memoria: %s", reason)
         self._memory_mode = True
 
+    def persist_memory_snapshot(self) -> None:
+        """Guarda la copia local del snapshot en memoria (si hay directorio configurado)."""
+        if not self.settings.memory_snapshot_dir:
+            return
+        try:
+            self.memory_store.save(self.settings.memory_snapshot_dir)
+        except Exception as exc:
+            logger.warning("⚠️ No se pudo guardar la copia local del snapshot: %s", exc)
+
+    def restore_memory_snapshot(self) -> bool:
+        """
+        Carga la copia local del snapshot para responder sin esperar al ministerio; si es
+        de un dia anterior se pide un refresco en segundo plano. False si no habia copia.
+        """
+        if not self._memory_mode or not self.settings.memory_snapshot_dir or self.memory_store.has_snapshot():
+            return False
+        try:
+            loaded = self.memory_store.load(self.settings.memory_snapshot_dir)
+        except Exception as exc:
+            logger.warning("⚠️ Copia local del snapshot ilegible, se ignora: %s", exc)
+            return False
+        if not loaded:
+            return False
+
+        self._observe_snapshot(self.memory_store.last_sync_at)
+        logger.info(
+            "💾 Snapshot restaurado de %s (total=%s, fecha=%s)",
+            self.settings.memory_snapshot_dir,
+            self.memory_store.count(),
+            self.memory_store.last_sync_at,
+        )
+        if self.snapshot_stale:
+            self.request_refresh("memory-restore")
+        return True
+
     def ensure_memory_snapshot_loaded(self, reason: str = "read") -> None:
-        if self.memory_store.has_snapshot():
+        if self.memory_store.has_snapshot() or self.restore_memory_snapshot():
             return
         logger.info("ℹ️ Cargando snapshot en memoria (%s)", reason)
         try:
@@ -82,13 +191,15 @@ class SyncService:
         today_local = datetime.now(SPAIN_TZ).date()
 
         if self._memory_mode:
-            total = len(self.memory_store.snapshot_rows)
+            total = self.memory_store.count()
             last_sync_at = self.memory_store.last_sync_at
         else:
             db_state = self.gas_repo.get_snapshot_state()
             total = db_state["total"]
             last_sync_at = db_state["last_sync_at"]
 
+        self._observe_snapshot(last_sync_at)
+
         snapshot_date_local = None
         is_current = False
         if last_sync_at is not None:
@@ -103,11 +214,16 @@ class SyncService:
             "is_current": is_current,
         }
 
-    def _prepare_sync_rows(self, datos: list[dict], fecha_sync: datetime) -> tuple[list[dict], list[tuple]]:
-        if not datos:
-            raise HTTPException(status_code=500, detail="No se pudieron obtener datos desde la API del gobierno")
+    def _prepare_sync_rows(self, datos: Iterable[dict], fecha_sync: datetime) -> tuple[list[dict], list[tuple]]:
+        recibidos = 0
+        datos_validos = []
+        for g in datos:
+            recibidos += 1
+            if g.get("Latitud") is not None and g.get("Longitud") is not None:
+                datos_validos.append(g)
 
-        datos_validos = [g for g in datos if g.get("Latitud") is not None and g.get("Longitud") is not None]
+        if not recibidos:
+            raise HTTPException(status_code=500, detail="No se pudieron obtener datos desde la API del gobierno")
         if not datos_validos:
             raise HTTPException(status_code=500, detail="No se encontraron gasolineras con coordenadas válidas")
 
@@ -137,6 +253,7 @@ class SyncService:
                 f"POINT({g['Longitud']} {g['Latitud']})",
                 g.get("Horario"),
                 _as_jsonb(g.get("Horario_parsed")),
+                horario_bitmap(g.get("Horario")),
                 fecha_sync,
             )
             for g in datos_validos
@@ -170,6 +287,18 @@ class SyncService:
             if self.settings.historical_scope != "favoritas" or g.get("IDEESS") in favoritas_ids
         ]
 
+    @staticmethod
+    def _history_candidates(datos_validos: list[dict], fecha_sync: datetime, diff: Optional[dict]) -> list[dict]:
+        """
+        Estaciones cuyo historico del dia hay que escribir. Si el sync incremental
+        repite dia, las filas sin cambios ya tienen el mismo precio guardado hoy.
+        """
+        previous = diff["previous_sync_at"] if diff else None
+        if previous is None or previous.astimezone(timezone.utc).date() != fecha_sync.date():
+            return datos_validos
+        written_ids = diff["written_ids"]
+        return [g for g in datos_validos if g.get("IDEESS") in written_ids]
+
     def _memory_sync_result(
         self,
         trigger: str,
@@ -197,32 +326,231 @@ class SyncService:
             body["mensaje"] = "Datos sincronizados con fallback en memoria 🚀"
         return body
 
+    def _reusable_upstream(self) -> Optional[dict]:
+        """
+        Validadores (`etag`, `last_modified`, `sha256`) de la descarga anterior si el
+        snapshot que produjo sigue cargado en el mismo almacenamiento. Sirven tambien
+        en un dia nuevo: sin cambios solo hay que escribir el historico del dia.
+        """
+        upstream = self._upstream
+        if upstream is None or upstream["storage_mode"] != ("memory-fallback" if self._memory_mode else "postgres"):
+            return None
+        if self._memory_mode and not self.memory_store.has_snapshot():
+            return None
+        return upstream
+
+    def _remember_upstream(self, meta: dict, fecha_sync: datetime) -> None:
+        self._upstream = {
+            "etag": meta.get("etag"),
+            "last_modified": meta.get("last_modified"),
+            "sha256": meta.get("sha256"),
+            "storage_mode": "memory-fallback" if self._memory_mode else "postgres",
+            "synced_at": fecha_sync,
+        }
+
+    @staticmethod
+    def _same_day(previous: datetime, now: datetime) -> bool:
+        """Mismo dia UTC (clave del historico) y local (frescura del snapshot)."""
+        return previous.date() == now.date() and previous.astimezone(SPAIN_TZ).date() == now.astimezone(SPAIN_TZ).date()
+
+    def _unchanged_result(self, trigger: str, reason: str, upstream: dict) -> dict:
+        logger.info("⏭️ Datos del ministerio sin cambios (%s): se conserva el snapshot", reason)
+        return {
+            "mensaje": "Datos del ministerio sin cambios: snapshot vigente",
+            "synced": False,
+            "reason": reason,
+            "fecha_snapshot": upstream["synced_at"].date().isoformat(),
+            "trigger": trigger,
+            "storage_mode": upstream["storage_mode"],
+        }
+
+    def _carry_over_day(
+        self, trigger: str, reason: str, upstream: dict, fecha_sync: datetime, timings: StageTimings
+    ) -> dict:
+        """
+        Dia nuevo sin datos nuevos del ministerio: el snapshot no se reescribe, pero se
+        escribe el historico del dia con sus precios y pasa a ser el snapshot de hoy.
+        """
+        logger.info("📅 Datos del ministerio sin cambios (%s) en un día nuevo: solo se escribe el histórico", reason)
+        retention_days = self.settings.history_retention_days
+        pruned_count = 0
+        if self._memory_mode:
+            with timings.stage("history_upsert"):
+                historico_count = self.memory_store.update_history(fecha_sync, retention_days)
+            self.memory_store.last_sync_at = fecha_sync
+            with timings.stage("persist_snapshot"):
+                self.persist_memory_snapshot()
+        else:
+            with timings.stage("favoritas"):
+                favoritas_ids = self._fetch_favoritas_ids()
+            with timings.stage("history_upsert"):
+                historico_count = self.history_repo.copy_snapshot_prices(
+                    fecha_sync.date(), favoritas_ids if self.settings.historical_scope == "favoritas" else None
+                )
+            with timings.stage("prune_history"):
+                pruned_count = self.history_repo.prune_before(fecha_sync.date() - timedelta(days=retention_days))
+            timings.count("prune_history", pruned_count)
+            self.gas_repo.mark_synced(fecha_sync)
+        timings.count("history_upsert", historico_count)
+
+        self._observe_snapshot(fecha_sync)
+        self._upstream = {**upstream, "synced_at": fecha_sync}
+        return {
+            "mensaje": "Datos del ministerio sin cambios: snapshot conservado e histórico del día escrito",
+            "synced": True,
+            "reason": reason,
+            "snapshot_rewritten": False,
+            "registros_historicos": historico_count,
+            "registros_historicos_pruned": pruned_count,
+            "historico_scope": self.settings.historical_scope,
+            "retention_days": retention_days,
+            "fecha_snapshot": fecha_sync.date().isoformat(),
+            "trigger": trigger,
+            "storage_mode": upstream["storage_mode"],
+        }
+
+    @staticmethod
+    def _horario_cache_delta(before: dict) -> dict:
+        after = horario_cache_stats()
+        hits = after["hits"] - before["hits"]
+        misses = after["misses"] - before["misses"]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            "size": after["size"],
+        }
+
+    @contextmanager
+    def _local_flight(self, wait_s: float) -> Iterator[tuple[bool, bool]]:
+        contended = not self._flight_lock.acquire(blocking=False)
+        if contended and not self._flight_lock.acquire(timeout=wait_s):
+            yield False, contended
+            return
+        try:
+            yield True, contended
+        finally:
+            self._flight_lock.release()
+
+    @contextmanager
+    def _single_flight(self) -> Iterator[tuple[bool, bool]]:
+        """
+        Un solo sync a la vez entre instancias: advisory lock en PostgreSQL y, en modo
+        memoria (o si no se puede tomar), un lock del proceso. Produce (adquirido, hubo_espera).
+        """
+        wait_s = self.settings.sync_lock_wait_s
+        with ExitStack() as stack:
+            state = None
+            if not self._memory_mode:
+                try:
+                    state = stack.enter_context(self.gas_repo.sync_advisory_lock(wait_s))
+                except Exception as exc:
+                    logger.warning("⚠️ No se pudo tomar el lock de sync en PostgreSQL, se usa el local: %s", exc)
+            if state is None:
+                state = stack.enter_context(self._local_flight(wait_s))
+            yield state
+
+    def _skipped_result(self, trigger: str, reason: str) -> dict:
+        state = self.get_snapshot_state()
+        return {
+            "mensaje": "Sincronización omitida: se mantiene el snapshot actual",
+            "synced": False,
+            "reason": reason,
+            "total": state["total"],
+            "fecha_snapshot": state["last_sync_at"].date().isoformat() if state["last_sync_at"] else None,
+            "trigger": trigger,
+            "storage_mode": "memory-fallback" if self._memory_mode else "postgres",
+        }
+
     def perform_sync(self, trigger: str = "manual") -> dict:
+        with self._single_flight() as (acquired, contended):
+            if not acquired:
+                logger.info("⏳ Otro sync sigue en curso; se sirve el snapshot actual (trigger=%s)", trigger)
+                return self._skipped_result(trigger, "sync-in-progress")
+            if contended and trigger != "manual":
+                # Hemos esperado a otra instancia: si ya dejo el snapshot del dia, no repetimos.
+                state = self.get_snapshot_state()
+                if state["total"] > 0 and state["is_current"]:
+                    return self._skipped_result(trigger, "synced-by-other-instance")
+
+            horario_before = horario_cache_stats()
+            timings = StageTimings()
+            result = self._sync_snapshot(trigger, timings)
+
+        observe_sync(timings)
+        result.update(timings.summary())
+        logger.info("⏱️ Tiempos del sync (ms): %s", result["timings_ms"])
+        if result.get("synced", True):
+            result["horario_cache"] = self._horario_cache_delta(horario_before)
+            self._notify_snapshot_listeners()
+        return result
+
+    def _sync_snapshot(self, trigger: str, timings: StageTimings) -> dict:
         logger.info("🔄 Iniciando sincronización (trigger=%s)", trigger)
 
-        datos = self.gobierno_client.fetch_gasolineras()
         fecha_sync = datetime.now(timezone.utc)
-        datos_validos, rows = self._prepare_sync_rows(datos, fecha_sync)
+        upstream = self._reusable_upstream()
+        meta: dict = {}
+        try:
+            # El cliente descarga el cuerpo y compara 304/sha256 antes de devolver el iterador.
+            datos = self.gobierno_client.iter_gasolineras(meta, validators=upstream, timings=timings)
+            with timings.stage("prepare_rows"):
+                datos_validos, rows = self._prepare_sync_rows(datos, fecha_sync)
+        except UpstreamNotModified as exc:
+            if self._same_day(upstream["synced_at"], fecha_sync):
+                return self._unchanged_result(trigger, exc.reason, upstream)
+            return self._carry_over_day(trigger, exc.reason, upstream, fecha_sync, timings)
+        timings.count("prepare_rows", len(rows))
 
         if self._memory_mode:
-            inserted_count = self.memory_store.replace_snapshot(datos_validos, fecha_sync)
-            historico_count = self.memory_store.update_history(fecha_sync, self.settings.history_retention_days)
+            with timings.stage("write_snapshot"):
+                inserted_count = self.memory_store.replace_snapshot(datos_validos, fecha_sync)
+            with timings.stage("history_upsert"):
+                historico_count = self.memory_store.update_history(fecha_sync, self.settings.history_retention_days)
+            timings.count("write_snapshot", inserted_count)
+            timings.count("history_upsert", historico_count)
+            with timings.stage("persist_snapshot"):
+                self.persist_memory_snapshot()
+            self._observe_snapshot(fecha_sync)
+            self._remember_upstream(meta, fecha_sync)
             return self._memory_sync_result(trigger, fecha_sync, inserted_count, historico_count)
 
         try:
-            deleted_count, inserted_count = self.gas_repo.replace_snapshot(rows)
+            diff = None
+            with timings.stage("write_snapshot"):
+                if self.settings.snapshot_sync_mode == "incremental":
+                    diff = self.gas_repo.apply_snapshot_diff(rows, fecha_sync, CLUSTER_GRID_SIZES)
+                if diff is None:
+                    deleted_count, inserted_count = self.gas_repo.replace_snapshot(rows, CLUSTER_GRID_SIZES)
+                else:
+                    deleted_count, inserted_count = diff["removed"], diff["new"] + diff["changed"]
+            timings.count("write_snapshot", inserted_count)
             retention_cutoff = fecha_sync.date() - timedelta(days=self.settings.history_retention_days)
-            pruned_count = self.history_repo.prune_before(retention_cutoff)
+            with timings.stage("prune_history"):
+                pruned_count = self.history_repo.prune_before(retention_cutoff)
+            timings.count("prune_history", pruned_count)
         except Exception as exc:
             self.activate_memory_mode(f"sync-db-write-failed: {exc}")
-            inserted_count = self.memory_store.replace_snapshot(datos_validos, fecha_sync)
+            with timings.stage("write_snapshot_fallback"):
+                inserted_count = self.memory_store.replace_snapshot(datos_validos, fecha_sync)
+            with timings.stage("persist_snapshot"):
+                self.persist_memory_snapshot()
+            self._observe_snapshot(fecha_sync)
             return self._memory_sync_result(trigger, fecha_sync, inserted_count, 0, warning=str(exc))
 
-        favoritas_ids = self._fetch_favoritas_ids()
-        historico_rows = self._build_historical_rows(datos_validos, fecha_sync.date(), favoritas_ids)
-        historico_count = self.history_repo.upsert_daily_prices(historico_rows)
+        self._observe_snapshot(fecha_sync)
+        self._remember_upstream(meta, fecha_sync)
 
-        return {
+        with timings.stage("favoritas"):
+            favoritas_ids = self._fetch_favoritas_ids()
+        with timings.stage("history_upsert"):
+            historico_rows = self._build_historical_rows(
+                self._history_candidates(datos_validos, fecha_sync, diff), fecha_sync.date(), favoritas_ids
+            )
+            historico_count = self.history_repo.upsert_daily_prices(historico_rows)
+        timings.count("history_upsert", historico_count)
+
+        result = {
             "mensaje": "Datos sincronizados correctamente 🚀",
             "registros_eliminados": deleted_count,
             "registros_insertados": inserted_count,
@@ -232,32 +560,87 @@ class SyncService:
             "retention_days": self.settings.history_retention_days,
             "favoritas_totales": len(favoritas_ids),
             "fecha_snapshot": fecha_sync.date().isoformat(),
-            "total": inserted_count,
+            "total": len(rows),
             "trigger": trigger,
             "storage_mode": "postgres",
+            "sync_mode": "full" if diff is None else "incremental",
         }
+        if diff is not None:
+            result["diff"] = {key: diff[key] for key in ("new", "changed", "unchanged", "removed")}
+            logger.info("🔁 Sync incremental: %s", result["diff"])
+        return result
 
-    def maybe_auto_sync_on_read(self, reason: str) -> None:
-        if not self.settings.auto_sync_on_read:
-            return
-
+    def refresh_if_stale(self, trigger: str) -> Optional[dict]:
+        """Sincroniza solo si no hay snapshot vigente del dia; devuelve el resultado del sync o None."""
         with self._sync_lock:
-            now = datetime.now(timezone.utc)
-            if self._last_auto_sync_attempt is not None:
-                elapsed = now - self._last_auto_sync_attempt
-                if elapsed < timedelta(minutes=self.settings.auto_sync_cooldown_minutes):
-                    return
-
             state = self.get_snapshot_state()
             if state["total"] > 0 and state["is_current"]:
-                return
-
-            self._last_auto_sync_attempt = now
+                return None
             logger.warning(
                 "⚠️ Snapshot no vigente (total=%s, snapshot=%s, hoy=%s). Ejecutando autosync (%s)",
                 state["total"],
                 state["snapshot_date_local"],
                 state["today_local"],
-                reason,
+                trigger,
             )
-            self.perform_sync(trigger=f"auto-read:{reason}")
+            return self.perform_sync(trigger=trigger)
+
+    def _refresh_loop(self) -> None:
+        interval_s = self.settings.snapshot_refresh_interval_s or None
+        while not self._refresh_stop.is_set():
+            woken = self._refresh_wakeup.wait(timeout=interval_s)
+            self._refresh_wakeup.clear()
+            if self._refresh_stop.is_set():
+                return
+            trigger = self._refresh_trigger if woken else "background-refresh"
+            try:
+                self.refresh_if_stale(trigger)
+            except Exception as exc:
+                logger.warning("⚠️ Error en refresco en segundo plano (%s): %s", trigger, exc)
+
+    def start_background_refresh(self) -> None:
+        """Arranca (si no lo esta ya) el hilo que mantiene el snapshot al dia fuera de las peticiones."""
+        with self._refresh_lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_stop.clear()
+            self._refresh_thread = threading.Thread(target=self._refresh_loop, name="snapshot-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def stop_background_refresh(self, timeout_s: float = 5.0) -> None:
+        with self._refresh_lock:
+            thread, self._refresh_thread = self._refresh_thread, None
+        if thread is None:
+            return
+        self._refresh_stop.set()
+        self._refresh_wakeup.set()
+        thread.join(timeout=timeout_s)
+
+    def request_refresh(self, trigger: str) -> bool:
+        """
+        Pide un refresco al hilo de fondo sin esperar a que termine. Las peticiones
+        dentro del cooldown o con un refresco ya pendiente se agrupan en uno solo.
+        """
+        with self._refresh_lock:
+            now = datetime.now(timezone.utc)
+            if self._last_auto_sync_attempt is not None:
+                elapsed = now - self._last_auto_sync_attempt
+                if elapsed < timedelta(minutes=self.settings.auto_sync_cooldown_minutes):
+                    return False
+            self._last_auto_sync_attempt = now
+            self._refresh_trigger = trigger
+        self.start_background_refresh()
+        self._refresh_wakeup.set()
+        return True
+
+    def maybe_auto_sync_on_read(self, reason: str) -> bool:
+        """
+        Frescura en el camino de lectura sin bloquearlo: se sirve el snapshot actual y,
+        si no es del dia y AUTO_SYNC_ON_READ esta activo, se despierta el refresco en
+        segundo plano. Devuelve si el snapshot servido esta desactualizado.
+        """
+        self.current_snapshot_version()
+        stale = self.snapshot_stale
+        if stale and self.settings.auto_sync_on_read:
+            self.request_refresh(f"auto-read:{reason}")
+        return stale
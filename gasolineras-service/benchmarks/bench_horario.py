@@ -0,0 +1,85 @@
+"""
+Benchmark de `parse_horario` sobre una muestra realista (~12k estaciones, unos
+cientos de horarios distintos): parser original (regex sin compilar, sin cache)
+frente al parser compilado y memoizado.
+
+Uso (desde gasolineras-service/):
+    python -m benchmarks.bench_horario
+"""
+import random
+import re
+import timeit
+from typing import Optional
+
+from app.services.fetch_gobierno import _expand_dias, _parse_horario_cached, parse_horario
+
+N_STATIONS = 12_000
+REPEAT = 20
+
+_COMUNES = ["L-D: 24H", "L-D: 06:00-22:00", "L-D: 07:00-23:00", "L-V: 07:00-21:00; S: 08:00-14:00"]
+
+
+def build_horarios(n: int = N_STATIONS, seed: int = 7) -> list[str]:
+    """Mezcla de horarios muy repetidos y una cola larga de variantes poco frecuentes."""
+    rng = random.Random(seed)
+    cola = []
+    for apertura in range(5, 10):
+        for cierre in range(20, 24):
+            cola.append(f"L-D: {apertura:02d}:00-{cierre:02d}:00")
+            cola.append(f"L-V: {apertura:02d}:30-{cierre:02d}:30; S-D: {apertura + 1:02d}:00-15:00")
+            cola.append(f"L-S: {apertura:02d}:00-{cierre:02d}:00; D: 09:00-14:00")
+            for dias in ("L,M,X,J,V", "L-J", "V-D"):
+                cola.append(f"{dias}: {apertura:02d}:00-{cierre:02d}:00; S: 09:00-13:{rng.randint(0, 5)}0")
+    return [rng.choice(_COMUNES) if rng.random() < 0.7 else rng.choice(cola) for _ in range(n)]
+
+
+def parse_horario_sin_cache(raw: Optional[str]) -> Optional[dict]:
+    """Copia del parser anterior: `re.match` con el patron en cada segmento."""
+    if not raw or not raw.strip():
+        return None
+    texto = raw.strip()
+    if re.match(r'^24\s*[Hh]', texto):
+        return {"texto": texto, "siempre_abierto": True, "segmentos": []}
+    segmentos = []
+    for parte in texto.split(";"):
+        parte = parte.strip()
+        if not parte:
+            continue
+        m = re.match(
+            r'^([LMXJVSD][LMXJVSD,\-]*)\s*:\s*(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2})\s*$',
+            parte,
+            re.IGNORECASE,
+        )
+        if m:
+            dias = _expand_dias(m.group(1))
+            if dias:
+                segmentos.append({"dias": dias, "apertura": m.group(2), "cierre": m.group(3)})
+    return {"texto": texto, "siempre_abierto": False, "segmentos": segmentos}
+
+
+def main() -> None:
+    horarios = build_horarios()
+    assert all(parse_horario(h) == parse_horario_sin_cache(h) for h in horarios)
+
+    def cached_sync() -> None:
+        # Cada sync arranca con la cache llena del anterior; el primero la rellena.
+        for h in horarios:
+            parse_horario(h)
+
+    def cold_sync() -> None:
+        _parse_horario_cached.cache_clear()
+        cached_sync()
+
+    base_ms = min(timeit.repeat(lambda: [parse_horario_sin_cache(h) for h in horarios], number=1, repeat=REPEAT)) * 1000
+    cold_ms = min(timeit.repeat(cold_sync, number=1, repeat=REPEAT)) * 1000
+    warm_ms = min(timeit.repeat(cached_sync, number=1, repeat=REPEAT)) * 1000
+    info = _parse_horario_cached.cache_info()
+    print(f"{len(horarios)} horarios, {len(set(horarios))} distintos")
+    print(f"{'sin cache':<24} {base_ms:8.3f} ms")
+    print(f"{'cache fria (1er sync)':<24} {cold_ms:8.3f} ms  x{base_ms / max(cold_ms, 1e-9):6.1f}")
+    print(f"{'cache caliente':<24} {warm_ms:8.3f} ms  x{base_ms / max(warm_ms, 1e-9):6.1f}")
+    print(f"hit rate acumulado: {info.hits / max(info.hits + info.misses, 1):.3f}")
+
+
+if __name__ == "__main__":
+    main()
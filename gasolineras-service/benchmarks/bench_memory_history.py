@@ -0,0 +1,110 @@
+"""
+Memoria y tiempo del historico en memoria: listas de dicts por estacion (version
+anterior de `MemoryStore.update_history`) frente al ring buffer float32.
+
+Simula ~12k estaciones sincronizadas un dia tras otro hasta llenar la retencion.
+
+Uso (desde gasolineras-service/):
+    python -m benchmarks.bench_memory_history
+"""
+import gc
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import numpy as np
+
+from app.services.price_history import PriceHistoryRing
+from app.services.snapshot_columns import PRICE_COLUMNS
+
+N_STATIONS = 12_000
+RETENTIONS = (30, 180)
+
+
+def build_days(n_days: int, n_stations: int = N_STATIONS, seed: int = 7):
+    """Un snapshot de precios por dia (7 combustibles, ~30 % sin dato)."""
+    rng = np.random.default_rng(seed)
+    ids = [str(100000 + i) for i in range(n_stations)]
+    start = date(2026, 1, 1)
+    for offset in range(n_days):
+        prices = {}
+        for column in PRICE_COLUMNS:
+            values = rng.uniform(1.2, 1.9, n_stations).round(3)
+            values[rng.random(n_stations) < 0.3] = np.nan
+            prices[column] = values
+        yield start + timedelta(days=offset), ids, prices
+
+
+def update_history_dicts(history: dict, day: date, ids: list[str], prices: dict, retention_days: int) -> None:
+    """Copia de la implementacion anterior: lista de dicts de 9 claves por estacion."""
+    columns = {column: [None if v != v else v for v in values.tolist()] for column, values in prices.items()}
+    for pos, ideess in enumerate(ids):
+        entries = history.setdefault(ideess, [])
+        entries = [h for h in entries if h.get("fecha") != day]
+        entries.append(
+            {
+                "ideess": ideess,
+                "fecha": day,
+                "p95": columns["precio_95_e5"][pos],
+                "p95p": columns["precio_95_e5_premium"][pos],
+                "p98": columns["precio_98_e5"][pos],
+                "pa": columns["precio_gasoleo_a"][pos],
+                "pb": columns["precio_gasoleo_b"][pos],
+                "pp": columns["precio_gasoleo_premium"][pos],
+                "pdr": columns["precio_diesel_renovable"][pos],
+            }
+        )
+        history[ideess] = entries[-retention_days:]
+
+
+def measure(label: str, build) -> None:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    holder, last_day_ms = build()
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<14} {current / 2**20:9.1f} MiB   total {elapsed:6.2f} s   ultimo dia {last_day_ms:8.2f} ms")
+    del holder
+
+
+def main() -> None:
+    for retention in RETENTIONS:
+        days = list(build_days(retention))
+        print(f"{N_STATIONS} estaciones x {retention} dias")
+
+        def with_dicts():
+            history: dict = {}
+            last = 0.0
+            for day, ids, prices in days:
+                started = time.perf_counter()
+                update_history_dicts(history, day, ids, prices, retention)
+                last = (time.perf_counter() - started) * 1000
+            return history, last
+
+        def with_ring():
+            ring = PriceHistoryRing(retention)
+            last = 0.0
+            for day, ids, prices in days:
+                started = time.perf_counter()
+                ring.append_day(day, ids, prices)
+                last = (time.perf_counter() - started) * 1000
+            return ring, last
+
+        measure("dicts", with_dicts)
+        measure("ring float32", with_ring)
+
+        ring, _ = with_ring()
+        ids = random.Random(1).sample(days[0][1], 20)
+        hasta = days[-1][0]
+        started = time.perf_counter()
+        for _ in range(100):
+            ring.series(ids, hasta - timedelta(days=29), hasta)
+        print(f"  series(20 ids, 30 dias): {(time.perf_counter() - started) * 10:.2f} ms")
+        del days
+
+
+if __name__ == "__main__":
+    main()
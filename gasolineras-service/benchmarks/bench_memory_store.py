@@ -0,0 +1,128 @@
+"""
+Benchmark del snapshot en memoria con un dataset sintetico (~12k estaciones).
+
+Uso (desde gasolineras-service/):
+    python -m benchmarks.bench_memory_store
+"""
+import random
+import timeit
+from datetime import datetime, timezone
+
+from app.services.geo import haversine_km
+from app.services.memory_store import MemoryStore
+from app.services.price_stats import price_stats_by_fuel
+from app.services.snapshot_columns import PRICE_COLUMNS
+
+N_STATIONS = 12_000
+REPEAT = 50
+
+
+def build_datos(n: int = N_STATIONS, seed: int = 7) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {
+            "IDEESS": str(100000 + i),
+            "Rótulo": rng.choice(["REPSOL", "CEPSA", "BP", "GALP", "SHELL"]),
+            "Municipio": f"MUNICIPIO {i % 800}",
+            "Provincia": f"PROVINCIA {i % 52}",
+            "Dirección": f"CALLE {i}",
+            "Precio Gasolina 95 E5": f"{rng.uniform(1.35, 1.85):.3f}".replace(".", ","),
+            "Precio Gasoleo A": f"{rng.uniform(1.25, 1.75):.3f}".replace(".", ","),
+            "Latitud": rng.uniform(36.0, 43.8),
+            "Longitud": rng.uniform(-9.3, 3.3),
+            "Horario": "L-D: 07:00-22:00",
+        }
+        for i in range(n)
+    ]
+
+
+def build_store(n: int = N_STATIONS, seed: int = 7) -> MemoryStore:
+    store = MemoryStore()
+    store.replace_snapshot(build_datos(n, seed), datetime.now(timezone.utc))
+    return store
+
+
+def linear_bbox(rows: list[dict], lat_sw: float, lon_sw: float, lat_ne: float, lon_ne: float) -> list[dict]:
+    return [
+        row
+        for row in rows
+        if row.get("latitud") is not None
+        and row.get("longitud") is not None
+        and lat_sw <= float(row["latitud"]) <= lat_ne
+        and lon_sw <= float(row["longitud"]) <= lon_ne
+    ]
+
+
+def linear_radius(rows: list[dict], lat: float, lon: float, km: float) -> list[tuple[dict, float]]:
+    result = []
+    for row in rows:
+        dist = haversine_km(lat, lon, float(row["latitud"]), float(row["longitud"]))
+        if dist <= km:
+            result.append((row, dist))
+    result.sort(key=lambda item: item[1])
+    return result
+
+
+def dict_filter(rows: list[dict], provincia: str, precio_max: float) -> list[dict]:
+    p = provincia.lower()
+    rows = [r for r in rows if p in (r.get("provincia") or "").lower()]
+    return [r for r in rows if r.get("precio_95_e5") is not None and float(r["precio_95_e5"]) <= precio_max]
+
+
+def dict_stats(rows: list[dict], field: str) -> list[float]:
+    return sorted(float(row[field]) for row in rows if row.get(field) is not None and float(row[field]) > 0)
+
+
+def dict_clusters(rows: list[dict], bbox: tuple, grid_size: float) -> list[tuple]:
+    lat_sw, lon_sw, lat_ne, lon_ne = bbox
+    cells: dict[tuple, list] = {}
+    for row in linear_bbox(rows, lat_sw, lon_sw, lat_ne, lon_ne):
+        key = (round(row["latitud"] / grid_size), round(row["longitud"] / grid_size))
+        cells.setdefault(key, []).append(row.get("precio_95_e5"))
+    return sorted(((len(p), min((x for x in p if x is not None), default=None)) for p in cells.values()), reverse=True)
+
+
+def _report(label: str, baseline, candidate) -> None:
+    base_ms = min(timeit.repeat(baseline, number=1, repeat=REPEAT)) * 1000
+    cand_ms = min(timeit.repeat(candidate, number=1, repeat=REPEAT)) * 1000
+    print(f"{label:<32} scan={base_ms:8.3f} ms  index={cand_ms:8.3f} ms  x{base_ms / max(cand_ms, 1e-9):6.1f}")
+
+
+def main() -> None:
+    store = build_store()
+    rows = list(store.iter_rows())
+    viewports = {
+        "bbox ciudad (zoom 14)": (40.38, -3.74, 40.45, -3.64),
+        "bbox provincia (zoom 9)": (39.9, -4.6, 41.2, -3.0),
+        "bbox nacional (zoom 5)": (35.0, -10.0, 44.5, 4.5),
+    }
+    for label, bbox in viewports.items():
+        _report(label, lambda b=bbox: linear_bbox(rows, *b), lambda b=bbox: store.indices_in_bbox(*b))
+
+    _report(
+        "clusters nacional (zoom 5)",
+        lambda: dict_clusters(rows, viewports["bbox nacional (zoom 5)"], 0.45),
+        lambda: store.columns.clusters.level(0.45).cells_in_bbox(*viewports["bbox nacional (zoom 5)"]),
+    )
+
+    for km in (5, 50, 200):
+        _report(
+            f"radio {km} km",
+            lambda k=km: linear_radius(rows, 40.4168, -3.7038, k),
+            lambda k=km: store.rows_within_km(40.4168, -3.7038, k),
+        )
+
+    _report(
+        "filtro provincia + precio_max",
+        lambda: dict_filter(rows, "provincia 1", 1.6),
+        lambda: store.filter_indices(provincia="provincia 1", precio_max=1.6),
+    )
+    _report(
+        "stats nacional (7 columnas)",
+        lambda: [dict_stats(rows, field) for field in PRICE_COLUMNS],
+        lambda: price_stats_by_fuel(store.columns.prices),
+    )
+
+
+if __name__ == "__main__":
+    main()
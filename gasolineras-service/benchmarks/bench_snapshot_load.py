@@ -0,0 +1,79 @@
+"""
+Benchmark de carga del snapshot en PostgreSQL: COPY + tabla temporal frente a execute_values.
+
+Reescribe la tabla `gasolineras`: ejecutar solo contra una base de datos de pruebas.
+
+Uso (desde gasolineras-service/):
+    DATABASE_URL=postgresql://... BENCH_ALLOW_WRITE=1 python -m benchmarks.bench_snapshot_load
+"""
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.config import settings
+from app.db.connection import get_cursor, get_db_conn
+from app.repositories.gasolineras_repository import GasolinerasRepository
+from app.services.memory_store import MemoryStore
+from app.services.sync_service import SyncService
+from benchmarks.bench_memory_store import N_STATIONS, build_datos
+
+REPEAT = 5
+
+
+def _wal_lsn() -> Optional[str]:
+    try:
+        with get_db_conn() as conn:
+            with get_cursor(conn) as cur:
+                cur.execute("SELECT pg_current_wal_lsn()::text AS lsn")
+                return cur.fetchone()["lsn"]
+    except Exception:
+        return None
+
+
+def _wal_bytes(before: Optional[str], after: Optional[str]) -> Optional[int]:
+    if before is None or after is None:
+        return None
+    with get_db_conn() as conn:
+        with get_cursor(conn) as cur:
+            cur.execute("SELECT pg_wal_lsn_diff(%s, %s)::bigint AS bytes", [after, before])
+            return int(cur.fetchone()["bytes"])
+
+
+def _run(method: str, rows: list[tuple]) -> tuple[float, Optional[int]]:
+    repo = GasolinerasRepository(load_method=method)
+    timings, wal = [], []
+    for _ in range(REPEAT):
+        before = _wal_lsn()
+        start = time.perf_counter()
+        repo.replace_snapshot(rows)
+        timings.append(time.perf_counter() - start)
+        wal.append(_wal_bytes(before, _wal_lsn()))
+    wal_values = [value for value in wal if value is not None]
+    return min(timings) * 1000, (min(wal_values) if wal_values else None)
+
+
+def main() -> None:
+    if os.getenv("BENCH_ALLOW_WRITE") != "1":
+        sys.exit("Este benchmark reescribe `gasolineras`. Exporta BENCH_ALLOW_WRITE=1 para continuar.")
+
+    sync_service = SyncService(
+        settings=settings,
+        gas_repo=GasolinerasRepository(),
+        history_repo=None,
+        gobierno_client=None,
+        usuarios_client=None,
+        memory_store=MemoryStore(),
+    )
+    _datos, rows = sync_service._prepare_sync_rows(build_datos(), datetime.now(timezone.utc))
+
+    print(f"{N_STATIONS} filas, mejor de {REPEAT} ejecuciones")
+    for method in GasolinerasRepository.LOAD_METHODS:
+        elapsed_ms, wal_bytes = _run(method, rows)
+        wal_text = f"{wal_bytes / 1024 / 1024:8.2f} MiB WAL" if wal_bytes is not None else "WAL n/d"
+        print(f"{method:<16} {elapsed_ms:10.1f} ms  {wal_text}")
+
+
+if __name__ == "__main__":
+    main()
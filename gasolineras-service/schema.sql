@@ -8,6 +8,10 @@ CREATE EXTENSION IF NOT EXISTS postgis;
 
 -- ============================================================
 -- Tabla principal de gasolineras
+-- El sync completo la sustituye por una copia (RENAME + DROP): nada debe
+-- depender de ella. Vistas, FKs o RLS sobre `gasolineras` desactivan el
+-- intercambio y el snapshot se escribe en sitio (DELETE + INSERT). Los GRANT
+-- y el comentario de la tabla se replican en cada intercambio.
 -- ============================================================
 CREATE TABLE IF NOT EXISTS gasolineras (
     ideess                  VARCHAR(10)         PRIMARY KEY,
@@ -29,6 +33,8 @@ CREATE TABLE IF NOT EXISTS gasolineras (
     -- Horario en texto original y en JSONB estructurado
     horario                 TEXT,
     horario_parsed          JSONB,
+    -- Horario compilado: 7 días x 96 cuartos de hora (bit = get_bit(horario_bits, slot))
+    horario_bits            BYTEA,
     actualizado_en          TIMESTAMPTZ         DEFAULT NOW()
 );
 
@@ -36,9 +42,38 @@ CREATE TABLE IF NOT EXISTS gasolineras (
 CREATE INDEX IF NOT EXISTS idx_gasolineras_provincia ON gasolineras (provincia);
 CREATE INDEX IF NOT EXISTS idx_gasolineras_municipio ON gasolineras (municipio);
 
+-- Índice para paginación por cursor (keyset) ordenada por precio
+CREATE INDEX IF NOT EXISTS idx_gasolineras_precio95_ideess ON gasolineras (precio_95_e5, ideess);
+
 -- Índice espacial GIST para búsquedas por proximidad (mucho más rápido que Haversine)
 CREATE INDEX IF NOT EXISTS idx_gasolineras_geom ON gasolineras USING GIST(geom);
 
+-- ============================================================
+-- Pirámide de clusters para el mapa (POST /gasolineras/markers)
+-- Se recalcula en cada sync, en la misma transacción que el snapshot:
+-- una fila por celda y tamaño de rejilla (ver cluster_pyramid.ZOOM_GRID_SIZES).
+-- ============================================================
+CREATE TABLE IF NOT EXISTS gasolineras_clusters (
+    grid_size           DOUBLE PRECISION    NOT NULL,
+    latitude            DOUBLE PRECISION    NOT NULL,
+    longitude           DOUBLE PRECISION    NOT NULL,
+    total               INTEGER             NOT NULL,
+    min_precio_95_e5    NUMERIC(6,3)
+);
+
+CREATE INDEX IF NOT EXISTS idx_gasolineras_clusters_grid_lat_lon
+    ON gasolineras_clusters (grid_size, latitude, longitude);
+
+-- ============================================================
+-- Estado del sync incremental (SNAPSHOT_SYNC_MODE=incremental)
+-- Las filas sin cambios conservan su `actualizado_en`, así que la fecha
+-- del último snapshot se guarda aquí (una sola fila).
+-- ============================================================
+CREATE TABLE IF NOT EXISTS gasolineras_sync_state (
+    id              SMALLINT            PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    last_sync_at    TIMESTAMPTZ         NOT NULL
+);
+
 -- ============================================================
 -- Si ya tienes la tabla creada (migración), ejecuta esto:
 -- ============================================================
@@ -47,6 +82,7 @@ CREATE INDEX IF NOT EXISTS idx_gasolineras_geom ON gasolineras USING GIST(geom);
 -- ALTER TABLE gasolineras ADD COLUMN IF NOT EXISTS horario_parsed JSONB;
 -- ALTER TABLE gasolineras ADD COLUMN IF NOT EXISTS precio_95_e5_premium NUMERIC(6,3);
 -- ALTER TABLE gasolineras ADD COLUMN IF NOT EXISTS precio_diesel_renovable NUMERIC(6,3);
+-- ALTER TABLE gasolineras ADD COLUMN IF NOT EXISTS horario_bits BYTEA;
 -- UPDATE gasolineras
 --   SET geom = ST_SetSRID(ST_MakePoint(longitud, latitud), 4326)::geography
 --   WHERE longitud IS NOT NULL AND latitud IS NOT NULL;
@@ -55,9 +91,12 @@ CREATE INDEX IF NOT EXISTS idx_gasolineras_geom ON gasolineras USING GIST(geom);
 -- ============================================================
 -- Tabla de precios históricos
 -- Guarda histórico diario de combustible para gráficos/modelado.
+-- Particionada por semanas de `fecha`: el servicio crea las
+-- particiones que faltan (precios_historicos_pAAAAMMDD, desde el
+-- lunes) antes de cada upsert y la retención borra particiones
+-- completas con DROP TABLE en lugar de DELETE por filas.
 -- ============================================================
 CREATE TABLE IF NOT EXISTS precios_historicos (
-    id      SERIAL      PRIMARY KEY,
     ideess  VARCHAR(10) NOT NULL,
     fecha   DATE        NOT NULL,
     p95     NUMERIC(6,3),
@@ -67,18 +106,29 @@ CREATE TABLE IF NOT EXISTS precios_historicos (
     pb      NUMERIC(6,3),
     pp      NUMERIC(6,3),
     pdr     NUMERIC(6,3),
-    UNIQUE (ideess, fecha)  -- evita duplicados del mismo día
-);
-
-CREATE INDEX IF NOT EXISTS idx_historico_ideess_fecha
-    ON precios_historicos (ideess, fecha DESC);
+    PRIMARY KEY (ideess, fecha)  -- evita duplicados del mismo día; incluye la clave de partición
+) PARTITION BY RANGE (fecha);
 
 -- Si ya existe la tabla de histórico, añade columnas nuevas con:
 -- ALTER TABLE precios_historicos ADD COLUMN IF NOT EXISTS p95p NUMERIC(6,3);
 -- ALTER TABLE precios_historicos ADD COLUMN IF NOT EXISTS pdr NUMERIC(6,3);
 
+-- Migración de la tabla sin particionar (el servicio sigue funcionando con
+-- ella usando DELETE; reinícialo tras migrar para que detecte las particiones):
+-- BEGIN;
+-- ALTER TABLE precios_historicos RENAME TO precios_historicos_legacy;
+-- CREATE TABLE precios_historicos (... como arriba ...) PARTITION BY RANGE (fecha);
+-- CREATE TABLE precios_historicos_legacy_part PARTITION OF precios_historicos
+--     FOR VALUES FROM (MINVALUE) TO ('<lunes de la semana actual>');
+-- INSERT INTO precios_historicos (ideess, fecha, p95, p95p, p98, pa, pb, pp, pdr)
+--     SELECT ideess, fecha, p95, p95p, p98, pa, pb, pp, pdr FROM precios_historicos_legacy;
+-- DROP TABLE precios_historicos_legacy;
+-- COMMIT;
+-- La partición `_legacy_part` se elimina sola cuando todo su rango queda fuera de la retención.
+
 -- ============================================================
--- Limpieza de histórico > 30 días (ejecutar manualmente o
--- programar con pg_cron en Neon)
+-- Limpieza de histórico > 30 días: la hace cada sync eliminando
+-- las particiones semanales cuyo rango queda fuera de
+-- HISTORY_RETENTION_DAYS. Equivalente manual:
 -- ============================================================
--- DELETE FROM precios_historicos WHERE fecha < NOW() - INTERVAL '30 days';
+-- DROP TABLE precios_historicos_p20260907;
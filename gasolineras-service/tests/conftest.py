@@ -0,0 +1,24 @@
+"""Fixtures compartidas de los tests."""
+from contextlib import contextmanager
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+
+@pytest.fixture
+def db_cursor(request):
+    """
+    Cursor psycopg2 simulado, inyectado en `get_db_conn`/`get_cursor` del modulo que
+    el fichero de test declara en `DB_MODULE` (p. ej. "app.repositories.history_repository").
+    """
+    module = request.module.DB_MODULE
+    cursor = MagicMock()
+    cursor.__enter__ = MagicMock(return_value=cursor)
+    cursor.__exit__ = MagicMock(return_value=False)
+
+    @contextmanager
+    def fake_conn():
+        yield MagicMock()
+
+    with patch(f"{module}.get_db_conn", fake_conn), patch(f"{module}.get_cursor", return_value=cursor):
+        yield cursor
@@ -0,0 +1,138 @@
+"""Tests del export del snapshot a Parquet por lotes (GCS simulado con un buffer)."""
+import io
+from dataclasses import replace
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pyarrow.parquet as pq
+import pytest
+from fastapi import HTTPException
+
+from app.clients.gcs_client import write_parquet_batches
+from app.config import settings
+from app.services.export_service import ExportService
+from app.services.memory_store import MemoryStore
+
+
+class FakeGCSClient:
+    def __init__(self) -> None:
+        self.buffer = io.BytesIO()
+
+    def upload_parquet_batches(self, batches, schema, bucket_name, blob_path, compression):
+        rows = write_parquet_batches(self.buffer, batches, schema, compression)
+        return f"gs://{bucket_name}/{blob_path}", rows
+
+    def parquet(self) -> pq.ParquetFile:
+        return pq.ParquetFile(io.BytesIO(self.buffer.getvalue()))
+
+
+def _db_row(i: int) -> dict:
+    return {
+        "ideess": str(1000 + i),
+        "rotulo": "TEST",
+        "municipio": "MADRID",
+        "provincia": "MADRID",
+        "direccion": "CALLE TEST 1",
+        "precio_95_e5": 1.5 if i % 3 else None,
+        "precio_95_e5_premium": None,
+        "precio_98_e5": None,
+        "precio_gasoleo_a": 1.4,
+        "precio_gasoleo_b": None,
+        "precio_gasoleo_premium": 1.6,
+        "precio_diesel_renovable": None,
+        "latitud": 40.4,
+        "longitud": -3.7,
+        "horario": "L-D: 07:00-22:00",
+        "horario_parsed": {
+            "texto": "L-D: 07:00-22:00",
+            "siempre_abierto": False,
+            "segmentos": [{"dias": [1, 2, 3, 4, 5, 6, 7], "apertura": "07:00", "cierre": "22:00"}],
+        },
+    }
+
+
+def _export_service(memory_mode: bool, gas_repo=None, memory_store=None) -> tuple[ExportService, FakeGCSClient]:
+    gcs_client = FakeGCSClient()
+    sync_service = MagicMock(memory_mode=memory_mode)
+    service = ExportService(
+        settings=replace(settings, raw_export_enabled=True, raw_export_gcs_bucket="bucket"),
+        sync_service=sync_service,
+        gas_repo=gas_repo or MagicMock(),
+        memory_store=memory_store or MemoryStore(),
+        gcs_client=gcs_client,
+    )
+    service.EXPORT_BATCH_SIZE = 4
+    return service, gcs_client
+
+
+class TestStreamingExport:
+    """Tests para el export Parquet escrito por row groups"""
+
+    def test_postgres_batches_become_row_groups(self):
+        """Cada lote del cursor de servidor debería escribirse como un row group"""
+        gas_repo = MagicMock()
+        gas_repo.get_snapshot_state.return_value = {"last_sync_at": datetime(2026, 10, 17, 6, tzinfo=timezone.utc)}
+        rows = [_db_row(i) for i in range(10)]
+        gas_repo.iter_snapshot_batches.side_effect = lambda size: iter(
+            [rows[start:start + size] for start in range(0, len(rows), size)]
+        )
+        service, gcs_client = _export_service(memory_mode=False, gas_repo=gas_repo)
+
+        result = service.export_snapshot_parquet_result()
+
+        gas_repo.iter_snapshot_batches.assert_called_once_with(4)
+        assert result["rows"] == 10
+        assert result["gcs_path"].endswith("snapshot_date=2026-10-17/gasolineras.parquet")
+        parquet = gcs_client.parquet()
+        assert parquet.metadata.num_row_groups == 3
+        table = parquet.read()
+        assert table.num_rows == 10
+        first = table.slice(0, 2).to_pylist()
+        assert first[0]["Precio Gasolina 95 E5"] == ""
+        assert first[1]["Precio Gasolina 95 E5"] == "1,500"
+        assert first[1]["Precio Gasóleo Premium"] == "1,600"
+        assert first[1]["Horario_parsed"]["segmentos"][0]["apertura"] == "07:00"
+        assert first[1]["fecha_registro"] == int(datetime(2026, 10, 17, 6, tzinfo=timezone.utc).timestamp() * 1000)
+
+    def test_postgres_empty_snapshot_is_404(self):
+        """Sin filas no debería abrirse la subida y la respuesta debería ser 404"""
+        gas_repo = MagicMock()
+        gas_repo.get_snapshot_state.return_value = {}
+        gas_repo.iter_snapshot_batches.return_value = iter([])
+        service, gcs_client = _export_service(memory_mode=False, gas_repo=gas_repo)
+
+        with pytest.raises(HTTPException) as exc:
+            service.export_snapshot_parquet_result()
+
+        assert exc.value.status_code == 404
+        assert gcs_client.buffer.getvalue() == b""
+
+    def test_memory_snapshot_exports_in_batches(self):
+        """En modo memoria el export debería recorrer el snapshot columnar por lotes"""
+        memory_store = MemoryStore()
+        memory_store.replace_snapshot(
+            [
+                {
+                    "IDEESS": str(2000 + i),
+                    "Rótulo": "TEST",
+                    "Precio Gasolina 95 E5": "1,500",
+                    "Latitud": 40.4,
+                    "Longitud": -3.7,
+                    "Horario": "24H",
+                    "Horario_parsed": {"texto": "24H", "siempre_abierto": True, "segmentos": []},
+                }
+                for i in range(6)
+            ],
+            datetime(2026, 10, 17, 6, tzinfo=timezone.utc),
+        )
+        service, gcs_client = _export_service(memory_mode=True, memory_store=memory_store)
+
+        result = service.export_snapshot_parquet_result()
+
+        assert result["rows"] == 6
+        assert result["storage_mode"] == "memory-fallback"
+        parquet = gcs_client.parquet()
+        assert parquet.metadata.num_row_groups == 2
+        row = parquet.read().to_pylist()[0]
+        assert row["Precio Gasolina 95 E5"] == "1,500"
+        assert row["Horario_parsed"]["siempre_abierto"] is True
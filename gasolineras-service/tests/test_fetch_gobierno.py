@@ -1,8 +1,20 @@
 """Tests para el parser de la API del ministerio."""
 
+import hashlib
+import json
+
+import httpx
 import pytest
 
-from app.services.fetch_gobierno import parse_gasolinera
+from app.services import fetch_gobierno
+from app.services.fetch_gobierno import (
+    UpstreamNotModified,
+    horario_cache_stats,
+    iter_lista_eess,
+    parse_gasolinera,
+    parse_horario,
+    stream_data_gobierno,
+)
 
 
 def test_parse_gasolinera_includes_95_premium_and_diesel_renovable():
@@ -51,3 +63,90 @@ def test_parse_gasolinera_accepts_legacy_gasoleo_premium_key_with_tilde():
 
     assert parsed is not None
     assert parsed["Precio Gasoleo Premium"] == "1,799"
+
+
+def _chunks(text: str, size: int):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_iter_lista_eess_streams_items_across_chunk_boundaries():
+    body = json.dumps(
+        {
+            "Fecha": "17/10/2026 8:45:12",
+            "ListaEESSPrecio": [{"IDEESS": str(i), "Rótulo": "A, \"B\" [C]"} for i in range(50)],
+            "Nota": "Archivo de todos los productos",
+            "ResultadoConsulta": "OK",
+        },
+        ensure_ascii=False,
+        indent=1,
+    )
+    meta = {}
+
+    items = list(iter_lista_eess(_chunks("\ufeff" + body, 7), meta))
+
+    assert [item["IDEESS"] for item in items] == [str(i) for i in range(50)]
+    assert items[0]["Rótulo"] == 'A, "B" [C]'
+    assert meta == {"Fecha": "17/10/2026 8:45:12", "Nota": "Archivo de todos los productos", "ResultadoConsulta": "OK"}
+
+
+def test_iter_lista_eess_rejects_truncated_body():
+    body = '{"Fecha": "x", "ListaEESSPrecio": [{"IDEESS": "1"}, {"IDEESS": "2"'
+
+    with pytest.raises(ValueError):
+        list(iter_lista_eess(_chunks(body, 5)))
+
+
+def _serve(monkeypatch, body: bytes, status_code: int = 200) -> list[dict]:
+    requests = []
+
+    def handler(request):
+        requests.append(dict(request.headers))
+        return httpx.Response(status_code, content=body, headers={"ETag": '"v1"'})
+
+    monkeypatch.setattr(fetch_gobierno, "get_http_client", lambda: httpx.Client(transport=httpx.MockTransport(handler)))
+    return requests
+
+
+def test_same_sha256_is_rejected_before_parsing(monkeypatch):
+    body = json.dumps({"Fecha": "17/10/2026 8:45:12", "ListaEESSPrecio": [{"IDEESS": "1"}]}).encode()
+    _serve(monkeypatch, body)
+    monkeypatch.setattr(fetch_gobierno, "parse_gasolinera", lambda raw: pytest.fail("no debería parsear"))
+    meta = {}
+
+    with pytest.raises(UpstreamNotModified) as exc:
+        stream_data_gobierno(meta, validators={"sha256": hashlib.sha256(body).hexdigest()})
+
+    assert exc.value.reason == "upstream-same-fingerprint"
+    assert meta["etag"] == '"v1"'
+
+
+def test_not_modified_sends_validators_and_changed_body_is_parsed(monkeypatch):
+    requests = _serve(monkeypatch, b"", status_code=304)
+
+    with pytest.raises(UpstreamNotModified) as exc:
+        stream_data_gobierno({}, validators={"etag": '"v1"', "sha256": "old"})
+
+    assert exc.value.reason == "upstream-not-modified"
+    assert requests[0]["if-none-match"] == '"v1"'
+
+    body = json.dumps({"Fecha": "x", "ListaEESSPrecio": [{"IDEESS": "1", "Latitud": "40,4", "Longitud": "-3,7"}]})
+    _serve(monkeypatch, body.encode())
+    meta = {}
+    items = list(stream_data_gobierno(meta, validators={"sha256": "old"}))
+
+    assert [item["IDEESS"] for item in items] == ["1"]
+    assert meta["Fecha"] == "x"
+    assert meta["sha256"] == hashlib.sha256(body.encode()).hexdigest()
+
+
+def test_parse_horario_is_memoized_by_raw_text():
+    before = horario_cache_stats()
+
+    first = parse_horario("L-V: 06:00-22:00; S-D: 08:00-15:00")
+    second = parse_horario("L-V: 06:00-22:00; S-D: 08:00-15:00")
+
+    after = horario_cache_stats()
+    assert second is first
+    assert first["segmentos"][1] == {"dias": [6, 7], "apertura": "08:00", "cierre": "15:00"}
+    assert after["hits"] - before["hits"] >= 1
+    assert parse_horario("   ") is None
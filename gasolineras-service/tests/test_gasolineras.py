@@ -1,9 +1,10 @@
 """
 Tests unitarios para el servicio de gasolineras (PostgreSQL)
 """
+import json
 import pytest
 from contextlib import contextmanager
-from datetime import date
+from datetime import date, datetime, timezone
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 from app.main import app
@@ -294,3 +295,187 @@ class TestHistorial:
             response = client.get("/gasolineras/99999/historial")
 
         assert response.status_code == 404
+
+
+class TestHistorialBulk:
+    """Tests para el historial de varias gasolineras"""
+
+    def test_historial_bulk_columnar_single_query(self):
+        """GET /gasolineras/historial debería devolver series alineadas y consultar la existencia solo de las que faltan"""
+        sync_mock = MagicMock(memory_mode=False, snapshot_stale=False)
+        sync_mock.current_snapshot_version.return_value = None
+        history_repo = MagicMock()
+        history_repo.get_history_bulk.return_value = [
+            {"ideess": "1", "fecha": date(2024, 1, 1), "p95": 1.451, "pa": 1.35},
+            {"ideess": "1", "fecha": date(2024, 1, 3), "p95": 1.46, "pa": None},
+            {"ideess": "2", "fecha": date(2024, 1, 2), "p95": 1.5, "pa": 1.4},
+        ]
+        gas_repo = MagicMock()
+        gas_repo.existing_ids.return_value = {"3"}
+
+        with patch('app.routes.gasolineras._gas_service.sync_service', sync_mock), \
+             patch('app.routes.gasolineras._gas_service.history_repo', history_repo), \
+             patch('app.routes.gasolineras._gas_service.gas_repo', gas_repo):
+            response = client.get(
+                "/gasolineras/historial?ids=1,2&ids=3&ids=4&fecha_desde=2024-01-01&fecha_hasta=2024-01-31"
+            )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["fechas"] == ["2024-01-01", "2024-01-02", "2024-01-03"]
+        assert data["estaciones"]["1"] == {"p95": [1.451, None, 1.46], "pa": [1.35, None, None]}
+        assert data["estaciones"]["2"]["p95"] == [None, 1.5, None]
+        assert data["sin_historial"] == ["3"]
+        assert data["no_encontradas"] == ["4"]
+        history_repo.get_history_bulk.assert_called_once_with(["1", "2", "3", "4"], date(2024, 1, 1), date(2024, 1, 31))
+        gas_repo.existing_ids.assert_called_once_with(["3", "4"])
+
+    def test_historial_bulk_rejects_inverted_range(self):
+        """Un rango con fecha_desde posterior a fecha_hasta debería devolver 422"""
+        response = client.get("/gasolineras/historial?ids=1&fecha_desde=2024-02-01&fecha_hasta=2024-01-01")
+
+        assert response.status_code == 422
+
+
+class TestConditionalRequests:
+    """Tests para ETag / If-None-Match en endpoints de lectura"""
+
+    def test_etag_and_not_modified(self):
+        """Con el mismo snapshot, If-None-Match debería devolver 304 sin recalcular"""
+        stats_payload = {"total_gasolineras": 1, "combustibles": {}}
+
+        with patch('app.routes.gasolineras._sync_service.current_snapshot_version', return_value="postgres:v1"), \
+             patch('app.routes.gasolineras._gas_service.stats', return_value=stats_payload) as mock_stats:
+            first = client.get("/gasolineras/estadisticas?provincia=Madrid")
+            etag = first.headers["ETag"]
+            second = client.get("/gasolineras/estadisticas?provincia=Madrid", headers={"If-None-Match": etag})
+
+        assert first.status_code == 200
+        assert second.status_code == 304
+        assert second.headers["ETag"] == etag
+        assert mock_stats.call_count == 1
+
+    def test_etag_changes_with_snapshot_version_and_params(self):
+        """El ETag debería cambiar con la versión del snapshot y con los parámetros"""
+        with patch('app.routes.gasolineras._gas_service.stats', return_value={}):
+            with patch('app.routes.gasolineras._sync_service.current_snapshot_version', return_value="postgres:v1"):
+                etag_v1 = client.get("/gasolineras/estadisticas").headers["ETag"]
+                etag_params = client.get("/gasolineras/estadisticas?provincia=Lugo").headers["ETag"]
+            with patch('app.routes.gasolineras._sync_service.current_snapshot_version', return_value="postgres:v2"):
+                response_v2 = client.get("/gasolineras/estadisticas", headers={"If-None-Match": etag_v1})
+
+        assert etag_v1 != etag_params
+        assert response_v2.status_code == 200
+        assert response_v2.headers["ETag"] != etag_v1
+
+    def test_markers_post_ignores_if_none_match(self):
+        """POST /markers no debería responder 304 (RFC 9110 solo lo permite en GET/HEAD)"""
+        viewport = {"lat_ne": 40.5, "lon_ne": -3.6, "lat_sw": 40.3, "lon_sw": -3.8, "zoom": 14}
+        with patch('app.routes.gasolineras._sync_service.current_snapshot_version', return_value="postgres:v1"), \
+             patch('app.routes.gasolineras._gas_service.get_markers', return_value={"markers": []}):
+            response = client.post("/gasolineras/markers", json=viewport, headers={"If-None-Match": "*"})
+
+        assert response.status_code == 200
+        assert "ETag" not in response.headers
+
+
+class TestStream:
+    """Tests para la exportación NDJSON en streaming"""
+
+    def test_stream_ndjson_with_projection(self):
+        """Debería devolver una línea JSON por gasolinera con solo los campos pedidos"""
+        from app.services.memory_store import MemoryStore
+        from tests.test_memory_store import _station
+
+        store = MemoryStore()
+        store.replace_snapshot(
+            [_station(str(20000 + i), 40.0 + i / 100, -3.0) for i in range(2500)],
+            datetime(2024, 1, 1, tzinfo=timezone.utc),
+        )
+        sync_mock = MagicMock(memory_mode=True)
+
+        with patch('app.routes.gasolineras._gas_service.sync_service', sync_mock), \
+             patch('app.routes.gasolineras._gas_service.memory_store', store):
+            response = client.get("/gasolineras/stream?campos=IDEESS,Latitud")
+
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert len(lines) == 2500
+        assert lines[0] == {"IDEESS": "20000", "Latitud": 40.0}
+
+    def test_stream_rejects_unknown_fields(self):
+        """Un campo desconocido debería devolver 422"""
+        with patch('app.routes.gasolineras._gas_service.sync_service', MagicMock(memory_mode=True)):
+            response = client.get("/gasolineras/stream?campos=IDEESS,nope")
+
+        assert response.status_code == 422
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        result |= (byte & 0x7F) << shift
+        pos += 1
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_fields(data: bytes) -> list[tuple[int, object]]:
+    """Decodificador protobuf mínimo (varint, 64 bits y longitud delimitada)."""
+    fields, pos = [], 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        else:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.append((number, value))
+    return fields
+
+
+class TestTiles:
+    """Tests para las teselas vectoriales MVT"""
+
+    def _memory_store(self):
+        from app.services.memory_store import MemoryStore
+        from tests.test_memory_store import _station
+
+        store = MemoryStore()
+        store.replace_snapshot(
+            [_station("11111", 40.4168, -3.7038, p95="1,459"), _station("22222", 43.26, -2.93)],
+            datetime(2024, 1, 1, tzinfo=timezone.utc),
+        )
+        return store
+
+    def test_station_tile_in_memory_mode(self):
+        """A zoom alto la tesela debería contener la estación con id y p95"""
+        sync_mock = MagicMock(memory_mode=True)
+        sync_mock.current_snapshot_version.return_value = None
+
+        with patch('app.routes.gasolineras._gas_service.sync_service', sync_mock), \
+             patch('app.routes.gasolineras._gas_service.memory_store', self._memory_store()):
+            response = client.get("/gasolineras/tiles/14/8023/6177.mvt")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/vnd.mapbox-vector-tile"
+        [(layer_field, layer)] = _read_fields(response.content)
+        layer_fields = _read_fields(layer)
+        assert layer_field == 3
+        assert (1, b"gasolineras") in layer_fields
+        assert [value for number, value in layer_fields if number == 3] == [b"id", b"p95"]
+        assert len([value for number, value in layer_fields if number == 2]) == 1
+        assert (4, b"\x0a\x0511111") in layer_fields
+
+    def test_tile_out_of_range(self):
+        """Coordenadas fuera de la rejilla del zoom deberían devolver 422"""
+        with patch('app.routes.gasolineras._gas_service.sync_service', MagicMock(memory_mode=True)):
+            response = client.get("/gasolineras/tiles/2/4/0.mvt")
+
+        assert response.status_code == 422
@@ -0,0 +1,171 @@
+"""Tests del repositorio SQL de gasolineras (cursor psycopg2 simulado)."""
+from datetime import datetime, timezone
+
+from app.repositories.gasolineras_repository import GasolinerasRepository
+
+DB_MODULE = "app.repositories.gasolineras_repository"
+
+
+def _row(ideess: str = "1", rotulo: str = "REPSOL", horario_parsed=None) -> tuple:
+    return (
+        ideess, rotulo, "MADRID", "MADRID", "CALLE 1",
+        1.459, None, None, 1.389, None, None, None,
+        40.4168, -3.7038, "POINT(-3.7038 40.4168)",
+        "L-D: 24H", horario_parsed, b"\xff" * 84,
+        datetime(2024, 1, 1, tzinfo=timezone.utc),
+    )
+
+
+class TestCopyLoad:
+    """Tests para la carga del snapshot con COPY"""
+
+    def test_copy_buffer_escapes_and_drops_wkt(self):
+        """Cada fila debería ir en formato texto de COPY, sin WKT y con \\N para NULL"""
+        row = _row(rotulo="A\tB\\C", horario_parsed={"dias": "L-D"})
+
+        line = GasolinerasRepository._copy_buffer([row]).getvalue()
+        fields = line.rstrip("\n").split("\t")
+
+        assert len(fields) == len(GasolinerasRepository._SNAPSHOT_COLUMNS)
+        assert fields[1] == "A\\tB\\\\C"
+        assert fields[6] == "\\N"
+        assert "POINT(" not in line
+        assert fields[15] == '{"dias": "L-D"}'
+        assert fields[16] == "\\\\x" + "ff" * 84
+
+    def test_replace_snapshot_uses_copy_and_set_wise_geom(self, db_cursor):
+        """El modo copy debería usar COPY FROM STDIN y construir geom con ST_MakePoint"""
+        GasolinerasRepository(load_method="copy").replace_snapshot([_row("1"), _row("2")])
+
+        statements = [call.args[0] for call in db_cursor.execute.call_args_list]
+        copy_sql = db_cursor.copy_expert.call_args.args[0]
+        assert copy_sql.startswith("COPY gasolineras_load")
+        assert any("ST_MakePoint(longitud, latitud)" in sql for sql in statements)
+        assert not any("ST_GeomFromText" in sql for sql in statements)
+
+
+class TestSnapshotSwap:
+    """Tests para el intercambio atómico del snapshot"""
+
+    def test_snapshot_is_built_aside_and_swapped_by_rename(self, db_cursor):
+        """El snapshot debería construirse en gasolineras_next e intercambiarse sin DELETE"""
+        db_cursor.fetchone.side_effect = [{"total": 3}, {}, {"stmt": "COMMENT ON TABLE gasolineras_next IS NULL"}]
+        db_cursor.fetchall.side_effect = [
+            [{"stmt": "GRANT SELECT ON gasolineras_next TO recomendacion"}],
+            [
+                {
+                    "index_name": "gasolineras_pkey",
+                    "indexdef": "CREATE UNIQUE INDEX gasolineras_pkey ON public.gasolineras USING btree (ideess)",
+                    "is_primary": True,
+                }
+            ],
+        ]
+        deleted, inserted = GasolinerasRepository().replace_snapshot([_row("1")])
+
+        statements = [call.args[0].strip() for call in db_cursor.execute.call_args_list]
+        swap = [
+            "ALTER TABLE gasolineras RENAME TO gasolineras_old",
+            "ALTER TABLE gasolineras_next RENAME TO gasolineras",
+            "DROP TABLE gasolineras_old",
+            "ALTER INDEX gasolineras_pkey_next RENAME TO gasolineras_pkey",
+        ]
+        start = statements.index(swap[0])
+
+        assert (deleted, inserted) == (3, 1)
+        assert not any(sql.startswith("DELETE FROM gasolineras") for sql in statements)
+        assert "CREATE TABLE gasolineras_next (LIKE gasolineras INCLUDING ALL EXCLUDING INDEXES)" in statements
+        assert "GRANT SELECT ON gasolineras_next TO recomendacion" in statements[:start]
+        assert "CREATE UNIQUE INDEX gasolineras_pkey_next ON public.gasolineras_next USING btree (ideess)" in statements[:start]
+        assert "ANALYZE gasolineras_next" in statements[:start]
+        assert statements[start:start + 4] == swap
+        assert statements[start + 4] == "RELEASE SAVEPOINT snapshot_swap"
+
+    def test_lock_timeout_retries_and_falls_back_to_in_place_copy(self, db_cursor):
+        """Si un lector retiene la tabla, el RENAME debería reintentarse y acabar copiando en sitio"""
+
+        class LockNotAvailable(Exception):
+            pgcode = "55P03"
+
+        def execute(sql, *args):
+            if sql == "ALTER TABLE gasolineras RENAME TO gasolineras_old":
+                raise LockNotAvailable("canceling statement due to lock timeout")
+
+        repo = GasolinerasRepository()
+        repo.SWAP_RETRY_DELAY_S = 0
+        db_cursor.execute.side_effect = execute
+        db_cursor.fetchone.side_effect = [{"total": 3}, {}, {"stmt": "COMMENT ON TABLE gasolineras_next IS NULL"}]
+        db_cursor.fetchall.side_effect = [[], []]
+        assert repo.replace_snapshot([_row("1")]) == (3, 1)
+
+        statements = [call.args[0].strip() for call in db_cursor.execute.call_args_list]
+        assert statements.count("ROLLBACK TO SAVEPOINT snapshot_swap") == repo.SWAP_ATTEMPTS
+        assert statements[-3:] == [
+            "DELETE FROM gasolineras",
+            "INSERT INTO gasolineras SELECT * FROM gasolineras_next",
+            "DROP TABLE gasolineras_next",
+        ]
+
+    def test_dependent_objects_force_in_place_load(self, db_cursor):
+        """Con vistas, FKs o RLS sobre gasolineras no debería intentarse el RENAME + DROP"""
+        db_cursor.fetchone.side_effect = [{"total": 3}, {"has_views": True}]
+        GasolinerasRepository().replace_snapshot([_row("1")])
+
+        statements = [call.args[0].strip() for call in db_cursor.execute.call_args_list]
+        assert "DELETE FROM gasolineras" in statements
+        assert not any("gasolineras_next" in sql for sql in statements)
+        assert db_cursor.copy_expert.call_args.args[0].startswith("COPY gasolineras_load")
+
+
+class TestIncrementalSync:
+    """Tests para el sync incremental por diferencias"""
+
+    def test_diff_writes_only_distinct_rows_and_reports_counts(self, db_cursor):
+        """Solo deberían escribirse filas distintas y devolverse new/changed/unchanged/removed"""
+        previous = datetime(2024, 1, 1, 6, tzinfo=timezone.utc)
+        db_cursor.fetchone.side_effect = [{"ready": True}, {"last_sync_at": previous}]
+        db_cursor.fetchall.return_value = [{"ideess": "1", "inserted": True}, {"ideess": "2", "inserted": False}]
+        db_cursor.rowcount = 4
+        diff = GasolinerasRepository().apply_snapshot_diff(
+            [_row("1"), _row("2"), _row("3")], datetime(2024, 1, 1, 9, tzinfo=timezone.utc)
+        )
+
+        statements = [call.args[0] for call in db_cursor.execute.call_args_list]
+        upsert = next(sql for sql in statements if "ON CONFLICT (ideess)" in sql)
+        assert "IS DISTINCT FROM" in upsert
+        assert "gasolineras.actualizado_en" not in upsert.split("WHERE")[1]
+        assert not any("gasolineras_next" in sql for sql in statements)
+        assert {k: diff[k] for k in ("new", "changed", "unchanged", "removed")} == {
+            "new": 1, "changed": 1, "unchanged": 1, "removed": 4,
+        }
+        assert diff["written_ids"] == {"1", "2"}
+        assert diff["previous_sync_at"] == previous
+
+    def test_diff_requires_sync_state_table(self, db_cursor):
+        """Sin gasolineras_sync_state debería devolver None para usar el snapshot completo"""
+        db_cursor.fetchone.return_value = {"ready": False}
+        assert GasolinerasRepository().apply_snapshot_diff([_row("1")], datetime.now(timezone.utc)) is None
+
+        assert not db_cursor.copy_expert.called
+
+
+class TestSyncAdvisoryLock:
+    """Tests para el lock distribuido de sync"""
+
+    def test_retries_until_lock_is_free_and_unlocks(self, db_cursor):
+        """Debería reintentar pg_try_advisory_lock y liberar el lock al terminar"""
+        db_cursor.fetchone.side_effect = [{"locked": False}, {"locked": True}, {"unlocked": True}]
+        with GasolinerasRepository().sync_advisory_lock(wait_s=5, poll_s=0) as state:
+            assert state == (True, True)
+
+        statements = [call.args[0] for call in db_cursor.execute.call_args_list]
+        assert statements.count("SELECT pg_try_advisory_lock(%s) AS locked") == 2
+        assert statements[-1] == "SELECT pg_advisory_unlock(%s) AS unlocked"
+
+    def test_failed_unlock_is_logged_as_error(self, caplog, db_cursor):
+        """Si el unlock devuelve false (otro backend tras un pooler) debería registrarse un error"""
+        db_cursor.fetchone.side_effect = [{"locked": True}, {"unlocked": False}]
+        with caplog.at_level("ERROR"):
+            with GasolinerasRepository().sync_advisory_lock(wait_s=0) as state:
+                assert state == (True, False)
+
+        assert "pg_advisory_unlock no liberó el lock de sync" in caplog.text
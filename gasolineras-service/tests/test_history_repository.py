@@ -0,0 +1,100 @@
+"""Tests del repositorio de historico particionado (cursor simulado)."""
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+
+from app.repositories.history_repository import HistoryRepository
+
+DB_MODULE = "app.repositories.history_repository"
+
+
+@pytest.fixture(autouse=True)
+def _no_execute_values():
+    with patch(f"{DB_MODULE}.execute_values"):
+        yield
+
+
+def _partition(name: str, bound: str) -> dict:
+    return {"name": name, "bound": bound}
+
+
+class TestPartitionedHistory:
+    """Tests para la retencion por particiones de precios_historicos"""
+
+    def test_prune_drops_whole_partitions_before_cutoff(self, db_cursor):
+        """Debería separar (CONCURRENTLY) y hacer DROP de las particiones fuera de la retención, sin count(*)"""
+        db_cursor.fetchone.side_effect = [{"partitioned": True}, {"has_default": False}]
+        db_cursor.fetchall.side_effect = [
+            [
+                _partition("precios_historicos_legacy_part", "FOR VALUES FROM (MINVALUE) TO ('2026-09-07')"),
+                _partition("precios_historicos_p20260907", "FOR VALUES FROM ('2026-09-07') TO ('2026-09-14')"),
+                _partition("precios_historicos_p20260914", "FOR VALUES FROM ('2026-09-14') TO ('2026-09-21')"),
+                _partition("precios_historicos_default", "DEFAULT"),
+            ],
+            [
+                {"name": "precios_historicos_legacy_part", "total": 120},
+                {"name": "precios_historicos_p20260907", "total": -1},
+            ],
+        ]
+        dropped = HistoryRepository().prune_before(date(2026, 9, 17))
+
+        statements = [call.args[0] for call in db_cursor.execute.call_args_list]
+        assert dropped == 120
+        detach = "ALTER TABLE precios_historicos DETACH PARTITION precios_historicos_p20260907 CONCURRENTLY"
+        assert statements.index(detach) < statements.index("DROP TABLE precios_historicos_p20260907")
+        assert "DROP TABLE precios_historicos_legacy_part" in statements
+        assert not any("p20260914" in sql and sql.startswith(("DROP", "ALTER")) for sql in statements)
+        assert not any(sql.startswith("DELETE") or "count(*)" in sql for sql in statements)
+
+    def test_prune_with_default_partition_detaches_without_concurrently(self, db_cursor):
+        """Con partición DEFAULT PostgreSQL no admite CONCURRENTLY: debería usarse el DETACH normal"""
+        db_cursor.fetchone.side_effect = [{"partitioned": True}, {"has_default": True}]
+        db_cursor.fetchall.side_effect = [
+            [_partition("precios_historicos_p20260907", "FOR VALUES FROM ('2026-09-07') TO ('2026-09-14')")],
+            [{"name": "precios_historicos_p20260907", "total": 80}],
+        ]
+        assert HistoryRepository().prune_before(date(2026, 9, 17)) == 80
+
+        statements = [call.args[0] for call in db_cursor.execute.call_args_list]
+        assert "ALTER TABLE precios_historicos DETACH PARTITION precios_historicos_p20260907" in statements
+
+    def test_upsert_creates_missing_weekly_partitions_once(self, db_cursor):
+        """Debería crear la semana del upsert y las siguientes solo si no existen"""
+        repo = HistoryRepository()
+        row = ("1", date(2026, 10, 17), 1.5, None, None, None, None, None, None)
+        db_cursor.fetchone.return_value = {"partitioned": True}
+        db_cursor.fetchall.return_value = [
+            _partition("precios_historicos_p20261012", "FOR VALUES FROM ('2026-10-12') TO ('2026-10-19')"),
+        ]
+        repo.upsert_daily_prices([row])
+        repo.upsert_daily_prices([row])
+
+        created = [call.args for call in db_cursor.execute.call_args_list if "PARTITION OF" in call.args[0]]
+        assert [params for _, params in created] == [
+            [date(2026, 10, 19), date(2026, 10, 26)],
+            [date(2026, 10, 26), date(2026, 11, 2)],
+        ]
+        assert "precios_historicos_p20261019" in created[0][0]
+
+    def test_unpartitioned_table_keeps_row_delete(self, db_cursor):
+        """Sin particionar debería mantenerse el DELETE por fecha"""
+        db_cursor.fetchone.return_value = {"partitioned": False}
+        db_cursor.rowcount = 7
+        assert HistoryRepository().prune_before(date(2026, 9, 17)) == 7
+
+        assert db_cursor.execute.call_args_list[-1].args == (
+            "DELETE FROM precios_historicos WHERE fecha < %s",
+            [date(2026, 9, 17)],
+        )
+
+    def test_copy_snapshot_prices_is_one_server_side_insert(self, db_cursor):
+        """El histórico de un día sin datos nuevos debería copiarse de `gasolineras` en una sentencia"""
+        db_cursor.fetchone.return_value = {"partitioned": False}
+        db_cursor.rowcount = 42
+
+        assert HistoryRepository().copy_snapshot_prices(date(2026, 10, 17), {"1"}) == 42
+
+        sql, params = db_cursor.execute.call_args_list[-1].args
+        assert "SELECT ideess, %s, precio_95_e5" in sql and "FROM gasolineras" in sql
+        assert params == [date(2026, 10, 17), ["1"]]
@@ -0,0 +1,60 @@
+"""Tests del bitmap semanal de horarios."""
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app.services.horario_bitmap import BITMAP_BYTES, horario_bitmap, open_mask, slot_for
+
+
+def _is_open(raw: str, weekday: int, hhmm: str) -> bool:
+    hours, minutes = map(int, hhmm.split(":"))
+    slot = (weekday - 1) * 96 + (hours * 60 + minutes) // 15
+    bitmap = np.frombuffer(horario_bitmap(raw), dtype=np.uint8).reshape(1, BITMAP_BYTES)
+    return bool(open_mask(bitmap, slot)[0])
+
+
+def test_segments_by_day_and_hour():
+    raw = "L-V: 07:00-21:30; S: 08:00-14:00"
+
+    assert _is_open(raw, 1, "07:00")
+    assert _is_open(raw, 5, "21:15")
+    assert not _is_open(raw, 5, "21:30")
+    assert not _is_open(raw, 1, "06:45")
+    assert _is_open(raw, 6, "13:59")
+    assert not _is_open(raw, 7, "10:00")
+
+
+def test_overnight_segment_continues_next_day_and_sunday_wraps_to_monday():
+    raw = "D: 22:00-06:00"
+
+    assert _is_open(raw, 7, "23:30")
+    assert _is_open(raw, 1, "05:45")
+    assert not _is_open(raw, 1, "06:00")
+
+
+def test_always_open_and_unknown_schedules():
+    assert horario_bitmap("24H") == b"\xff" * BITMAP_BYTES
+    assert horario_bitmap("SEGÚN TEMPORADA") is None
+    assert horario_bitmap(None) is None
+
+
+def test_bit_layout_matches_postgres_get_bit():
+    """El bit `slot` es el bit `slot % 8` (desde el menos significativo) del byte `slot // 8`"""
+    bitmap = horario_bitmap("L: 00:15-00:30")
+
+    assert bitmap[0] == 0b0000_0010
+    assert not any(bitmap[1:])
+
+
+def test_slot_uses_peninsular_time():
+    # Lunes 2024-01-01 23:10 UTC = martes 00:10 en Madrid (UTC+1).
+    assert slot_for(datetime(2024, 1, 1, 23, 10, tzinfo=timezone.utc)) == 96
+    assert slot_for(datetime(2024, 1, 1, 23, 10)) == 92
+
+
+def test_day_range_with_24h_counts_as_full_days():
+    raw = "L-V: 24H; S: 09:00-14:00"
+
+    assert _is_open(raw, 3, "03:00")
+    assert _is_open(raw, 6, "10:00")
+    assert not _is_open(raw, 7, "10:00")
@@ -0,0 +1,327 @@
+"""Tests del almacen en memoria usado como fallback."""
+import random
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from app.services.geo import haversine_km
+from app.services.memory_store import MemoryStore
+from app.services.price_history import PriceHistoryRing
+from app.services.snapshot_columns import PRICE_COLUMNS
+from app.services.spatial_grid import SpatialGrid
+
+
+def _station(ideess: str, lat: float, lon: float, **extra) -> dict:
+    return {
+        "IDEESS": ideess,
+        "Rótulo": extra.get("rotulo", "TEST"),
+        "Municipio": extra.get("municipio", "MADRID"),
+        "Provincia": extra.get("provincia", "MADRID"),
+        "Dirección": "CALLE TEST 1",
+        "Precio Gasolina 95 E5": extra.get("p95", "1,500"),
+        "Latitud": lat,
+        "Longitud": lon,
+        "Horario": extra.get("horario", "L-D: 07:00-22:00"),
+    }
+
+
+@pytest.fixture
+def store() -> MemoryStore:
+    rng = random.Random(42)
+    datos = [
+        _station(
+            str(10000 + i),
+            rng.uniform(36.0, 43.8),
+            rng.uniform(-9.3, 3.3),
+            p95=f"{rng.uniform(1.3, 1.8):.3f}" if i % 10 else "",
+            provincia=rng.choice(["MADRID", "BIZKAIA", "ARABA/ÁLAVA", "GIPUZKOA"]),
+        )
+        for i in range(2000)
+    ]
+    memory_store = MemoryStore()
+    memory_store.replace_snapshot(datos, datetime(2024, 1, 1, tzinfo=timezone.utc))
+    return memory_store
+
+
+class TestSpatialIndex:
+    """Tests para el indice espacial del snapshot en memoria"""
+
+    def test_bbox_matches_linear_scan(self, store):
+        """La consulta por bbox debería devolver lo mismo que un recorrido completo"""
+        lat_sw, lon_sw, lat_ne, lon_ne = 40.0, -4.5, 41.3, -3.1
+        expected = {
+            row["ideess"]
+            for row in store.iter_rows()
+            if lat_sw <= row["latitud"] <= lat_ne and lon_sw <= row["longitud"] <= lon_ne
+        }
+
+        result = {row["ideess"] for row in store.rows_in_bbox(lat_sw, lon_sw, lat_ne, lon_ne)}
+
+        assert expected
+        assert result == expected
+
+    def test_radius_sorted_by_distance(self, store):
+        """La consulta por radio debería filtrar por haversine y ordenar por distancia"""
+        lat, lon, km = 40.4168, -3.7038, 80
+        expected = {
+            row["ideess"]
+            for row in store.iter_rows()
+            if haversine_km(lat, lon, row["latitud"], row["longitud"]) <= km
+        }
+
+        result = store.rows_within_km(lat, lon, km)
+        distances = [dist for _row, dist in result]
+
+        assert {row["ideess"] for row, _dist in result} == expected
+        assert distances == sorted(distances)
+
+    def test_station_just_inside_radius_across_cell_edge(self):
+        """Una estación a 49,99 km no debería perderse por una caja de búsqueda más pequeña que el radio"""
+        grid = SpatialGrid(np.array([40.50037087]), np.array([-3.05]))
+
+        indices, distances = grid.indices_within_km(40.0508, -3.05, 50.0)
+
+        assert indices.tolist() == [0]
+        assert distances[0] == pytest.approx(haversine_km(40.0508, -3.05, 40.50037087, -3.05))
+
+
+class TestColumnarSnapshot:
+    """Tests para la representación columnar del snapshot"""
+
+    def test_materialized_row_matches_snapshot_row(self):
+        """El dict materializado debería coincidir con to_snapshot_row"""
+        fecha = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        source = _station("55555", 43.25, -2.92, p95="1,565", provincia="BIZKAIA")
+        memory_store = MemoryStore()
+        memory_store.replace_snapshot([source], fecha)
+
+        assert memory_store.row_by_id("55555") == memory_store.to_snapshot_row(source, fecha)
+
+    def test_filter_matches_dict_semantics(self, store):
+        """Los filtros vectorizados deberían replicar el filtrado sobre dicts"""
+        rows = list(store.iter_rows())
+        expected = [
+            row["ideess"]
+            for row in rows
+            if "zka" in row["provincia"].lower()
+            and row["precio_95_e5"] is not None
+            and row["precio_95_e5"] <= 1.5
+        ]
+
+        result = [row["ideess"] for row in store.filter_rows(provincia="ZKA", precio_max=1.5)]
+
+        assert expected
+        assert result == expected
+
+
+class TestIdIndex:
+    """Tests para el índice IDEESS -> fila"""
+
+    def test_row_by_id_accepts_int_and_str(self, store):
+        """row_by_id debería resolver el ID sin importar si llega como str o int"""
+        assert store.row_by_id("10007")["ideess"] == "10007"
+        assert store.row_by_id(10007)["ideess"] == "10007"
+        assert store.row_by_id("99999999") is None
+
+    def test_rows_by_ids_keeps_order_and_skips_unknown(self, store):
+        """rows_by_ids debería respetar el orden pedido y omitir IDs inexistentes"""
+        rows = store.rows_by_ids(["10500", "nope", "10002"])
+
+        assert [row["ideess"] for row in rows] == ["10500", "10002"]
+
+    def test_index_rebuilt_on_replace_snapshot(self, store):
+        """Un nuevo snapshot debería sustituir el índice completo"""
+        store.replace_snapshot([_station("77777", 40.0, -3.0)], datetime(2024, 1, 2, tzinfo=timezone.utc))
+
+        assert store.has_id("77777")
+        assert not store.has_id("10007")
+
+
+class TestKeysetPagination:
+    """Tests para la paginación por cursor en memoria"""
+
+    @pytest.mark.parametrize("order_by", ["ideess", "precio"])
+    def test_pages_are_contiguous_without_overlap(self, store, order_by):
+        """Recorrer todas las páginas debería devolver cada fila filtrada exactamente una vez"""
+        expected = set(store.filter_indices(provincia="MADRID").tolist())
+        seen: list[int] = []
+        after = None
+        while True:
+            total, indices = store.keyset_indices("MADRID", None, None, order_by, after, 150)
+            page = indices[:150].tolist()
+            seen.extend(page)
+            if len(indices) <= 150:
+                break
+            last = store.rows_at([page[-1]])[0]
+            after = (last["precio_95_e5"], last["ideess"]) if order_by == "precio" else (last["ideess"],)
+
+        assert total == len(expected)
+        assert len(seen) == len(set(seen))
+        assert set(seen) == expected
+
+
+class TestClusterPyramid:
+    """Tests para la pirámide de clusters precalculada"""
+
+    def test_level_matches_snap_to_grid_aggregation(self, store):
+        """Cada nivel debería agregar igual que ST_SnapToGrid + representante más barato"""
+        grid_size = 0.45
+        expected: dict[tuple, list] = {}
+        for row in store.iter_rows():
+            key = (round(row["latitud"] / grid_size), round(row["longitud"] / grid_size))
+            expected.setdefault(key, []).append(row)
+
+        level = store.columns.clusters.level(grid_size)
+        positions = level.cells_in_bbox(-90, -180, 90, 180)
+        result = {
+            (float(level.lat[pos]), float(level.lon[pos])): int(level.count[pos]) for pos in positions.tolist()
+        }
+
+        assert sum(result.values()) == store.count()
+        for rows in expected.values():
+            priced = [r for r in rows if r["precio_95_e5"] is not None]
+            cheapest = min(priced, key=lambda r: r["precio_95_e5"]) if priced else None
+            if cheapest is not None:
+                assert result[(cheapest["latitud"], cheapest["longitud"])] == len(rows)
+
+    def test_cells_in_bbox_only_returns_visible_representatives(self, store):
+        """Solo deberían devolverse celdas cuyo representante cae dentro del viewport"""
+        level = store.columns.clusters.level(0.12)
+        positions = level.cells_in_bbox(40.0, -4.5, 41.3, -3.1)
+
+        assert positions.size
+        assert ((level.lat[positions] >= 40.0) & (level.lat[positions] <= 41.3)).all()
+        assert ((level.lon[positions] >= -4.5) & (level.lon[positions] <= -3.1)).all()
+        assert (level.count[positions][:-1] >= level.count[positions][1:]).all()
+
+
+class TestOpenFilter:
+    """Tests para el filtro por horario (bitmap semanal)"""
+
+    def test_filter_and_radius_use_weekly_bitmap(self):
+        """Solo deberían devolverse las estaciones abiertas en el cuarto de hora pedido"""
+        memory_store = MemoryStore()
+        memory_store.replace_snapshot(
+            [
+                _station("1", 40.40, -3.70, horario="L-D: 24H"),
+                _station("2", 40.41, -3.70, horario="L-V: 07:00-15:00"),
+                _station("3", 40.42, -3.70, horario="S-D: 09:00-14:00"),
+                _station("4", 40.43, -3.70, horario="CONSULTAR"),
+            ],
+            datetime(2024, 1, 1, tzinfo=timezone.utc),
+        )
+        lunes_10h = 10 * 4
+        domingo_20h = 6 * 96 + 20 * 4
+
+        lunes = memory_store.rows_at(memory_store.filter_indices(abierta_slot=lunes_10h))
+        cerca = memory_store.rows_within_km(40.40, -3.70, 10, abierta_slot=domingo_20h)
+
+        assert [row["ideess"] for row in lunes] == ["1", "2"]
+        assert [row["ideess"] for row, _dist in cerca] == ["1"]
+        assert memory_store.filter_indices().size == 4
+
+
+class TestPriceHistory:
+    """Tests para el histórico en memoria como ring buffer"""
+
+    def _sync_day(self, store: MemoryStore, day: datetime, p95: str, retention_days: int = 3) -> None:
+        store.replace_snapshot([_station("1", 40.0, -3.0, p95=p95), _station("2", 41.0, -2.0)], day)
+        store.update_history(day, retention_days)
+
+    def test_daily_append_and_range_slice(self):
+        """Cada sync debería añadir un día y el rango debería devolverse en orden cronológico"""
+        store = MemoryStore()
+        start = datetime(2026, 10, 1, 12, tzinfo=timezone.utc)
+        for offset, p95 in enumerate(["1,401", "1,402", "1,403"]):
+            self._sync_day(store, start + timedelta(days=offset), p95)
+        # Reescribir el mismo día sustituye el valor en lugar de duplicar la fila.
+        self._sync_day(store, start + timedelta(days=2), "1,499")
+
+        rows = store.history_by_id("1", date(2026, 10, 2), date(2026, 10, 31))
+
+        assert [(row["fecha"], row["p95"]) for row in rows] == [(date(2026, 10, 2), 1.402), (date(2026, 10, 3), 1.499)]
+        assert rows[0]["pa"] is None
+        assert store.history.values.dtype.name == "float32"
+
+    def test_retention_overwrites_oldest_day(self):
+        """Con retención de 3 días, el cuarto día debería expulsar al primero"""
+        store = MemoryStore()
+        start = datetime(2026, 10, 1, 12, tzinfo=timezone.utc)
+        for offset in range(4):
+            self._sync_day(store, start + timedelta(days=offset), "1,400")
+
+        fechas = [row["fecha"] for row in store.history_by_id("2", date(2026, 9, 1), date(2026, 10, 31))]
+
+        assert fechas == [date(2026, 10, 2), date(2026, 10, 3), date(2026, 10, 4)]
+        assert store.history.values.shape[2] == 3
+
+    def test_resize_keeps_most_recent_days(self):
+        """Reducir la retención debería conservar los días más recientes"""
+        store = MemoryStore()
+        start = datetime(2026, 10, 1, 12, tzinfo=timezone.utc)
+        for offset in range(3):
+            self._sync_day(store, start + timedelta(days=offset), "1,400")
+        store.history.resize(2)
+
+        series = store.history_by_ids(["1", "2", "desconocida"], date(2026, 9, 1), date(2026, 10, 31))
+
+        assert set(series) == {"1", "2"}
+        assert [row["fecha"] for row in series["1"]] == [date(2026, 10, 2), date(2026, 10, 3)]
+
+    def test_append_writes_day_in_place_and_drops_departed_stations(self):
+        """Añadir un día no debería copiar la matriz y las estaciones sin datos en la ventana deberían salir"""
+        ring = PriceHistoryRing(3)
+        start = date(2026, 10, 1)
+        ids = ["1", "2"]
+        ring.append_day(start, ids, {column: np.array([1.5, 1.6]) for column in PRICE_COLUMNS})
+        values = ring.values
+
+        for offset in range(1, 4):
+            ring.append_day(start + timedelta(days=offset), ["1"], {column: np.array([1.5]) for column in PRICE_COLUMNS})
+            if offset < 3:
+                assert ring.values is values
+                assert "2" in ring.rows
+
+        assert list(ring.rows) == ["1"]
+        assert ring.series(["2"], start, start + timedelta(days=3)) == {}
+        assert len(ring.series(["1"], start, start + timedelta(days=3))["1"]) == 3
+
+    def test_reads_during_sync_see_complete_days(self):
+        """Leer mientras otro hilo añade días y cambia la retención no debería fallar ni perder días"""
+        ring = PriceHistoryRing(5)
+        ids = [str(i) for i in range(500)]
+        prices = {column: np.full(len(ids), 1.5) for column in PRICE_COLUMNS}
+        start = date(2026, 1, 1)
+        ring.append_day(start, ids, prices)
+        stop = threading.Event()
+        errors = []
+
+        def sync():
+            offset = 0
+            while not stop.is_set():
+                offset += 1
+                ring.resize(5 + offset % 3)
+                # Cada día trae estaciones nuevas: fuerza también el crecimiento de filas.
+                day_ids = ids + [f"n{offset}-{i}" for i in range(50)]
+                ring.append_day(start + timedelta(days=offset), day_ids, {c: np.full(len(day_ids), 1.5) for c in prices})
+
+        writer = threading.Thread(target=sync)
+        writer.start()
+        try:
+            for _ in range(300):
+                try:
+                    series = ring.series(["0", "499"], date(2025, 1, 1), date(2030, 1, 1))
+                except Exception as exc:  # pragma: no cover - es justo lo que se comprueba
+                    errors.append(exc)
+                    break
+                # El día más reciente publicado siempre está completo para todas las estaciones.
+                latest = {ideess: rows[-1]["fecha"] for ideess, rows in series.items()}
+                assert len(set(latest.values())) == 1
+                assert all(rows[-1]["p95"] == 1.5 for rows in series.values())
+        finally:
+            stop.set()
+            writer.join()
+
+        assert errors == []
@@ -0,0 +1,88 @@
+"""Tests de estadísticas de precios (semántica percentile_disc)."""
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from app.services.gasolinera_service import GasolineraService
+from app.services.memory_store import MemoryStore
+from app.services.price_stats import price_stats, price_stats_from_aggregate
+from app.services.response_cache import ResponseCache
+from tests.test_memory_store import _station
+
+
+class TestPriceStats:
+    """Tests para el cálculo de estadísticas por combustible"""
+
+    def test_percentiles_follow_percentile_disc(self):
+        """Los percentiles deberían ser valores reales de la muestra, como percentile_disc"""
+        values = np.array([1.4, np.nan, 1.1, 0.0, 1.3, 1.2])
+
+        result = price_stats(values)
+
+        assert result == {
+            "min": 1.1,
+            "max": 1.4,
+            "media": 1.25,
+            "mediana": 1.2,
+            "p25": 1.1,
+            "p75": 1.3,
+            "total_muestras": 4,
+        }
+
+    def test_aggregate_row_matches_numpy(self):
+        """Una fila agregada de PostgreSQL debería producir el mismo formato que NumPy"""
+        row = {
+            "precio_95_e5_n": 4,
+            "precio_95_e5_min": 1.1,
+            "precio_95_e5_max": 1.4,
+            "precio_95_e5_avg": 1.25,
+            "precio_95_e5_pct": [1.1, 1.2, 1.3],
+        }
+
+        result = price_stats_from_aggregate(row)
+
+        assert result == {"gasolina_95": price_stats(np.array([1.1, 1.2, 1.3, 1.4]))}
+
+    def test_precomputed_province_stats_match_live(self):
+        """Las estadísticas precalculadas por provincia deberían coincidir con el cálculo en vivo"""
+        store = MemoryStore()
+        store.replace_snapshot(
+            [
+                _station(str(i), 40.0, -3.0, p95=f"1,{400 + i}", provincia=("BIZKAIA", "MADRID", "LUGO")[i % 3])
+                for i in range(90)
+            ],
+            datetime(2024, 1, 1, tzinfo=timezone.utc),
+        )
+        sync_mock = MagicMock(memory_mode=True)
+        sync_mock.current_snapshot_version.return_value = "memory-fallback:v1"
+        service = GasolineraService(sync_mock, MagicMock(), MagicMock(), store, 30)
+
+        precomputed = service._stats("bizkaia", None)
+        sync_mock.current_snapshot_version.return_value = None
+        live = service._stats("bizkaia", None)
+
+        assert precomputed["total_gasolineras"] == live["total_gasolineras"] > 0
+        assert precomputed["combustibles"] == live["combustibles"]
+
+    def test_cached_stats_get_a_fresh_timestamp(self):
+        """El timestamp no debería cachearse: cada respuesta lleva la hora en que se sirve"""
+        store = MemoryStore()
+        store.replace_snapshot(
+            [_station(str(i), 40.0, -3.0, p95=f"1,{400 + i}") for i in range(5)],
+            datetime(2024, 1, 1, tzinfo=timezone.utc),
+        )
+        sync_mock = MagicMock(memory_mode=True, snapshot_stale=False)
+        sync_mock.current_snapshot_version.return_value = "memory-fallback:v1"
+        service = GasolineraService(
+            sync_mock, MagicMock(), MagicMock(), store, 30, response_cache=ResponseCache(max_entries=8)
+        )
+
+        first = service.stats(None, None)
+        second = service.stats(None, None)
+
+        assert service.response_cache.stats()["hits"] == 1
+        assert "timestamp" in first and "timestamp" in second
+        cached = service._cached("stats", (None, None), lambda: None)
+        assert "timestamp" not in cached
+        assert {k: v for k, v in first.items() if k != "timestamp"} == cached
@@ -0,0 +1,49 @@
+"""Tests para la cache de respuestas ligada a la versión del snapshot."""
+from app.services.response_cache import ResponseCache
+
+
+class TestResponseCache:
+    """Tests de la cache LRU de respuestas"""
+
+    def test_hit_after_first_compute(self):
+        """La segunda lectura con la misma versión no debería recalcular"""
+        cache = ResponseCache(max_entries=4)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {"total": 1}
+
+        first = cache.get_or_compute("v1", ("count",), compute)
+        second = cache.get_or_compute("v1", ("count",), compute)
+
+        assert first is second
+        assert len(calls) == 1
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_new_version_invalidates_everything(self):
+        """Un cambio de versión del snapshot debería vaciar la cache"""
+        cache = ResponseCache(max_entries=4)
+        cache.get_or_compute("v1", ("stats", "MADRID"), lambda: "old")
+
+        value = cache.get_or_compute("v2", ("stats", "MADRID"), lambda: "new")
+
+        assert value == "new"
+        assert cache.stats()["entries"] == 1
+        assert cache.stats()["invalidations"] == 1
+
+    def test_lru_eviction_and_disabled_mode(self):
+        """Debería expulsar la entrada menos usada y no cachear si está desactivada"""
+        cache = ResponseCache(max_entries=2)
+        cache.get_or_compute("v1", ("a",), lambda: 1)
+        cache.get_or_compute("v1", ("b",), lambda: 2)
+        cache.get_or_compute("v1", ("a",), lambda: 1)
+        cache.get_or_compute("v1", ("c",), lambda: 3)
+
+        assert cache.get_or_compute("v1", ("b",), lambda: "recomputed") == "recomputed"
+        assert cache.stats()["evictions"] >= 1
+
+        disabled = ResponseCache(max_entries=0)
+        disabled.get_or_compute("v1", ("a",), lambda: 1)
+        assert disabled.stats()["entries"] == 0
@@ -0,0 +1,39 @@
+"""Tests de los tiempos por etapa del sync y su exposicion como histogramas."""
+import time
+
+from app.services.sync_metrics import Histogram, StageTimings
+
+
+def test_nested_stages_report_exclusive_time():
+    timings = StageTimings()
+
+    def slow_items():
+        for item in range(3):
+            time.sleep(0.01)
+            yield item
+
+    with timings.stage("prepare_rows"):
+        items = list(timings.timed_iter("fetch", slow_items()))
+    timings.count("prepare_rows", len(items))
+
+    summary = timings.summary()
+    assert items == [0, 1, 2]
+    assert summary["timings_ms"]["fetch"] >= 30
+    assert summary["timings_ms"]["prepare_rows"] < summary["timings_ms"]["fetch"]
+    assert summary["timings_ms"]["total"] >= summary["timings_ms"]["fetch"]
+    assert summary["stage_rows"] == {"prepare_rows": 3}
+    assert "fetch" not in summary["peak_rss_mb"]
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("sync_seconds", "Tiempo.", (0.1, 1.0))
+    histogram.observe("fetch", 0.05)
+    histogram.observe("fetch", 0.5)
+    histogram.observe("fetch", 5.0)
+
+    lines = histogram.render()
+
+    assert 'sync_seconds_bucket{stage="fetch",le="0.1"} 1' in lines
+    assert 'sync_seconds_bucket{stage="fetch",le="1.0"} 2' in lines
+    assert 'sync_seconds_bucket{stage="fetch",le="+Inf"} 3' in lines
+    assert 'sync_seconds_count{stage="fetch"} 3' in lines
@@ -0,0 +1,318 @@
+"""Tests del servicio de sincronizacion (modo memoria, cliente del ministerio simulado)."""
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import replace
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from app.clients.gobierno_client import UpstreamNotModified
+from app.config import settings
+from app.services.memory_store import MemoryStore
+from app.services.sync_service import SyncService
+
+
+class FakeGobiernoClient:
+    def __init__(self, fecha: str = "17/10/2026 8:00:00", sha256: str = "abc") -> None:
+        self.fecha = fecha
+        self.sha256 = sha256
+        self.not_modified = False
+        self.validators = []
+        self.parsed = 0
+
+    def iter_gasolineras(self, meta=None, validators=None, timings=None):
+        self.validators.append(validators)
+        if self.not_modified:
+            raise UpstreamNotModified()
+        if validators and validators.get("sha256") == self.sha256:
+            raise UpstreamNotModified("upstream-same-fingerprint")
+        self.parsed += 1
+        yield {
+            "IDEESS": "1",
+            "Rótulo": "TEST",
+            "Precio Gasolina 95 E5": "1,500",
+            "Latitud": 40.4,
+            "Longitud": -3.7,
+            "Horario": "L-D: 24H",
+        }
+        meta.update({"Fecha": self.fecha, "sha256": self.sha256, "etag": '"v1"', "last_modified": None})
+
+
+def _sync_service(client: FakeGobiernoClient, gas_repo=None, **overrides) -> SyncService:
+    return SyncService(
+        settings=replace(settings, **{"force_memory_mode": True, "memory_snapshot_dir": "", **overrides}),
+        gas_repo=gas_repo or MagicMock(),
+        history_repo=MagicMock(),
+        gobierno_client=client,
+        usuarios_client=MagicMock(),
+        memory_store=MemoryStore(),
+    )
+
+
+class TestUpstreamFingerprint:
+    """Tests para evitar re-sincronizar datos del ministerio sin cambios"""
+
+    def test_same_fingerprint_skips_rest_of_sync(self):
+        """Una segunda descarga idéntica no debería reconstruir el snapshot ni avisar a los listeners"""
+        client = FakeGobiernoClient()
+        service = _sync_service(client)
+        listener = MagicMock()
+        service.add_snapshot_listener(listener)
+
+        first = service.perform_sync()
+        columns = service.memory_store.columns
+        second = service.perform_sync()
+
+        assert first["total"] == 1
+        assert {"prepare_rows", "write_snapshot", "history_upsert", "total"} <= set(first["timings_ms"])
+        assert first["stage_rows"]["prepare_rows"] == 1
+        assert "horario_cache" in first and "horario_cache" not in second
+        assert second["synced"] is False
+        assert second["reason"] == "upstream-same-fingerprint"
+        assert service.memory_store.columns is columns
+        assert listener.call_count == 1
+        assert client.validators[1]["etag"] == '"v1"'
+
+    def test_not_modified_and_changed_payload(self):
+        """Un 304 debería conservar el snapshot y una huella distinta debería sincronizar"""
+        client = FakeGobiernoClient()
+        service = _sync_service(client)
+        service.perform_sync()
+
+        client.not_modified = True
+        assert service.perform_sync()["reason"] == "upstream-not-modified"
+
+        client.not_modified = False
+        client.sha256 = "def"
+        assert service.perform_sync()["total"] == 1
+
+    def test_new_day_not_modified_writes_history_without_rewriting_snapshot(self):
+        """En un día nuevo, un 304 debería escribir el histórico del día sin reescribir el snapshot"""
+        client = FakeGobiernoClient()
+        service = _sync_service(client)
+        service.perform_sync()
+        yesterday = service.memory_store.last_sync_at - timedelta(days=1)
+        service.memory_store.last_sync_at = yesterday
+        service._upstream["synced_at"] = yesterday
+        service.memory_store.history = type(service.memory_store.history)(30)
+        service.memory_store.update_history(yesterday, 30)
+        columns = service.memory_store.columns
+
+        client.not_modified = True
+        result = service.perform_sync()
+
+        assert client.validators[-1]["etag"] == '"v1"'
+        assert result["synced"] is True
+        assert result["reason"] == "upstream-not-modified"
+        assert result["snapshot_rewritten"] is False
+        assert result["registros_historicos"] == 1
+        assert service.memory_store.columns is columns
+        assert service.snapshot_stale is False
+        fechas = [row["fecha"] for row in service.memory_store.history_by_id("1", date.min, date.max)]
+        assert fechas == [yesterday.date(), yesterday.date() + timedelta(days=1)]
+
+    def test_new_day_not_modified_in_postgres_copies_history_in_sql(self):
+        """En PostgreSQL, un día nuevo sin cambios debería copiar el histórico en SQL y marcar el sync"""
+        client = FakeGobiernoClient()
+        gas_repo = MagicMock()
+
+        @contextmanager
+        def advisory_lock(wait_s):
+            yield True, False
+
+        gas_repo.sync_advisory_lock = advisory_lock
+        service = _sync_service(client, gas_repo=gas_repo, force_memory_mode=False)
+        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+        service._upstream = {"etag": '"v1"', "last_modified": None, "sha256": "abc",
+                             "storage_mode": "postgres", "synced_at": yesterday}
+        service.history_repo.copy_snapshot_prices.return_value = 12000
+        service.history_repo.prune_before.return_value = 0
+
+        result = service.perform_sync()
+
+        assert result["reason"] == "upstream-same-fingerprint"
+        assert result["registros_historicos"] == 12000
+        service.history_repo.copy_snapshot_prices.assert_called_once()
+        service.history_repo.upsert_daily_prices.assert_not_called()
+        service.gas_repo.apply_snapshot_diff.assert_not_called()
+        service.gas_repo.mark_synced.assert_called_once()
+        assert client.parsed == 0
+
+    def test_same_fingerprint_is_checked_before_parsing(self):
+        """Con el mismo sha256 no debería parsearse ninguna estación"""
+        client = FakeGobiernoClient()
+        service = _sync_service(client)
+        service.perform_sync()
+
+        assert service.perform_sync()["reason"] == "upstream-same-fingerprint"
+        assert client.validators[-1]["sha256"] == "abc"
+        assert client.parsed == 1
+
+
+class TestSingleFlight:
+    """Tests para el sync único entre instancias"""
+
+    def test_busy_lock_serves_current_snapshot(self):
+        """Si otro sync tiene el lock y no se libera a tiempo, no debería descargarse nada"""
+        client = FakeGobiernoClient()
+        service = _sync_service(client, sync_lock_wait_s=0.01)
+        service._flight_lock.acquire()
+        try:
+            result = service.perform_sync(trigger="auto-read:list")
+        finally:
+            service._flight_lock.release()
+
+        assert result["synced"] is False
+        assert result["reason"] == "sync-in-progress"
+        assert client.validators == []
+
+    def test_waiting_instance_skips_when_other_left_current_snapshot(self):
+        """Tras esperar al advisory lock, un snapshot ya vigente no debería volver a sincronizarse"""
+        client = FakeGobiernoClient()
+        gas_repo = MagicMock()
+        gas_repo.get_snapshot_state.return_value = {"total": 10, "last_sync_at": datetime.now(timezone.utc)}
+
+        @contextmanager
+        def advisory_lock(wait_s):
+            yield True, True
+
+        gas_repo.sync_advisory_lock = advisory_lock
+        service = _sync_service(client, gas_repo=gas_repo, force_memory_mode=False)
+
+        result = service.perform_sync(trigger="startup")
+
+        assert result["reason"] == "synced-by-other-instance"
+        assert result["storage_mode"] == "postgres"
+        assert client.validators == []
+
+
+class TestBackgroundRefresh:
+    """Tests para el refresco del snapshot fuera del camino de lectura"""
+
+    def test_stale_read_returns_immediately_and_refreshes_once(self):
+        """Una lectura con snapshot de ayer no debería esperar al sync y solo debería lanzarse uno"""
+        release = threading.Event()
+
+        class SlowClient(FakeGobiernoClient):
+            def iter_gasolineras(self, meta=None, validators=None, timings=None):
+                release.wait(timeout=5)
+                yield from super().iter_gasolineras(meta, validators, timings)
+
+        client = SlowClient()
+        service = _sync_service(client, auto_sync_on_read=True, snapshot_refresh_interval_s=0)
+        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+        service.memory_store.replace_snapshot(
+            [{"IDEESS": "1", "Rótulo": "AYER", "Latitud": 40.4, "Longitud": -3.7}], yesterday
+        )
+        try:
+            assert service.maybe_auto_sync_on_read("list") is True
+            assert service.maybe_auto_sync_on_read("markers") is True
+            release.set()
+            for _ in range(100):
+                if not service.snapshot_stale:
+                    break
+                time.sleep(0.05)
+        finally:
+            service.stop_background_refresh()
+
+        assert service.snapshot_stale is False
+        assert len(client.validators) == 1
+
+
+class TestWarmRestart:
+    """Tests para la copia local del snapshot en modo memoria"""
+
+    def test_cold_process_serves_local_copy_and_refreshes_in_background(self, tmp_path):
+        """Un proceso nuevo debería cargar la copia local sin descargar y refrescarla si es de ayer"""
+        writer = _sync_service(FakeGobiernoClient(), memory_snapshot_dir=str(tmp_path))
+        writer.perform_sync()
+        assert (tmp_path / "snapshot.arrow").is_file()
+        assert (tmp_path / "history.arrow").is_file()
+
+        client = FakeGobiernoClient()
+        reader = _sync_service(client, memory_snapshot_dir=str(tmp_path))
+        reader.ensure_memory_snapshot_loaded("list")
+
+        assert reader.memory_store.count() == 1
+        assert reader.memory_store.columns.row(0)["ideess"] == "1"
+        assert [row["p95"] for row in reader.memory_store.history_by_id("1", date.min, date.max)] == [1.5]
+        assert reader.current_snapshot_version() == writer.current_snapshot_version()
+        assert client.validators == []
+
+    def test_history_from_another_snapshot_is_ignored(self, tmp_path):
+        """Un history.arrow de otro sync (caída entre los dos renombrados) no debería cargarse"""
+        old_dir, new_dir = tmp_path / "old", tmp_path / "new"
+        writer = _sync_service(FakeGobiernoClient(), memory_snapshot_dir=str(old_dir))
+        writer.perform_sync()
+        writer.memory_store.last_sync_at += timedelta(hours=1)
+        writer.memory_store.save(str(new_dir))
+        (new_dir / "history.arrow").replace(old_dir / "history.arrow")
+
+        store = MemoryStore()
+
+        assert store.load(str(old_dir)) is True
+        assert store.count() == 1
+        assert len(store.history) == 0
+        assert sorted(path.name for path in old_dir.iterdir()) == ["history.arrow", "snapshot.arrow"]
+
+
+    def test_load_rebuilds_columns_from_arrow_arrays(self, tmp_path, monkeypatch):
+        """Al cargar, las columnas deberían salir de los arrays Arrow sin reconstruir filas"""
+        writer = _sync_service(FakeGobiernoClient(), memory_snapshot_dir=str(tmp_path))
+        writer.perform_sync()
+        saved = writer.memory_store.columns
+        store = MemoryStore()
+
+        def no_rows(*args, **kwargs):
+            raise AssertionError("la carga no debería pasar por dicts de fila")
+
+        monkeypatch.setattr("app.services.snapshot_columns.SnapshotColumns.__init__", no_rows)
+
+        assert store.load(str(tmp_path)) is True
+        loaded = store.columns
+        assert loaded.categories["rotulo"].values == saved.categories["rotulo"].values
+        np.testing.assert_array_equal(loaded.categories["rotulo"].codes, saved.categories["rotulo"].codes)
+        np.testing.assert_array_equal(loaded.horario_bits, saved.horario_bits)
+        np.testing.assert_array_equal(loaded.prices["precio_98_e5"], saved.prices["precio_98_e5"])
+        assert loaded.row(0) == saved.row(0)
+
+
+class TestSnapshotVersion:
+    """Tests para la versión del snapshot compartida entre réplicas"""
+
+    def test_postgres_version_is_reread_after_ttl(self):
+        """Pasado el TTL la versión debería releerse de la BD para ver los sync de otras réplicas"""
+        gas_repo = MagicMock()
+        gas_repo.get_snapshot_state.side_effect = [
+            {"total": 1, "last_sync_at": datetime(2026, 10, 17, 6, tzinfo=timezone.utc)},
+            {"total": 1, "last_sync_at": datetime(2026, 10, 17, 9, tzinfo=timezone.utc)},
+        ]
+        service = _sync_service(FakeGobiernoClient(), gas_repo=gas_repo, force_memory_mode=False,
+                                snapshot_version_ttl_s=60)
+
+        first = service.current_snapshot_version()
+        assert service.current_snapshot_version() == first
+        assert gas_repo.get_snapshot_state.call_count == 1
+
+        service._snapshot_version_checked_at -= 61
+        second = service.current_snapshot_version()
+
+        assert second != first
+        assert second.endswith("09:00:00+00:00")
+
+    def test_failed_reread_keeps_known_version(self):
+        """Si la BD falla al releer, debería conservarse la última versión conocida"""
+        gas_repo = MagicMock()
+        gas_repo.get_snapshot_state.side_effect = [
+            {"total": 1, "last_sync_at": datetime(2026, 10, 17, 6, tzinfo=timezone.utc)},
+            RuntimeError("db down"),
+        ]
+        service = _sync_service(FakeGobiernoClient(), gas_repo=gas_repo, force_memory_mode=False,
+                                snapshot_version_ttl_s=0)
+
+        first = service.current_snapshot_version()
+
+        assert first is not None
+        assert service.current_snapshot_version() == first
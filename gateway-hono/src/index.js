@@ -596,6 +596,19 @@ app.post("/api/routing/matrix", proxyRouting);
 // ========================================
 // 🔀 PROXY: MICROSERVICIO DE GASOLINERAS
 // ========================================
+const CACHE_HEADER_NAMES = ["etag", "cache-control"];
+
+function pickCacheHeaders(response) {
+  const picked = {};
+  for (const name of CACHE_HEADER_NAMES) {
+    const value = response.headers.get(name);
+    if (value) {
+      picked[name] = value;
+    }
+  }
+  return picked;
+}
+
 app.all("/api/gasolineras/*", async (c) => {
   try {
     const gasPath = c.req.path.replace('/api/gasolineras', '');
@@ -645,14 +658,26 @@ app.all("/api/gasolineras/*", async (c) => {
 
     const response = await fetchWithCloudRunAuth(url, options);
     const contentType = response.headers.get("content-type");
+    const cacheHeaders = pickCacheHeaders(response);
+
+    // Revalidación con ETag: reenviar el 304 sin cuerpo.
+    if (response.status === 304) {
+      return c.body(null, 304, cacheHeaders);
+    }
+
+    // NDJSON (/stream) y teselas MVT (/tiles): reenviar el cuerpo tal cual, sin bufferizar
+    // ni decodificar como texto (las teselas son binarias).
+    if (contentType?.includes("application/x-ndjson") || contentType?.includes("application/vnd.mapbox-vector-tile")) {
+      return c.body(response.body, response.status, { "content-type": contentType, ...cacheHeaders });
+    }
 
     if (contentType?.includes("application/json")) {
       const data = await response.json();
-      return c.json(data, response.status);
+      return c.json(data, response.status, cacheHeaders);
     }
 
     const text = await response.text();
-    return c.text(text, response.status);
+    return c.text(text, response.status, cacheHeaders);
   } catch (error) {
     console.error("Error en proxy de gasolineras:", error);
     return c.json(
@@ -675,9 +700,14 @@ app.get("/api/gasolineras", async (c) => {
     const url = `${GASOLINERAS_SERVICE}/gasolineras${queryString ? '?' + queryString : ''}`;
     console.log(`🔄 Proxy gasolineras list: GET ${url}`);
     
-    const response = await fetchWithCloudRunAuth(url);
+    const ifNoneMatch = c.req.header("If-None-Match");
+    const response = await fetchWithCloudRunAuth(url, ifNoneMatch ? { headers: { "If-None-Match": ifNoneMatch } } : undefined);
+    const cacheHeaders = pickCacheHeaders(response);
+    if (response.status === 304) {
+      return c.body(null, 304, cacheHeaders);
+    }
     const data = await response.json();
-    return c.json(data);
+    return c.json(data, response.status, cacheHeaders);
   } catch (error) {
     console.error("Error al obtener gasolineras:", error);
     return c.json(